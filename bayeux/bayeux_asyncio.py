@@ -0,0 +1,757 @@
+"""asyncio implementation of the bayeux client.
+
+Needs Python 3.7 or later. Unlike BayeuxClient it does not use Twisted or
+threads: everything runs on the asyncio event loop the client is started
+on, so no state is locked and many clients can share one loop.
+"""
+import asyncio
+import codecs
+import itertools
+import ssl
+from urllib.parse import urlsplit
+
+from zope.interface import implementer
+
+from . import bayeux_constants
+from . import bayeux_stats
+from .bayeux_backoff import Backoff
+from .bayeux_channel_trie import ChannelTrie
+from .bayeux_codec import get_codec
+from .bayeux_errors import (BayeuxError, NoReplyError, PublishError,
+    TransportError)
+from .bayeux_logging import debug_payload, logger
+from .bayeux_message_parser import BayeuxMessageParser
+from .interfaces import IMessengerService
+
+class HttpConnection(object):
+    """A persistent HTTP/1.1 connection that sends one request at a time.
+
+    The connection is opened when the first request is sent and opened
+    again if the server closes it.
+
+    Attributes:
+        host: The server host
+        port: The server port
+        path: The path requests are posted to
+        ssl: SSL context for https servers, None for http
+        headers: Extra headers sent with every request
+        cookies: Cookies shared by every connection of a client, by name
+        reader: The stream the response is read from
+        writer: The stream the request is written to
+    """
+    def __init__(self, server, headers, cookies):
+        """Initialize the connection.
+
+        Args:
+            server: The bayeux server url
+            headers: Extra headers to send with every request
+            cookies: Dict of cookies to send and update
+        """
+        parts = urlsplit(server)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.ssl = ssl.create_default_context() if (
+            parts.scheme == 'https') else None
+        self.headers = headers
+        self.cookies = cookies
+        self.reader = None
+        self.writer = None
+
+    async def request(self, body, content_type, on_data):
+        """Posts a request and reads the response.
+
+        Args:
+            body: The request body, bytes
+            content_type: The content type of the body
+            on_data: Called with each piece of the response body as it
+                     arrives
+
+        Raises:
+            TransportError: If the server answered with an error status or
+                            a malformed response
+            OSError: If the connection failed
+        """
+        try:
+            await self._request(body, content_type, on_data)
+        except (ValueError, IndexError) as e:
+            self.close()
+            raise TransportError('Malformed response from the server: %s' % e)
+        except BaseException:
+            #The connection is in an unknown state
+            self.close()
+            raise
+
+    async def _request(self, body, content_type, on_data):
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl)
+        lines = ['POST %s HTTP/1.1' % self.path,
+            'Host: %s:%d' % (self.host, self.port),
+            'Content-Type: %s' % content_type,
+            'Content-Length: %d' % len(body)]
+        lines.extend('%s: %s' % header for header in self.headers)
+        if self.cookies:
+            lines.append('Cookie: ' + '; '.join('%s=%s' % cookie
+                for cookie in self.cookies.items()))
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+            + body)
+
+        reader = self.reader
+        status = await reader.readline()
+        if not status:
+            raise TransportError('Connection closed by the server')
+        code = int(status.split()[1])
+        length = None
+        chunked = False
+        close = status.startswith(b'HTTP/1.0')
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            value = value.strip()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = value.lower() == 'chunked'
+            elif name == 'connection':
+                close = value.lower() == 'close'
+            elif name == 'set-cookie':
+                cookie = value.split(';', 1)[0]
+                cookie_name, _, cookie_value = cookie.partition('=')
+                self.cookies[cookie_name.strip()] = cookie_value.strip()
+        if code != 200:
+            #Read the body anyway so the connection can be used again
+            on_data = lambda data: None
+        if chunked:
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    #Skip any trailers
+                    while (await reader.readline()).strip():
+                        pass
+                    break
+                on_data(await reader.readexactly(size))
+                await reader.readexactly(2)
+        elif length is not None:
+            while length > 0:
+                data = await reader.read(min(length, 65536))
+                if not data:
+                    raise TransportError('Connection closed by the server')
+                length -= len(data)
+                on_data(data)
+        else:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                on_data(data)
+            close = True
+        if close:
+            self.close()
+        if code != 200:
+            raise TransportError('Server responded with HTTP %d' % code)
+
+    def close(self):
+        """Closes the connection."""
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+@implementer(IMessengerService)
+class AsyncBayeuxClient(object):
+    """Bayeux client for asyncio applications.
+
+    Connects to the server using long-polling over HTTP/1.1. Every method
+    must be called from the event loop the client was started on, and
+    listeners are called on it too. A listener may be a coroutine
+    function, in which case each call is run as a task.
+
+    Messages other than the handshake and connect are gathered into
+    batches the same way as BayeuxClient does it. The connect is held by
+    the server on a connection of its own, and up to max_in_flight
+    batches may be waiting on the server at once, each on its own
+    persistent connection.
+
+    Attributes:
+        server: The bayeux server url
+        codec: Codec used to encode and decode messages
+        listeners: Trie of listeners by channel pattern
+        subscriptions: Channel patterns subscribed to on the server
+        failed_subscriptions: Subscriptions to send again after the next
+                              successful connect
+        replies: Futures waiting for a reply, by message id
+        client_id: The client id from the handshake, None until then
+        advice: The advice last given by the server
+        backoff: Backoff used to delay reconnection attempts
+        started: Whether the client has been started
+        is_handshook: Whether the current session has been handshaken
+        connected: Whether the last connect succeeded
+        queue: (message, future) tuples waiting to be sent
+        idle: Connections free to send a batch on
+        in_flight: Number of batches waiting on the server
+        connection: The connection used for the long-polling connect
+        tasks: Running background tasks
+    """
+    def __init__(self, server, oauth_header=None,
+        batch_window=bayeux_constants.BATCH_WINDOW,
+        max_batch_size=bayeux_constants.MAX_BATCH_SIZE,
+        max_in_flight=bayeux_constants.MAX_IN_FLIGHT,
+        max_pending=bayeux_constants.MAX_PENDING_PUBLISHES,
+        backoff=None, codec=None, stats=False):
+        """Initialize the client.
+
+        Args:
+            server: The remote bayeux server to connect this client to
+                    (e.g. 'http://1.1.1.1:8080/bayeux')
+            oauth_header: if authorization is required, this is the full
+                          header value
+            batch_window: Time in seconds to gather outgoing messages into
+                          a single request
+            max_batch_size: Maximum number of messages sent in one request
+            max_in_flight: Maximum number of batches waiting on the server
+                           at once
+            max_pending: Maximum number of publishes waiting for an
+                         acknowledgement before publish waits for room
+            backoff: The Backoff used to delay reconnection attempts
+            codec: The JSON codec used to encode and decode messages, see
+                   bayeux_codec.get_codec
+            stats: Whether to record counters and histograms of the
+                   client's activity, see stats(). May also be a
+                   BayeuxStats to record into.
+        """
+        self.server = server
+        self.headers = []
+        if oauth_header is not None:
+            self.headers.append(('Authorization', oauth_header))
+        self.cookies = {}
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.backoff = backoff or Backoff()
+        self.codec = get_codec(codec)
+        if isinstance(stats, bayeux_stats.BayeuxStats):
+            self._stats = stats
+        else:
+            self._stats = bayeux_stats.BayeuxStats() if stats else None
+        self.listeners = ChannelTrie()
+        self.subscriptions = set()
+        self.failed_subscriptions = set()
+        self.replies = {}
+        self.msg_id = itertools.count(1)
+        self.client_id = None
+        self.advice = {'reconnect': bayeux_constants.RECONNECT_RETRY}
+        self.connect_interval = 0
+        self.connect_timeout = None
+        self.started = False
+        self.is_handshook = False
+        self.connected = False
+        self.queue = []
+        self.flush_handle = None
+        self.idle = []
+        self.in_flight = 0
+        self.connection = None
+        self.loop = None
+        self.run_task = None
+        self.tasks = set()
+        self.handshook = None
+        self.publish_slots = None
+
+    async def start(self):
+        """Starts the client.
+
+        Handshakes with the server, subscribes to the registered channels
+        and keeps connecting in a background task until stopped. Failed
+        handshakes are retried, so wrap this in asyncio.wait_for to give
+        up after a while.
+
+        Returns once the first handshake has succeeded.
+        """
+        if not self.started:
+            self.started = True
+            self.loop = asyncio.get_running_loop()
+            self.handshook = asyncio.Event()
+            self.publish_slots = asyncio.Semaphore(self.max_pending)
+            self.connection = self._new_connection()
+            self.run_task = self.loop.create_task(self._run())
+        await self.handshook.wait()
+
+    async def stop(self):
+        """Stops the client.
+
+        Stops connecting, sends a disconnect to the server and closes the
+        connections. Anything still waiting for a reply fails with
+        NoReplyError.
+        """
+        if not self.started:
+            return
+        self.started = False
+        self.run_task.cancel()
+        try:
+            await self.run_task
+        except asyncio.CancelledError:
+            pass
+        if self.is_handshook:
+            try:
+                await self._request({
+                    'channel': bayeux_constants.DISCONNECT_CHANNEL},
+                    bayeux_constants.CONNECT_TIMEOUT_MARGIN)
+            except (BayeuxError, OSError, asyncio.TimeoutError) as e:
+                logger.warning('Error sending disconnect: %s', e)
+        self.is_handshook = False
+        self.connected = False
+        self.client_id = None
+        tasks, self.tasks = self.tasks, set()
+        for task in tasks:
+            task.cancel()
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        for _, future in self.queue:
+            if not future.done():
+                future.set_exception(NoReplyError('Client stopped'))
+        self.queue = []
+        for msg_id in list(self.replies):
+            future = self.replies.pop(msg_id)
+            if not future.done():
+                future.set_exception(NoReplyError('Client stopped'))
+        self.connection.close()
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+    async def register(self, id, callback):
+        """Subscribe for a particular event.
+
+        Args:
+            id: The event to subscribe to (e.g. '/foo/bar' or '/foo/*')
+            callback: The callback, or coroutine function, to call with
+                      each message received
+
+        Raises:
+            ValueError: If a wildcard is used anywhere but the last segment
+        """
+        self.listeners.add(id, callback)
+        if id not in self.subscriptions:
+            self.subscriptions.add(id)
+            if self.is_handshook:
+                await self._subscribe(id)
+
+    async def deregister(self, id, callback):
+        """Unsubscribe from a particular event.
+
+        Args:
+            id: The event to unsubscribe from
+            callback: The callback to unsubscribe
+        """
+        if self.listeners.remove(id, callback) == 0 and (
+                id in self.subscriptions):
+            self.subscriptions.discard(id)
+            self.failed_subscriptions.discard(id)
+            if self.is_handshook:
+                try:
+                    await self._send({
+                        'channel': bayeux_constants.UNSUBSCRIBE_CHANNEL,
+                        'subscription': id})
+                except (BayeuxError, OSError, asyncio.TimeoutError) as e:
+                    logger.warning('Error sending unsubscribe request: %s', e)
+
+    async def publish(self, id, data):
+        """Publish data to a particular event.
+
+        Waits while max_pending publishes are waiting for an
+        acknowledgement. Publishes made before the handshake completes
+        are held until it does.
+
+        Args:
+            id: The event to publish to (e.g. '/foo/bar')
+            data: The data to publish
+
+        Returns:
+            The server's acknowledgement
+
+        Raises:
+            BayeuxError: If the client is not started
+            PublishError: If the server rejected the message
+            NoReplyError: If the server did not reply, or the client was
+                          stopped first
+        """
+        if not self.started:
+            raise BayeuxError('Client is not started')
+        message = {'channel': id, 'data': data}
+        debug_payload(id, 'publish: %s', message)
+        async with self.publish_slots:
+            reply = await self._send(message)
+        if not reply.get('successful'):
+            raise PublishError('Publish to %s failed: %s' % (id,
+                reply.get('error')))
+        return reply
+
+    def stats(self):
+        """Returns the client's counters and histograms.
+
+        Returns:
+            A snapshot dict, see BayeuxClient.stats, or None if the client
+            was created without stats
+        """
+        if self._stats is None:
+            return None
+        return self._stats.snapshot()
+
+    async def _run(self):
+        """Handshakes and keeps connecting until the client is stopped."""
+        failures = 0
+        while True:
+            if not self.is_handshook:
+                if not await self._handshake():
+                    self._count_reconnect()
+                    await asyncio.sleep(self.backoff.next())
+                    continue
+            try:
+                reply = await self._connect()
+            except (BayeuxError, OSError, asyncio.TimeoutError) as e:
+                logger.warning('Connect failed: %s', e)
+                self.connected = False
+                self._count_reconnect()
+                failures += 1
+                if failures >= bayeux_constants.CONNECT_FAILURE_THRESHOLD:
+                    #Consider the session lost and start a new one
+                    failures = 0
+                    self.is_handshook = False
+                await asyncio.sleep(self.backoff.next())
+                continue
+            failures = 0
+            self._update_advice(reply)
+            if reply.get('successful'):
+                self.backoff.reset()
+                self.connected = True
+                failed, self.failed_subscriptions = (
+                    self.failed_subscriptions, set())
+                for event in failed & self.subscriptions:
+                    self._spawn(self._subscribe(event))
+                if self.connect_interval:
+                    await asyncio.sleep(self.connect_interval)
+                continue
+            logger.warning('Connect failed: %s', reply.get('error'))
+            self.connected = False
+            reconnect = self.advice.get('reconnect',
+                bayeux_constants.RECONNECT_RETRY)
+            if reconnect == bayeux_constants.RECONNECT_NONE:
+                logger.error('Server advised not to reconnect, stopping client')
+                self.started = False
+                self.is_handshook = False
+                return
+            if reconnect == bayeux_constants.RECONNECT_HANDSHAKE:
+                self.is_handshook = False
+            self._count_reconnect()
+            await asyncio.sleep(max(self.connect_interval,
+                self.backoff.next()))
+
+    async def _handshake(self):
+        """Starts a new session.
+
+        Returns:
+            Whether the handshake succeeded
+        """
+        self.client_id = None
+        self.advice = {'reconnect': bayeux_constants.RECONNECT_RETRY}
+        if self._stats is not None:
+            self._stats.incr(bayeux_stats.HANDSHAKES)
+        message = {
+            'channel': bayeux_constants.HANDSHAKE_CHANNEL,
+            'supportedConnectionTypes': [bayeux_constants.LONG_POLLING],
+            'version': '1.0',
+            'minimumVersion': '1.0'
+            }
+        try:
+            reply = await self._request(message)
+        except (BayeuxError, OSError) as e:
+            logger.warning('Error sending handshake request: %s', e)
+            return False
+        self._update_advice(reply)
+        if not reply.get('successful'):
+            logger.warning('Handshake failed: %s', reply.get('error'))
+            return False
+        self.client_id = reply['clientId']
+        self.is_handshook = True
+        self.failed_subscriptions = set()
+        for event in self.subscriptions:
+            self._spawn(self._subscribe(event))
+        #Send anything that was held waiting for the client id
+        self._flush()
+        self.handshook.set()
+        return True
+
+    async def _connect(self):
+        """Sends a connect request and waits for its reply.
+
+        Returns:
+            The reply
+        """
+        start = self.loop.time()
+        reply = await self._request({
+            'channel': bayeux_constants.CONNECT_CHANNEL,
+            'connectionType': bayeux_constants.LONG_POLLING},
+            self.connect_timeout)
+        if self._stats is not None:
+            self._stats.observe(bayeux_stats.CONNECT_RTT,
+                self.loop.time() - start)
+        return reply
+
+    async def _subscribe(self, event):
+        """Sends a subscribe request, to be sent again if it fails.
+
+        Args:
+            event: The event to subscribe to
+        """
+        try:
+            reply = await self._send({
+                'channel': bayeux_constants.SUBSCRIBE_CHANNEL,
+                'subscription': event})
+        except (BayeuxError, OSError, asyncio.TimeoutError) as e:
+            logger.warning('Error sending subscription request: %s', e)
+            self.failed_subscriptions.add(event)
+            return
+        if not reply.get('successful'):
+            logger.warning('Subscribe to %s failed: %s', event,
+                reply.get('error'))
+
+    def _update_advice(self, reply):
+        """Applies the advice in a reply from the server.
+
+        Args:
+            reply: The reply
+        """
+        advice = reply.get('advice')
+        if not advice:
+            return
+        self.advice.update(advice)
+        if 'interval' in advice:
+            self.connect_interval = int(advice['interval']) / 1000.0
+        if 'timeout' in advice:
+            self.connect_timeout = (int(advice['timeout']) / 1000.0 +
+                bayeux_constants.CONNECT_TIMEOUT_MARGIN)
+
+    def _count_reconnect(self):
+        """Counts a reconnect attempt in the stats, if enabled."""
+        if self._stats is not None:
+            self._stats.incr(bayeux_stats.RECONNECTS)
+
+    def _spawn(self, coro):
+        """Runs a coroutine in a task that is cancelled on stop.
+
+        The loop only keeps weak references to tasks, so they are held
+        here until they finish.
+
+        Returns:
+            The task
+        """
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def _next_id(self):
+        return str(next(self.msg_id))
+
+    def _entry(self, message):
+        """Pairs a message with a future for its reply."""
+        return message, self.loop.create_future()
+
+    async def _request(self, message, timeout=None):
+        """Sends a message on its own on the connect connection.
+
+        Args:
+            message: The message, an id is added to it
+            timeout: Time in seconds to wait for the response, None to wait
+                     as long as it takes
+
+        Returns:
+            The server's reply
+
+        Raises:
+            NoReplyError: If the server did not reply
+        """
+        message['id'] = self._next_id()
+        message, future = entry = self._entry(message)
+        try:
+            await asyncio.wait_for(self._post(self.connection, [entry]),
+                timeout)
+        except BaseException:
+            #_post has failed the future with the same error
+            if not future.cancelled():
+                future.exception()
+            raise
+        return future.result()
+
+    def _send(self, message):
+        """Queues a message to be sent in the next batch.
+
+        Args:
+            message: The message, an id is added to it
+
+        Returns:
+            A future for the server's reply
+
+        Raises:
+            NoReplyError: If the client has been stopped, as nothing would
+                          ever send the message
+        """
+        if not self.started:
+            raise NoReplyError('Client stopped')
+        message['id'] = self._next_id()
+        entry = self._entry(message)
+        if self._stats is not None:
+            self._stats.incr(bayeux_stats.MESSAGES_SENT)
+            self._stats.observe(bayeux_stats.QUEUE_DEPTH, len(self.queue))
+        self.queue.append(entry)
+        if len(self.queue) >= self.max_batch_size:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.batch_window,
+                self._flush)
+        return entry[1]
+
+    def _flush(self):
+        """Sends the queued messages in batches while there is room."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        while (self.queue and self.client_id is not None and
+                self.in_flight < self.max_in_flight):
+            batch = self.queue[:self.max_batch_size]
+            del self.queue[:self.max_batch_size]
+            self.in_flight += 1
+            connection = self.idle.pop() if self.idle else (
+                self._new_connection())
+            self._spawn(self._send_batch(connection, batch))
+
+    async def _send_batch(self, connection, batch):
+        """Sends a batch and returns its connection to the idle list."""
+        try:
+            await self._post(connection, batch)
+        except (BayeuxError, OSError):
+            #The messages have already been failed
+            pass
+        finally:
+            self.in_flight -= 1
+            if self.started:
+                self.idle.append(connection)
+                self._flush()
+            else:
+                connection.close()
+
+    def _new_connection(self):
+        return HttpConnection(self.server, self.headers, self.cookies)
+
+    async def _post(self, connection, entries):
+        """Sends messages to the server in one request.
+
+        Replies are matched to the messages by id as they are parsed.
+        Messages left without a reply fail with NoReplyError, and all of
+        them fail if the request does.
+
+        Args:
+            connection: The HttpConnection to send on
+            entries: List of (message, future) tuples to send
+        """
+        messages = []
+        for message, future in entries:
+            if self.client_id is not None:
+                message['clientId'] = self.client_id
+            self.replies[message['id']] = future
+            messages.append(message)
+        body = self.codec.encode(messages)
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        parser = BayeuxMessageParser(self._dispatch, self.codec, self._stats)
+        size = [0]
+
+        def on_data(data):
+            size[0] += len(data)
+            try:
+                parser.feed(decoder.decode(data))
+            except ValueError as e:
+                logger.error('Error parsing message: %s', e)
+        try:
+            await connection.request(body, self.codec.content_type, on_data)
+        except BaseException as e:
+            error = e
+            if isinstance(e, asyncio.CancelledError):
+                error = NoReplyError('Request cancelled')
+            self._fail(entries, error)
+            raise
+        if not parser.close():
+            logger.error('Response ended with an incomplete message')
+        if self._stats is not None:
+            self._stats.incr(bayeux_stats.RESPONSES)
+            self._stats.observe(bayeux_stats.RESPONSE_BYTES, size[0])
+        self._fail(entries, None)
+
+    def _fail(self, entries, error):
+        """Fails the messages that are still waiting for a reply.
+
+        Args:
+            entries: List of (message, future) tuples
+            error: The exception to fail them with, None for NoReplyError
+        """
+        for message, future in entries:
+            if self.replies.pop(message['id'], None) is not None and (
+                    not future.done()):
+                future.set_exception(error or NoReplyError(
+                    'No reply to message %s' % message['id']))
+
+    def _dispatch(self, msg):
+        """Dispatches a single message received from the server.
+
+        Args:
+            msg: The decoded message
+        """
+        channel = msg.get('channel')
+        if 'successful' in msg:
+            if channel is not None and channel.startswith(
+                    bayeux_constants.META_CHANNEL_PREFIX):
+                self._notify(channel, msg)
+            future = self.replies.pop(msg.get('id'), None)
+            if future is not None and not future.done():
+                future.set_result(msg)
+        elif channel is not None:
+            self._notify(channel, msg)
+
+    def _notify(self, event, data):
+        """Calls the listeners for a message.
+
+        Args:
+            event: The channel the message was received on
+            data: The message
+        """
+        debug_payload(event, 'notify: %s: %s', event, data)
+        stats = self._stats
+        if stats is not None:
+            stats.incr_channel(event, bayeux_stats.RECEIVED)
+        listeners = self.listeners.match(event)
+        if not listeners:
+            return
+        if stats is not None:
+            stats.incr_channel(event, bayeux_stats.DISPATCHED)
+            listeners = [stats.timed(listener) for listener in listeners]
+        for listener in list(listeners):
+            try:
+                result = listener(data)
+                if asyncio.iscoroutine(result):
+                    self._spawn(result).add_done_callback(
+                        _log_listener_error)
+            except Exception:
+                logger.exception('Error in listener for %s', event)
+
+def _log_listener_error(task):
+    """Logs the error, if any, raised by a coroutine listener."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Error in listener', exc_info=task.exception())
@@ -0,0 +1,55 @@
+import random
+
+from . import bayeux_constants
+
+class Backoff(object):
+    """Jittered exponential backoff for reconnection attempts.
+
+    Each call to next returns a delay that doubles (by default) from the
+    initial delay up to the maximum. A random part of each delay, set by
+    jitter, is taken off so that many clients that lost the server at the
+    same moment spread their retries out instead of retrying in lockstep.
+
+    Attributes:
+        initial: Delay in seconds before the first retry
+        maximum: Largest delay in seconds before jitter is applied
+        multiplier: Factor the delay grows by after each attempt
+        jitter: Fraction of each delay, between 0 and 1, that is randomised
+        attempts: Number of delays handed out since the last reset
+    """
+    def __init__(self, initial=bayeux_constants.BACKOFF_INITIAL,
+        maximum=bayeux_constants.BACKOFF_MAX,
+        multiplier=bayeux_constants.BACKOFF_MULTIPLIER,
+        jitter=bayeux_constants.BACKOFF_JITTER):
+        """Initialize the backoff.
+
+        Args:
+            initial: Delay in seconds before the first retry
+            maximum: Largest delay in seconds before jitter is applied
+            multiplier: Factor the delay grows by after each attempt
+            jitter: Fraction of each delay that is randomised. 0 gives
+                    fixed delays, 1 gives delays anywhere from 0 up to the
+                    full delay.
+        """
+        if not 0 <= jitter <= 1:
+            raise ValueError('jitter must be between 0 and 1')
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next(self):
+        """Returns the delay before the next attempt.
+
+        Returns:
+            The delay in seconds
+        """
+        delay = min(self.maximum,
+            self.initial * self.multiplier ** self.attempts)
+        self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        """Starts again from the initial delay after a success."""
+        self.attempts = 0
@@ -0,0 +1,147 @@
+#Wildcard segments, only allowed as the last segment of a pattern
+WILDCARD = '*'
+DEEP_WILDCARD = '**'
+
+class _Node(object):
+    """A node in the channel trie, one per channel segment.
+
+    Attributes:
+        children: Child nodes by segment
+        listeners: Listeners registered for the pattern ending here
+    """
+    __slots__ = ('children', 'listeners')
+
+    def __init__(self):
+        self.children = {}
+        self.listeners = set()
+
+class ChannelTrie(object):
+    """Index of listeners by channel pattern.
+
+    Patterns are either a plain channel (e.g. '/foo/bar'), a channel
+    ending in '*' which matches exactly one more segment (e.g. '/foo/*'
+    matches '/foo/bar' but not '/foo/bar/baz') or a channel ending in '**'
+    which matches one or more segments (e.g. '/foo/**' matches both).
+
+    Patterns are stored in a trie keyed by segment, so finding the
+    listeners for a channel walks one node per segment of the channel no
+    matter how many patterns are registered.
+
+    Attributes:
+        root: The root node of the trie
+    """
+    def __init__(self):
+        """Initialize the trie."""
+        self.root = _Node()
+
+    def add(self, pattern, callback):
+        """Adds a listener for a channel pattern.
+
+        Args:
+            pattern: The channel pattern (e.g. '/foo/*')
+            callback: The listener
+
+        Returns:
+            False if the listener was already registered for the pattern
+
+        Raises:
+            ValueError: If a wildcard is used anywhere but the last segment
+        """
+        segments = _split(pattern)
+        for segment in segments[:-1]:
+            if segment in (WILDCARD, DEEP_WILDCARD):
+                raise ValueError(
+                    'Wildcards are only allowed as the last segment: %s'
+                    % pattern)
+        node = self.root
+        for segment in segments:
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _Node()
+            node = child
+        if callback in node.listeners:
+            return False
+        node.listeners.add(callback)
+        return True
+
+    def remove(self, pattern, callback):
+        """Removes a listener for a channel pattern.
+
+        Args:
+            pattern: The channel pattern
+            callback: The listener
+
+        Returns:
+            The number of listeners remaining for the pattern
+        """
+        path = [self.root]
+        segments = _split(pattern)
+        for segment in segments:
+            node = path[-1].children.get(segment)
+            if node is None:
+                return 0
+            path.append(node)
+        path[-1].listeners.discard(callback)
+        remaining = len(path[-1].listeners)
+        #Prune nodes that no longer lead to any listeners
+        for i in range(len(segments), 0, -1):
+            node = path[i]
+            if node.listeners or node.children:
+                break
+            del path[i - 1].children[segments[i - 1]]
+        return remaining
+
+    def get(self, pattern):
+        """Returns the listeners registered for exactly this pattern.
+
+        Args:
+            pattern: The channel pattern
+
+        Returns:
+            The set of listeners, empty if there are none
+        """
+        node = self.root
+        for segment in _split(pattern):
+            node = node.children.get(segment)
+            if node is None:
+                return set()
+        return node.listeners
+
+    def match(self, channel):
+        """Finds the listeners for every pattern that matches a channel.
+
+        Args:
+            channel: The channel a message was received on (e.g. '/foo/bar')
+
+        Returns:
+            The set of matching listeners. This may be the trie's own set
+            so it must not be modified.
+        """
+        segments = _split(channel)
+        last = len(segments) - 1
+        node = self.root
+        matched = None
+        for i, segment in enumerate(segments):
+            children = node.children
+            if children.get(DEEP_WILDCARD) is not None:
+                matched = _union(matched, children[DEEP_WILDCARD].listeners)
+            if i == last and children.get(WILDCARD) is not None:
+                matched = _union(matched, children[WILDCARD].listeners)
+            node = children.get(segment)
+            if node is None:
+                break
+        else:
+            matched = _union(matched, node.listeners)
+        return matched if matched is not None else set()
+
+def _split(channel):
+    """Splits a channel into its segments."""
+    return channel.strip('/').split('/')
+
+def _union(matched, listeners):
+    """Adds listeners to a match without copying in the common case."""
+    if not listeners:
+        return matched
+    if matched is None:
+        return listeners
+    return matched | listeners
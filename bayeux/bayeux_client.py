@@ -1,14 +1,21 @@
-import bayeux_constants
+from . import bayeux_constants
+from . import bayeux_stats
 import collections
 import json
-import logging
 import zope.interface
-from threading import Timer, Thread, RLock
+from threading import Thread, RLock
 from twisted.internet import reactor
-from bayeux_message_receiver import BayeuxMessageReceiver
-from bayeux_message_sender import BayeuxMessageSender
-
-from interfaces import IMessengerService
+from twisted.python.threadable import isInIOThread
+from .bayeux_backoff import Backoff
+from .bayeux_dedup import BayeuxDedup
+from .bayeux_dispatcher import BatchingListener, ConflatingListener
+from .bayeux_logging import logger
+from .bayeux_message_receiver import BayeuxMessageReceiver
+from .bayeux_message_sender import BayeuxMessageSender
+from .bayeux_replay import BayeuxReplay
+from .bayeux_stats import BayeuxStats
+
+from .interfaces import IMessengerService
 
 class BayeuxClient(object):
     zope.interface.implements(IMessengerService)
@@ -22,53 +29,154 @@ class BayeuxClient(object):
         oauth_header: if authorization is required, this is the full header value
         receiver: The bayeux message receiver
         sender: The bayeux message sender
-        timer: A timer used to retry messaging in cases of errors
+        timer: The delayed call on the reactor for the next connect or
+               handshake retry
         retry_connect_count: Counter for the number of connect retries
         connect_interval: Interval for the connect message in seconds
+        advice: The latest advice from the server
+        backoff: Backoff used to delay reconnection attempts
         is_handshook: Whether or not we have made a successful handshake request
         subscriptions: Set of active subscriptions
+        subscription_batch: Largest number of channels in one subscribe or
+                            unsubscribe message
+        manage_reactor: Whether destroying the client stops the reactor
+        replay: The BayeuxReplay resuming subscriptions, None if disabled
+        dedup: The BayeuxDedup dropping redelivered messages, None if
+               disabled
         lock: Concurrency lock
     """
-    def __init__(self, server, oauth_header=None):
+    def __init__(self, server, oauth_header=None,
+        batch_window=bayeux_constants.BATCH_WINDOW,
+        max_batch_size=bayeux_constants.MAX_BATCH_SIZE,
+        max_in_flight=bayeux_constants.MAX_IN_FLIGHT,
+        max_pending=bayeux_constants.MAX_PENDING_PUBLISHES,
+        use_websocket=True, ws_url=None, dispatcher=None, backoff=None,
+        codec=None, stats=False, pool=None, manage_reactor=True,
+        replay=None, dedup=False, extensions=(), lazy_decode=False,
+        subscription_batch=bayeux_constants.SUBSCRIPTION_BATCH,
+        compression=False):
         """Initialize the client.
 
         Args:
             server: The remote bayeux server to connect this client to
                     (e.g. 'http://1.1.1.1:8080/bayeux')
+            oauth_header: if authorization is required, this is the full
+                          header value
+            batch_window: Time in seconds to gather outgoing messages into
+                          a single request
+            max_batch_size: Maximum number of messages sent in one request
+            max_in_flight: Maximum number of batches waiting on the server
+                           at once
+            max_pending: Maximum number of publishes waiting for an
+                         acknowledgement before publish blocks
+            use_websocket: Whether to use a websocket transport when the
+                           server supports it, falling back to long-polling
+            ws_url: The url to open the websocket on, by default the server
+                    url with a ws or wss scheme
+            dispatcher: How listener callbacks are called, one of the
+                        dispatchers in bayeux_dispatcher. By default they
+                        are called directly on the reactor thread.
+            backoff: The Backoff used to delay reconnection attempts, by
+                     default a jittered exponential backoff starting at
+                     HANDSHAKE_RETRY_INTERVAL
+            codec: The JSON codec used to encode and decode messages, a
+                   name from bayeux_codec ('json', 'ujson' or 'orjson') or
+                   a codec object. The standard json module by default.
+            stats: Whether to record counters and histograms of the
+                   client's activity, see stats(). May also be a
+                   BayeuxStats to record into.
+            pool: A BayeuxConnectionPool to share with other clients, by
+                  default the client has its own
+            manage_reactor: Whether destroy stops the reactor. Clients
+                            sharing the reactor with others, such as those
+                            run by a BayeuxSessionManager, only close their
+                            connections.
+            replay: A BayeuxReplay to resume subscriptions from the last
+                    message received after a new handshake or a restart,
+                    or the path of the file to keep replay ids in. By
+                    default subscriptions start from new messages.
+            dedup: Whether to drop messages that were already received,
+                   such as those a server delivers again after a
+                   reconnect. May also be a BayeuxDedup choosing the
+                   channels, keys and window.
+            extensions: BayeuxExtensions to pass every message sent and
+                        received through, such as an AckExtension, see
+                        add_extension
+            lazy_decode: Whether to decode only the channel, id and other
+                         envelope fields of each message up front. Its
+                         data is decoded the first time a listener reads
+                         it, so messages without listeners are never
+                         decoded in full. See LazyMessage.
+            subscription_batch: Largest number of channels subscribed to
+                                in one message. By default each channel
+                                has a message of its own, the sender
+                                still batches them into few requests.
+                                Above 1 several channels share a message,
+                                as an array, which not every server
+                                accepts.
+            compression: Whether to accept gzip and deflate encoded
+                         long-polling responses, which saves bandwidth
+                         when the server compresses them at some cost in
+                         CPU
         """
         self.server = server
+        self.manage_reactor = manage_reactor
         self.timer = None
         self.retry_connect_count = 0
         self.connect_interval = 0
-        self.receiver = BayeuxMessageReceiver()
+        self.advice = {'reconnect': bayeux_constants.RECONNECT_RETRY}
+        self.backoff = backoff or Backoff()
+        self.receiver = BayeuxMessageReceiver(dispatcher, codec,
+            stats if isinstance(stats, BayeuxStats) else
+            BayeuxStats() if stats else None, lazy_decode)
+        if replay is not None and not isinstance(replay, BayeuxReplay):
+            replay = BayeuxReplay(replay)
+        self.replay = replay
+        self.receiver.replay = replay
+        if dedup and not isinstance(dedup, BayeuxDedup):
+            dedup = BayeuxDedup()
+        self.dedup = dedup or None
+        self.receiver.dedup = self.dedup
+        self.receiver.extensions = tuple(extensions)
         self.is_handshook = False
         self.started = False
         self.destroyed = False
         self.connected = False
         self.subscriptions = set()
+        self.failed_subscriptions = set()
+        self.subscription_batch = subscription_batch
         self.lock = RLock()
         self.oauth_header = oauth_header
-        logging.debug("server: %s, receiver: %s, oauth header: %s", self.server, self.receiver, self.oauth_header)
-        self.sender = BayeuxMessageSender(self.server, self.receiver, self.oauth_header)
+        logger.debug('server: %s, receiver: %s', self.server, self.receiver)
+        self.sender = BayeuxMessageSender(self.server, self.receiver,
+            self.oauth_header, batch_window, max_batch_size, max_in_flight,
+            max_pending, use_websocket, ws_url, pool, compression)
         self.receiver.register(bayeux_constants.HANDSHAKE_CHANNEL,
             self._handshake_cb)
-        logging.debug("registered handshake channel")
+        logger.debug("registered handshake channel")
         self.receiver.register(bayeux_constants.CONNECT_CHANNEL,
             self._connect_cb)
-        logging.debug("registered connect channel")
+        logger.debug("registered connect channel")
         self.receiver.register(bayeux_constants.DISCONNECT_CHANNEL,
             self._disconnect_cb)
-        logging.debug("registered disconnect channel")
+        logger.debug("registered disconnect channel")
 
     def destroy(self):
         """Destroys the client.
 
-        This stops the Twisted Reactor. Once this is called the reactor
-        can no longer be started. Should call this prior to exiting the
-        application.
+        This stops the Twisted Reactor and the dispatcher. Once this is
+        called the reactor can no longer be started. Should call this prior
+        to exiting the application. If the client was created with
+        manage_reactor set to False, the reactor is left running and only
+        the client's connections are closed.
         """
         with self.lock:
             self.destroyed = True
+            self.receiver.stop()
+            if self.receiver.stats is not None:
+                self.receiver.stats.stop()
+            if self.replay is not None:
+                self.replay.close()
             if reactor.running:
                 if self.started and self.connected:
                     #Currently running and connected so issue a disconnect
@@ -79,7 +187,7 @@ class BayeuxClient(object):
                     pass
                 else:
                     #Not connected so just stop reactor
-                    self._stop_reactor()
+                    self._release()
 
     def start(self):
         #TODO Take daemon in as arg
@@ -101,7 +209,7 @@ class BayeuxClient(object):
                         args=(False,))
                     thread.daemon = True
                     thread.start()
-                self.sender.handshake(self._handshake_error)
+                self._handshake()
             #else:
             #    #Client already running
             #    logging.info('Client already running')
@@ -117,37 +225,123 @@ class BayeuxClient(object):
                 self.is_handshook = False
                 self.started = False
                 self.retry_connect_count = 0
-                if self.timer is not None:
-                    self.timer.cancel()
-                    self.timer = None
+                self._cancel_timer()
                 self.sender.disconnect(self._disconnect_error)
+                if self.replay is not None:
+                    self.replay.sync()
             #else:
             #    #Client not running
             #    logging.info('Client not running')
 
-    def register(self, id, callback):
+    def register(self, id, callback, conflate=False):
         """Subscribe for a particular event.
 
+        The event may end in a wildcard segment, '/foo/*' matches any
+        channel directly below '/foo' and '/foo/**' matches any channel
+        below it at any depth.
+
+        With conflate, messages that arrive while the callback has not
+        yet been given an earlier one replace it, so a callback that falls
+        behind only gets the latest message, see ConflatingListener. This
+        needs a dispatcher with worker threads.
+
         Args:
-            id: The event to subscribe to (e.g. '/foo/bar')
+            id: The event to subscribe to (e.g. '/foo/bar' or '/foo/*')
             callback: The callback to trigger upon receipt of the message
+            conflate: True to deliver only the latest message, or the
+                      name of a field of the message data, or a function
+                      of the message, to deliver the latest message for
+                      each of its values
+        """
+        if conflate:
+            callback = ConflatingListener(callback,
+                None if conflate is True else conflate)
+        self._register(id, callback)
+
+    def register_batch(self, id, callback,
+        max_batch=bayeux_constants.MAX_DELIVERY_BATCH,
+        max_delay=bayeux_constants.DELIVERY_BATCH_DELAY):
+        """Subscribe for a particular event, receiving its messages in
+        batches.
+
+        The callback is called with a list of the messages received on a
+        channel, the messages that came in one response or, with a delay,
+        those received within max_delay seconds of the first, so it can
+        handle them in bulk. See BatchingListener.
+
+        Args:
+            id: The event to subscribe to (e.g. '/foo/bar' or '/foo/*')
+            callback: The callback to trigger with each list of messages
+            max_batch: Largest number of messages in one call
+            max_delay: Longest time in seconds a message waits for its
+                       batch
+        """
+        self._register(id, BatchingListener(callback,
+            self.receiver.dispatcher, max_batch, max_delay))
+
+    def _register(self, id, callback):
+        """Registers a listener and subscribes for its event if needed.
+
+        Args:
+            id: The event to subscribe to
+            callback: The listener
+        """
+        self.register_many([id], callback)
+
+    def register_many(self, ids, callback):
+        """Subscribe for several events with the same callback.
+
+        The events not already subscribed to are sent to the server
+        together, up to subscription_batch in each subscribe message.
+
+        Args:
+            ids: The events to subscribe to
+            callback: The callback to trigger upon receipt of the messages
+
+        Raises:
+            ValueError: If an event is malformed, in which case none of
+                        them are registered
         """
         with self.lock:
-            if self.is_handshook:
-                if id not in self.subscriptions:
-                    #Already connected so subscribe for this new event
-                    self.subscriptions.add(id)
-                    if self.started:
-                        self.sender.subscribe(id) #TODO Handle error case
-                else:
-                    #Event already subscribed for so don't need to do anything
-                    pass
-            else:
-                #Not yet connected so just add to our subscription list.
-                #The subscription list will be used to subscribe once we are
-                #connected.
-                self.subscriptions.add(id)
-            self.receiver.register(id, callback)
+            #Register locally first, this rejects malformed patterns
+            ids = list(ids)
+            added = []
+            try:
+                for id in ids:
+                    if self.receiver.register(id, callback):
+                        added.append(id)
+            except ValueError:
+                for id in added:
+                    self.receiver.deregister(id, callback)
+                raise
+            new = set(ids) - self.subscriptions
+            self.subscriptions |= new
+            #Until connected the subscription list is only kept, it is
+            #used to subscribe once the handshake succeeds
+            if new and self.is_handshook and self.started:
+                self._subscribe(new)
+
+    def publish(self, id, data, block=True):
+        """Publish data to a particular event.
+
+        Publishes are batched and pipelined by the sender. Messages
+        published before the handshake completes are held until it does.
+        If too many publishes are waiting for an acknowledgement this
+        blocks until there is room, unless block is False or it is called
+        on the reactor thread, in which case the Deferred fails with
+        QueueFullError.
+
+        Args:
+            id: The event to publish to (e.g. '/foo/bar')
+            data: The data to publish
+            block: Whether to wait for room in the outgoing queue
+
+        Returns:
+            A Deferred that fires with the server's acknowledgement, or
+            fails with PublishError if the server rejected the message.
+            Callbacks run on the reactor thread.
+        """
+        return self.sender.publish(id, data, block=block)
 
     def deregister(self, id, callback):
         """Unsubscribe from a particular event.
@@ -156,13 +350,126 @@ class BayeuxClient(object):
             id: The event to unsubscribe from
             callback: The callback to unsubscribe
         """
+        self.deregister_many([id], callback)
+
+    def deregister_many(self, ids, callback):
+        """Unsubscribe a callback from several events.
+
+        The events left without listeners are unsubscribed from the server
+        together, up to subscription_batch in each unsubscribe message.
+
+        Args:
+            ids: The events to unsubscribe from
+            callback: The callback to unsubscribe
+        """
+        with self.lock:
+            unused = set()
+            for id in ids:
+                if self.receiver.deregister(id, callback) == 0:
+                    #No more listeners for this event to unsubscribe from
+                    #the server
+                    unused.add(id)
+            unused &= self.subscriptions
+            self.subscriptions -= unused
+            if unused and self.started:
+                self._unsubscribe(unused)
+
+    def set_subscriptions(self, desired, callback):
+        """Makes the client subscribed to exactly the given events.
+
+        Events that are not yet subscribed to are registered with the
+        callback, and events that are no longer wanted are unsubscribed
+        along with all of their listeners. Events in both are left alone,
+        so only the difference is sent to the server, in as few messages
+        as subscription_batch allows.
+
+        Args:
+            desired: The events to be subscribed to
+            callback: The callback to register for the new events
+
+        Raises:
+            ValueError: If a new event is malformed, in which case nothing
+                        is changed
+        """
+        desired = set(desired)
+        with self.lock:
+            self.register_many(desired - self.subscriptions, callback)
+            removed = self.subscriptions - desired
+            for id in removed:
+                for listener in list(self.receiver.listeners.get(id)):
+                    self.receiver.deregister(id, listener)
+            self.subscriptions -= removed
+            if removed and self.started:
+                self._unsubscribe(removed)
+
+    def add_extension(self, extension):
+        """Adds an extension that sees every message sent and received.
+
+        Extensions are called in the order they were added, on the
+        reactor thread, see BayeuxExtension.
+
+        Args:
+            extension: The BayeuxExtension
+        """
         with self.lock:
-            if self.receiver.deregister(id, callback) == 0:
-                #No more listeners for this event to unsubscribe from the
-                #server
-                self.subscriptions.remove(id)
-                if self.started:
-                    self.sender.unsubscribe(id)
+            self.receiver.extensions += (extension,)
+
+    def remove_extension(self, extension):
+        """Removes an extension added with add_extension.
+
+        Args:
+            extension: The BayeuxExtension
+        """
+        with self.lock:
+            self.receiver.extensions = tuple(e for e in
+                self.receiver.extensions if e is not extension)
+
+    def stats(self):
+        """Returns the client's counters and histograms.
+
+        Counters are under 'counters' (handshakes, reconnects,
+        messages_sent, responses, bytes_received), messages received and
+        dispatched are under 'channels' by channel along with any
+        duplicates dropped, and the response_bytes, wire_bytes,
+        response_time, read_time, decode_time, callback_time, connect_rtt
+        and queue_depth histograms are under 'histograms'. bytes_received
+        and wire_bytes count bytes as they came over the wire, before any
+        decompression. Times are in seconds. How often the connect and
+        control lanes reused their connections is under 'lanes', see
+        BayeuxMessageSender.lane_stats. With dedup, its hits and misses
+        are under 'dedup'.
+
+        Returns:
+            A snapshot dict, or None if the client was created without
+            stats
+        """
+        if self.receiver.stats is None:
+            return None
+        return self._add_sections(self.receiver.stats.snapshot())
+
+    def _add_sections(self, snapshot):
+        """Adds the sender's lane stats and the dedup counts to a stats
+        snapshot."""
+        snapshot['lanes'] = self.sender.lane_stats()
+        if self.dedup is not None:
+            snapshot['dedup'] = self.dedup.snapshot()
+        return snapshot
+
+    def add_stats_exporter(self, exporter, interval):
+        """Calls an exporter with the stats at a fixed interval.
+
+        Args:
+            exporter: Called on the reactor thread with each snapshot, as
+                      returned by stats()
+            interval: Time in seconds between snapshots
+
+        Raises:
+            ValueError: If the client was created without stats
+        """
+        if self.receiver.stats is None:
+            raise ValueError('Stats are not enabled for this client')
+        self.receiver.stats.add_exporter(
+            lambda snapshot: exporter(self._add_sections(snapshot)), interval)
 
     def _connect_cb(self, data):
         """Callback for the connect message.
@@ -171,56 +478,110 @@ class BayeuxClient(object):
         connect mesasge based on the interval value in the
         connect response message. The connect messsage acts
         as a heartbeat to the bayeux server. If the connect
-        message failed, then try and restart the client again.
+        message failed, then reconnect as the server advises.
 
         Args:
             data: The connect response data
         """
-        logging.debug('_connect_cb: %s' % data)
+        logger.debug('_connect_cb: %s', data)
         with self.lock:
             if self.started:
+                self._update_advice(data)
                 if(data['successful']):
                     self.retry_connect_count = 0
+                    self.backoff.reset()
                     self.connected = True
-                    if('advice' in data and 'interval' in
-                    data['advice'] and
-                    data['advice']['interval']):
-                        #The interval defines how often we need to ping on the
-                        #server with a connect message to keep the connection
-                        #alive
-                        self.connect_interval = int(
-                            data['advice']['interval']) / 1000
-                    self.timer = Timer(self.connect_interval,
-                        self.sender.connect, [self._connect_error])
-                    self.timer.start()
+                    self._schedule(self.connect_interval, self._send_connect)
+                    #Send again any subscribes that failed on the way
+                    failed, self.failed_subscriptions = (
+                        self.failed_subscriptions, set())
+                    failed &= self.subscriptions
+                    if failed:
+                        self._subscribe(failed)
+                else:
+                    logger.warning('Connect failed: %s' % data.get('error'))
+                    self.connected = False
+                    self._reconnect()
 
     def _connect_error(self, reason):
         """Callback if there is an error during the connect request message.
 
         If there was an error sending the connect message, retry a few times
-        before trying to restart the client again.
+        with increasing delays before trying to restart the client again.
 
         Args:
             reason: The reason that the connect failed
         """
-        logging.debug('_connect_error: %s' % reason)
+        logger.debug('_connect_error: %s', reason)
         with self.lock:
             if self.started:
+                self._count_reconnect()
                 self.retry_connect_count += 1
                 self.connected = False
                 if(self.retry_connect_count <
                     bayeux_constants.CONNECT_FAILURE_THRESHOLD):
-                    logging.warning('Trying to reconnect')
-                    self.timer = Timer(self.connect_interval,
-                        self.sender.connect, [self._connect_error])
-                    self.timer.start()
+                    delay = self.backoff.next()
+                    logger.warning('Trying to reconnect in %.1f secs' % delay)
+                    self._schedule(delay, self._send_connect)
                 else:
-                    logging.warning('Failed trying to reconnect...resend handshake request')
+                    logger.warning('Failed trying to reconnect...resend handshake request')
                     #Consider this a failed connection and go back to retrying
                     #handshakes
                     self.is_handshook = False
                     self.retry_connect_count = 0
-                    self.sender.handshake(self._handshake_error)
+                    self._schedule(self.backoff.next(), self._send_handshake)
+
+    def _update_advice(self, data):
+        """Applies the advice in a response from the server.
+
+        Advice stays in effect until the server changes it.
+
+        Args:
+            data: The response data
+        """
+        advice = data.get('advice')
+        if not advice:
+            return
+        self.advice.update(advice)
+        if 'interval' in advice:
+            #The interval defines how often we need to ping on the
+            #server with a connect message to keep the connection
+            #alive
+            self.connect_interval = int(advice['interval']) / 1000.0
+        if 'timeout' in advice:
+            #The server holds connects for up to timeout, so anything much
+            #longer than that means the connection has gone away
+            self.sender.connect_timeout = (int(advice['timeout']) / 1000.0 +
+                bayeux_constants.CONNECT_TIMEOUT_MARGIN)
+        if advice.get('multiple-clients'):
+            logger.warning('Server reports multiple clients sharing this '
+                'connection, polling every %.1f secs' % self.connect_interval)
+
+    def _reconnect(self):
+        """Reconnects after a failed response as the server advises.
+
+        The reconnect advice says whether to retry the connect, start a new
+        session with a handshake, or give up. Retries are delayed by at
+        least the advised interval and by the backoff.
+        """
+        reconnect = self.advice.get('reconnect',
+            bayeux_constants.RECONNECT_RETRY)
+        delay = max(self.connect_interval, self.backoff.next())
+        if reconnect == bayeux_constants.RECONNECT_NONE:
+            logger.error('Server advised not to reconnect, stopping client')
+            self.is_handshook = False
+            self.started = False
+            self._cancel_timer()
+        elif reconnect == bayeux_constants.RECONNECT_HANDSHAKE:
+            logger.warning('Resending handshake in %.1f secs' % delay)
+            self._count_reconnect()
+            self.is_handshook = False
+            self.retry_connect_count = 0
+            self._schedule(delay, self._send_handshake)
+        else:
+            logger.warning('Trying to reconnect in %.1f secs' % delay)
+            self._count_reconnect()
+            self._schedule(delay, self._send_connect)
 
     def _disconnect_cb(self, data):
         """Callback for the disconnect message.
@@ -230,11 +591,11 @@ class BayeuxClient(object):
         Args:
             data: The disconnect response data
         """
-        logging.debug('_disconnect_cb: %s' % data)
+        logger.debug('_disconnect_cb: %s', data)
         with self.lock:
             self.connected = False
             if self.destroyed:
-                self._stop_reactor()
+                self._release()
 
     def _disconnect_error(self, reason):
         """Callback if there is an error during the disconnect
@@ -243,65 +604,209 @@ class BayeuxClient(object):
         Args:
             reason: The reason the disconnect failed
         """
-        logging.debug('_disconnect_error: %s' % reason)
+        logger.debug('_disconnect_error: %s', reason)
         with self.lock:
             self.connected = False
             if self.destroyed:
-                self._stop_reactor()
+                self._release()
 
     def _handshake_cb(self, data):
         """Callback for the handshake message.
 
-        If the callback succeeded, then update the client id in the sender and
-        begin issuing connect requests. If the handshake failed, the resend
-        the handshake request after a given timeout.
+        If the callback succeeded, then pick the transport to use, update the
+        client id in the sender and begin issuing connect requests. If the
+        handshake failed, the resend the handshake request after a given
+        timeout.
 
         Args:
             data: The handshake response data
         """
-        logging.debug('_handshake_cb: %s' % data)
+        logger.debug('_handshake_cb: %s', data)
         with self.lock:
             if self.started and not self.destroyed:
                 if(data['successful']):
+                    #A new session starts with default advice
+                    self.advice = {
+                        'reconnect': bayeux_constants.RECONNECT_RETRY}
+                    self._update_advice(data)
                     self.is_handshook = True
-                    self.sender.set_client_id(
-                        data['clientId'])
-                    self.sender.connect(
-                        self._connect_error)
-                    #On a successful handshake register for pending subscriptions
-                    for event in self.subscriptions:
-                        #TODO Handle error case
-                        self.sender.subscribe(event)
+                    d = self.sender.negotiate(
+                        data.get('supportedConnectionTypes', []))
+                    d.addCallback(self._transport_ready, data['clientId'])
+                    #On a successful handshake register for pending
+                    #subscriptions. These share messages and are batched
+                    #by the sender so they go out in as few requests as
+                    #possible.
+                    self.failed_subscriptions = set()
+                    if self.subscriptions:
+                        self._subscribe(self.subscriptions)
                 else:
-                    #Connect was not successful for some reason, try again
-                    self.is_handshook = False
-                    self.timer = Timer(bayeux_constants.HANDSHAKE_RETRY_INTERVAL,
-                        self.sender.handshake, [self._handshake_error])
-                    self.timer.start()
+                    #Handshake was not successful for some reason, try
+                    #again unless the server advises otherwise
+                    logger.warning('Handshake failed: %s' % data.get('error'))
+                    self._update_advice(data)
+                    if (self.advice.get('reconnect') ==
+                            bayeux_constants.RECONNECT_RETRY):
+                        #Retrying a failed handshake means a new handshake
+                        self.advice['reconnect'] = (
+                            bayeux_constants.RECONNECT_HANDSHAKE)
+                    self._reconnect()
+
+    def _transport_ready(self, connection_type, client_id):
+        """Callback once the transport has been picked after a handshake.
+
+        Releases the messages held for the new session and starts issuing
+        connect requests.
+
+        Args:
+            connection_type: The connection type that will be used
+            client_id: The client id from the handshake response
+        """
+        logger.info('Connected using %s' % connection_type)
+        with self.lock:
+            if self.started and not self.destroyed and self.is_handshook:
+                self.sender.set_client_id(client_id)
+                self.sender.connect(self._connect_error)
 
     def _handshake_error(self, reason):
         """Callback if there is an error during the handshake
         request message.
 
         If there was an error sending the handshake message, then wait and
-        retry the message until we are able to connect.
+        retry the message until we are able to connect. The wait grows with
+        each failure.
 
         Args:
             reason: The reason that the handshake failed
         """
         with self.lock:
             if self.started and not self.destroyed:
-                logging.warning(''.join(['Error sending handshake request',
+                self._count_reconnect()
+                delay = self.backoff.next()
+                logger.warning(''.join(['Error sending handshake request',
                     'message...retrying in ',
-                    str(bayeux_constants.HANDSHAKE_RETRY_INTERVAL),
+                    '%.1f' % delay,
                     ' secs']))
                 self.is_handshook = False
-                self.timer = Timer(bayeux_constants.HANDSHAKE_RETRY_INTERVAL,
-                    self.sender.handshake, [self._handshake_error])
-                self.timer.start()
+                self._schedule(delay, self._send_handshake)
+
+    def _count_reconnect(self):
+        """Counts a reconnect attempt in the stats, if enabled."""
+        if self.receiver.stats is not None:
+            self.receiver.stats.incr(bayeux_stats.RECONNECTS)
+
+    def _subscribe(self, events):
+        """Sends subscribe requests for events, subscription_batch in
+        each message.
+
+        Args:
+            events: The events to subscribe to
+        """
+        for batch in self._batches(events):
+            ext = None
+            if self.replay is not None:
+                ext = self.replay.subscribe_ext(batch)
+            d = self.sender.subscribe(
+                batch[0] if len(batch) == 1 else batch, ext=ext)
+            d.addErrback(self._subscribe_error, batch)
+
+    def _unsubscribe(self, events):
+        """Sends unsubscribe requests for events, subscription_batch in
+        each message.
+
+        Args:
+            events: The events to unsubscribe from
+        """
+        for batch in self._batches(events):
+            self.sender.unsubscribe(batch[0] if len(batch) == 1 else batch,
+                self._subscribe_error)
+
+    def _batches(self, events):
+        """Splits events into lists of at most subscription_batch."""
+        events = list(events)
+        size = max(1, self.subscription_batch)
+        return [events[i:i + size] for i in range(0, len(events), size)]
+
+    def _subscribe_error(self, reason, events=None):
+        """Callback if there is an error during a subscribe or unsubscribe
+        request message.
+
+        A failed subscribe is sent again after the next successful connect
+        or handshake.
+
+        Args:
+            reason: The reason that the request failed
+            events: The events that failed to subscribe, None for an
+                    unsubscribe
+        """
+        logger.warning('Error sending subscription request: %s' %
+            reason.getErrorMessage())
+        if events is not None:
+            with self.lock:
+                self.failed_subscriptions.update(events)
+
+    def _schedule(self, delay, f):
+        """Schedules the next connect or handshake on the reactor.
+
+        Replaces any call that was already scheduled. Must be called on the
+        reactor thread.
+
+        Args:
+            delay: Time in seconds to wait
+            f: The function to call
+        """
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = reactor.callLater(delay, f)
+
+    def _cancel_timer(self):
+        """Cancels the scheduled connect or handshake, if any."""
+        timer, self.timer = self.timer, None
+        if timer is None:
+            return
+
+        def cancel():
+            if timer.active():
+                timer.cancel()
+        if isInIOThread():
+            cancel()
+        else:
+            reactor.callFromThread(cancel)
+
+    def _send_connect(self):
+        """Sends a scheduled connect request if the client is still running."""
+        with self.lock:
+            self.timer = None
+            if self.started:
+                self.sender.connect(self._connect_error)
+
+    def _send_handshake(self):
+        """Sends a scheduled handshake request if the client is still running."""
+        with self.lock:
+            self.timer = None
+            if self.started and not self.destroyed:
+                self._handshake()
+
+    def _handshake(self):
+        """Sends a handshake request, asking for replay if it is enabled."""
+        ext = None
+        if self.replay is not None:
+            ext = self.replay.handshake_ext()
+        self.sender.handshake(self._handshake_error, ext)
+
+    def _release(self):
+        """Lets go of the reactor once the client is destroyed.
+
+        Stops the reactor, or if the client shares it with others just
+        closes the client's connections.
+        """
+        if self.manage_reactor:
+            self._stop_reactor()
+        else:
+            reactor.callFromThread(self.sender.close)
 
     def _stop_reactor(self):
         """Helper method to stop the reactor"""
         if reactor.running:
-            logging.info('Stopping reactor')
+            logger.info('Stopping reactor')
             reactor.callFromThread(reactor.stop)
@@ -0,0 +1,111 @@
+import json
+
+try:
+    string_types = basestring
+except NameError:
+    #Python 3
+    string_types = str
+
+class JsonCodec(object):
+    """Encodes and decodes bayeux messages with the standard json module.
+
+    Output is compact, with no whitespace between items.
+    """
+    name = 'json'
+    content_type = 'application/json'
+
+    def encode(self, messages):
+        """Encodes messages for sending.
+
+        Args:
+            messages: A message dict or list of message dicts
+
+        Returns:
+            The JSON encoded string
+        """
+        return json.dumps(messages, separators=(',', ':'))
+
+    def decode(self, data):
+        """Decodes a JSON string.
+
+        Args:
+            data: The JSON string
+
+        Returns:
+            The decoded message or list of messages
+
+        Raises:
+            ValueError: If the data is not valid JSON
+        """
+        return json.loads(data)
+
+class UJsonCodec(JsonCodec):
+    """Encodes and decodes bayeux messages with ujson."""
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._dumps = ujson.dumps
+        self._loads = ujson.loads
+
+    def encode(self, messages):
+        return self._dumps(messages)
+
+    def decode(self, data):
+        return self._loads(data)
+
+class OrjsonCodec(JsonCodec):
+    """Encodes and decodes bayeux messages with orjson."""
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+
+    def encode(self, messages):
+        return self._dumps(messages)
+
+    def decode(self, data):
+        #orjson.JSONDecodeError is a ValueError
+        return self._loads(data)
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    UJsonCodec.name: UJsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    }
+
+def get_codec(codec=None):
+    """Returns a codec.
+
+    Args:
+        codec: A codec name ('json', 'ujson' or 'orjson'), an object with
+               encode and decode methods, or None for the standard json
+               codec
+
+    Returns:
+        The codec
+
+    Raises:
+        ValueError: If the named codec is unknown
+        ImportError: If the library for the named codec is not installed
+    """
+    if codec is None:
+        return JsonCodec()
+    if isinstance(codec, string_types):
+        if codec not in CODECS:
+            raise ValueError('Unknown codec: %s' % codec)
+        return CODECS[codec]()
+    return codec
+
+def available_codecs():
+    """Returns the names of the codecs that can be used here."""
+    names = []
+    for name, cls in sorted(CODECS.items()):
+        try:
+            cls()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
@@ -0,0 +1,106 @@
+import zlib
+
+from twisted.internet.interfaces import IProtocol
+from twisted.python.components import proxyForInterface
+from twisted.python.failure import Failure
+from twisted.web.client import ContentDecoderAgent, ResponseFailed
+from twisted.web.iweb import IResponse, UNKNOWN_LENGTH
+
+class _DecompressingProtocol(proxyForInterface(IProtocol)):
+    """Wraps the protocol reading a response, decompressing the body as it
+    arrives and passing each decompressed piece straight on.
+
+    The size of the body before decompression is counted in the wrapped
+    protocol's compressed_size.
+
+    Attributes:
+        original: The wrapped protocol
+        response: The original response, to report errors with
+        decompressor: The zlib decompress object, None until the format
+                      of a deflate body is known
+        head: The start of a deflate body, kept until the format is known
+    """
+    def __init__(self, protocol, response, wbits=None):
+        """Initialize the protocol.
+
+        Args:
+            protocol: The protocol to pass the decompressed body to
+            response: The original response
+            wbits: The zlib window bits of the format, None for deflate
+                   with or without the zlib header
+        """
+        self.original = protocol
+        self.response = response
+        self.decompressor = None
+        if wbits is not None:
+            self.decompressor = zlib.decompressobj(wbits)
+        self.head = b''
+        protocol.compressed_size = 0
+
+    def dataReceived(self, data):
+        self.original.compressed_size += len(data)
+        if self.decompressor is None:
+            data = self.head + data
+            if len(data) < 2:
+                self.head = data
+                return
+            self.head = b''
+            #Some servers send deflate without the zlib header
+            header = ord(data[0:1]) << 8 | ord(data[1:2])
+            zlib_header = header % 31 == 0 and header >> 8 & 0x0f == 8
+            self.decompressor = zlib.decompressobj(
+                zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+        try:
+            data = self.decompressor.decompress(data)
+        except zlib.error:
+            raise ResponseFailed([Failure()], self.response)
+        if data:
+            self.original.dataReceived(data)
+
+    def connectionLost(self, reason):
+        try:
+            if self.decompressor is None:
+                #A body too short to tell its format
+                data = (zlib.decompress(self.head, -zlib.MAX_WBITS)
+                    if self.head else b'')
+            else:
+                data = self.decompressor.flush()
+        except zlib.error:
+            raise ResponseFailed([reason, Failure()], self.response)
+        if data:
+            self.original.dataReceived(data)
+        self.original.connectionLost(reason)
+
+class GzipDecoder(proxyForInterface(IResponse)):
+    """A response whose gzip encoded body is decompressed as it is read.
+
+    Attributes:
+        original: The original response
+    """
+    def __init__(self, response):
+        self.original = response
+        self.length = UNKNOWN_LENGTH
+
+    def deliverBody(self, protocol):
+        self.original.deliverBody(_DecompressingProtocol(protocol,
+            self.original, 16 + zlib.MAX_WBITS))
+
+class DeflateDecoder(GzipDecoder):
+    """A response whose deflate encoded body is decompressed as it is
+    read, with or without the zlib header."""
+    def deliverBody(self, protocol):
+        self.original.deliverBody(_DecompressingProtocol(protocol,
+            self.original))
+
+def decoding_agent(agent):
+    """Wraps an agent so its requests accept gzip and deflate encoded
+    responses, which are decompressed as they are read.
+
+    Args:
+        agent: The agent to wrap
+
+    Returns:
+        The wrapping ContentDecoderAgent
+    """
+    return ContentDecoderAgent(agent,
+        [('gzip', GzipDecoder), ('deflate', DeflateDecoder)])
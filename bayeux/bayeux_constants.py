@@ -3,6 +3,46 @@ CONNECT_CHANNEL = '/meta/connect'
 DISCONNECT_CHANNEL = '/meta/disconnect'
 SUBSCRIBE_CHANNEL = '/meta/subscribe'
 UNSUBSCRIBE_CHANNEL = '/meta/unsubscribe'
+META_CHANNEL_PREFIX = '/meta/'
+
+WEBSOCKET = 'websocket'
+LONG_POLLING = 'long-polling'
+CALLBACK_POLLING = 'callback-polling'
+
+RECONNECT_RETRY = 'retry'
+RECONNECT_HANDSHAKE = 'handshake'
+RECONNECT_NONE = 'none'
 
 HANDSHAKE_RETRY_INTERVAL = 5 #Retry interval in seconds for handshake requests
-CONNECT_FAILURE_THRESHOLD = 3 #Number of failed connect requests before reissuing handshakes
\ No newline at end of file
+CONNECT_FAILURE_THRESHOLD = 3 #Number of failed connect requests before reissuing handshakes
+CONNECT_TIMEOUT_MARGIN = 10 #Time in seconds a connect may exceed the advised timeout
+
+BACKOFF_INITIAL = HANDSHAKE_RETRY_INTERVAL #Delay in seconds before the first retry
+BACKOFF_MAX = 120 #Largest delay in seconds between retries
+BACKOFF_MULTIPLIER = 2 #Factor the retry delay grows by after each failure
+BACKOFF_JITTER = 0.5 #Fraction of each retry delay that is randomised
+
+BATCH_WINDOW = 0.01 #Time in seconds to gather outgoing messages into a batch
+MAX_BATCH_SIZE = 100 #Maximum number of messages sent in a single request
+SUBSCRIPTION_BATCH = 1 #Maximum number of channels in one subscribe message
+MAX_IN_FLIGHT = 4 #Maximum number of batches waiting on the server at once
+MAX_PENDING_PUBLISHES = 10000 #Maximum number of unacknowledged publishes
+MAX_CONNECTIONS_PER_HOST = 8 #Maximum number of requests besides connects a shared pool has open to one host
+WEBSOCKET_OPEN_TIMEOUT = 10 #Time in seconds to wait for a websocket to open
+
+REPLAY_SYNC_EVERY = 100 #Replay cursor updates buffered before they are written to disk
+REPLAY_SYNC_INTERVAL = 1 #Longest time in seconds a replay cursor update waits to be written
+REPLAY_COMPACT_LINES = 10000 #Records the replay store may hold before it is rewritten
+
+DEDUP_WINDOW = 300 #Time in seconds a received message is remembered for deduplication
+DEDUP_SIZE = 10000 #Largest number of messages remembered on each channel for deduplication
+
+MAX_DELIVERY_BATCH = 1000 #Largest number of messages passed to a batch listener at once
+DELIVERY_BATCH_DELAY = 0 #Time in seconds a message waits for its batch, 0 for the messages of one response
+
+RELAY_MAX_FRAME = 16 * 1024 * 1024 #Largest frame in bytes sent between a relay and its clients
+RELAY_RECONNECT_MAX = 5 #Longest time in seconds between attempts to reconnect to a relay
+
+SHARDS = 4 #Number of worker processes a sharded client runs
+SHARD_REPLICAS = 100 #Points on the hash ring for each shard
+SHARD_CLOSE_TIMEOUT = 5 #Seconds a closing worker waits for its disconnect
@@ -0,0 +1,136 @@
+import collections
+import time
+
+from . import bayeux_constants
+
+def message_id(msg):
+    """Returns the id of a message, None if it has none."""
+    return msg.get('id')
+
+class DedupWindow(object):
+    """The hashes of the messages recently received on one channel.
+
+    Hashes are kept in the order they arrived, with a set to look them up,
+    and are dropped once they are older than the window or there are more
+    than the window holds.
+
+    Attributes:
+        entries: (time, hash) of each message, oldest first
+        hashes: The hashes in entries
+    """
+    __slots__ = ('entries', 'hashes')
+
+    def __init__(self):
+        self.entries = collections.deque()
+        self.hashes = set()
+
+    def add(self, value, now, expire, size):
+        """Adds a hash unless it is already in the window.
+
+        Args:
+            value: The hash
+            now: The current time
+            expire: Hashes added before this time are dropped
+            size: Largest number of hashes kept
+
+        Returns:
+            True if the hash was already in the window
+        """
+        entries = self.entries
+        while entries and (entries[0][0] < expire or len(entries) >= size):
+            self.hashes.discard(entries.popleft()[1])
+        if value in self.hashes:
+            return True
+        entries.append((now, value))
+        self.hashes.add(value)
+        return False
+
+class BayeuxDedup(object):
+    """Drops messages that have already been received on a channel.
+
+    After a reconnect or a new handshake a server may deliver some
+    messages again. Each channel keeps the hashes of the keys of the
+    messages received on it within the last window seconds, up to size of
+    them, and a message whose key is among them is not passed to the
+    listeners. Only hashes are kept, so memory use does not depend on the
+    size of the keys.
+
+    Attributes:
+        window: Time in seconds a message is remembered
+        size: Largest number of messages remembered on each channel
+        key: Function returning the key of a message, None if it has none
+        keys: Key function by channel for the channels to deduplicate,
+              None to deduplicate every channel with key
+        clock: Function returning the current time
+        windows: The DedupWindow of each channel
+        hits: Number of messages dropped as duplicates
+        misses: Number of messages checked that were new
+    """
+    def __init__(self, window=bayeux_constants.DEDUP_WINDOW,
+        size=bayeux_constants.DEDUP_SIZE, key=message_id, channels=None,
+        clock=time.time):
+        """Initialize the deduplication.
+
+        Args:
+            window: Time in seconds a message is remembered
+            size: Largest number of messages remembered on each channel
+            key: Function returning the key of a message, or None if it
+                 has none and is never a duplicate. The message id by
+                 default.
+            channels: The channels to deduplicate, or a dict of key
+                      functions by channel where None uses key. Every
+                      channel by default.
+            clock: Function returning the current time
+        """
+        self.window = window
+        self.size = size
+        self.key = key
+        if channels is None or isinstance(channels, dict):
+            self.keys = channels
+        else:
+            self.keys = dict.fromkeys(channels)
+        self.clock = clock
+        self.windows = {}
+        self.hits = 0
+        self.misses = 0
+
+    def is_duplicate(self, channel, msg):
+        """Checks a message against those recently received on its channel,
+        and remembers it.
+
+        Must be called on the reactor thread.
+
+        Args:
+            channel: The channel the message was received on
+            msg: The message
+
+        Returns:
+            True if the message was already received
+        """
+        if self.keys is None:
+            key = self.key
+        elif channel in self.keys:
+            key = self.keys[channel] or self.key
+        else:
+            return False
+        value = key(msg)
+        if value is None:
+            return False
+        window = self.windows.get(channel)
+        if window is None:
+            window = self.windows[channel] = DedupWindow()
+        now = self.clock()
+        if window.add(hash(value), now, now - self.window, self.size):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def snapshot(self):
+        """Returns the number of duplicates dropped.
+
+        Returns:
+            A dict with the number of 'hits', messages dropped as
+            duplicates, and 'misses', messages that were new
+        """
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,506 @@
+import collections
+import threading
+
+from twisted.internet import reactor
+from twisted.python.threadable import isInIOThread
+
+from .bayeux_logging import logger
+
+#Overflow policies for a full dispatch queue
+BLOCK = 'block' #Wait for room, holding up the reactor thread
+DROP_OLDEST = 'drop-oldest' #Discard the oldest queued message
+DROP_NEWEST = 'drop-newest' #Discard the message being queued
+
+def _call_listeners(channel, listeners, msg):
+    """Calls each listener with a message, logging any errors.
+
+    Args:
+        channel: The channel the message was received on
+        listeners: The listeners to call
+        msg: The message
+    """
+    for listener in listeners:
+        try:
+            listener(msg)
+        except Exception:
+            logger.exception('Error in listener for %s', channel)
+
+class InlineDispatcher(object):
+    """Calls listeners directly on the reactor thread.
+
+    This is the default. It has the lowest overhead but a slow listener
+    holds up every other channel and the connect loop.
+    """
+    def dispatch(self, channel, listeners, msg):
+        """Calls the listeners for a message.
+
+        Args:
+            channel: The channel the message was received on
+            listeners: The listeners to call
+            msg: The message
+        """
+        _call_listeners(channel, listeners, msg)
+
+    def stop(self):
+        """No Op"""
+        pass
+
+class HeldListener(object):
+    """Base class for listeners that hold messages before delivering them.
+
+    The receiver offers each message to a held listener on the reactor
+    thread before dispatching, and only dispatches it if offer says so.
+    Dispatchers that drop messages tell the listener through dropped, and
+    the receiver closes the listener once it is deregistered. Compares
+    equal to the callback it wraps, so it can be deregistered by the
+    callback.
+
+    Attributes:
+        callback: The listener messages are delivered to
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def __call__(self, msg):
+        self.callback(msg)
+
+    def offer(self, msg):
+        """Holds a message for delivery.
+
+        Args:
+            msg: The message
+
+        Returns:
+            True if the message has to be dispatched to this listener,
+            which by default it always does
+        """
+        return True
+
+    def response_done(self):
+        """Called on the reactor thread once every message of a response
+        from the server has been offered."""
+        pass
+
+    def dropped(self, msg):
+        """Called when a dispatcher discards a message it was given for
+        this listener.
+
+        Args:
+            msg: The message
+        """
+        pass
+
+    def close(self):
+        """Called once the listener is deregistered, to let go of any
+        messages it is holding."""
+        pass
+
+    def __eq__(self, other):
+        if isinstance(other, HeldListener):
+            other = other.callback
+        return self.callback == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.callback)
+
+class ConflatingListener(HeldListener):
+    """Listener that only delivers the latest of the messages waiting for it.
+
+    A message arriving while an earlier one is still waiting to be
+    delivered replaces it, or with a key replaces the waiting message
+    with the same key. A listener that falls behind then gets the latest
+    values at once instead of working through a backlog, and the number
+    of messages held does not grow during a burst. This only makes a
+    difference when listeners are called through a dispatcher with worker
+    threads.
+
+    Attributes:
+        callback: The listener messages are delivered to
+        key: Function returning the key of a message, None to keep only
+             the latest message
+        pending: The messages waiting to be delivered, by key
+        scheduled: Whether a delivery has been dispatched
+        lock: Guards pending and scheduled
+        merged: Number of messages replaced by a later one
+    """
+    def __init__(self, callback, key=None):
+        """Initialize the listener.
+
+        Args:
+            callback: The listener to deliver messages to
+            key: The name of a field of the message data to keep the
+                 latest message for each value of, or a function returning
+                 the key of a message. By default only the latest message
+                 is kept.
+        """
+        if key is not None and not callable(key):
+            key = _data_field(key)
+        HeldListener.__init__(self, callback)
+        self.key = key
+        self.pending = collections.OrderedDict()
+        self.scheduled = False
+        self.lock = threading.Lock()
+        self.merged = 0
+
+    def offer(self, msg):
+        """Holds a message for delivery.
+
+        Args:
+            msg: The message
+
+        Returns:
+            True if a delivery has to be dispatched, False if one already
+            waiting will deliver the message
+        """
+        key = None
+        if self.key is not None:
+            try:
+                key = self.key(msg)
+            except Exception:
+                logger.exception('Error in conflation key for %s',
+                    msg.get('channel'))
+        with self.lock:
+            if self.pending.pop(key, None) is not None:
+                self.merged += 1
+            self.pending[key] = msg
+            if self.scheduled:
+                return False
+            self.scheduled = True
+            return True
+
+    def __call__(self, msg):
+        """Delivers the messages waiting, ignoring the one dispatched."""
+        with self.lock:
+            messages = list(self.pending.values())
+            self.pending.clear()
+            self.scheduled = False
+        for msg in messages:
+            try:
+                self.callback(msg)
+            except Exception:
+                logger.exception('Error in conflating listener')
+
+    def dropped(self, msg):
+        """Lets the next message dispatch a delivery again, as the one
+        that was dispatched will never run. The messages waiting are
+        delivered with it."""
+        with self.lock:
+            self.scheduled = False
+
+class BatchingListener(HeldListener):
+    """Listener that is given the messages on a channel in batches.
+
+    Messages are gathered for each channel and delivered as a list once
+    max_batch of them are waiting or max_delay seconds after the first
+    one. With no delay, a batch holds the messages of a channel that
+    arrived together in one response, or websocket frame, and is
+    delivered once all of it has been read. Batches are delivered through
+    the dispatcher, one call per batch.
+
+    Attributes:
+        dispatcher: The dispatcher batches are delivered through
+        max_batch: Largest number of messages in a batch
+        max_delay: Longest time in seconds a message waits for its batch
+        batches: The messages waiting, by channel
+        calls: The delayed call delivering each waiting batch, by channel,
+               when there is a delay
+        closed: Whether the listener has been deregistered
+    """
+    def __init__(self, callback, dispatcher, max_batch, max_delay):
+        """Initialize the listener.
+
+        Args:
+            callback: Called with a list of messages
+            dispatcher: The dispatcher to deliver batches through
+            max_batch: Largest number of messages in a batch
+            max_delay: Longest time in seconds a message waits for its
+                       batch
+        """
+        HeldListener.__init__(self, callback)
+        self.dispatcher = dispatcher
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = {}
+        self.calls = {}
+        self.closed = False
+
+    def offer(self, msg):
+        """Adds a message to the batch for its channel. Must be called on
+        the reactor thread.
+
+        Returns:
+            False, batches are dispatched by the listener itself
+        """
+        if self.closed:
+            return False
+        channel = msg.get('channel')
+        batch = self.batches.get(channel)
+        if batch is None:
+            batch = self.batches[channel] = []
+            if self.max_delay:
+                self.calls[channel] = reactor.callLater(self.max_delay,
+                    self.flush, channel)
+        batch.append(msg)
+        if len(batch) >= self.max_batch:
+            self.flush(channel)
+        return False
+
+    def flush(self, channel):
+        """Dispatches the batch waiting for a channel, if any.
+
+        Args:
+            channel: The channel
+        """
+        batch = self.batches.pop(channel, None)
+        call = self.calls.pop(channel, None)
+        if call is not None and call.active():
+            call.cancel()
+        if batch and not self.closed:
+            self.dispatcher.dispatch(channel, [self.callback], batch)
+
+    def response_done(self):
+        """Dispatches the batches of the response just read, when there
+        is no delay."""
+        if not self.max_delay:
+            for channel in list(self.batches):
+                self.flush(channel)
+
+    def close(self):
+        """Discards the waiting batches and cancels their delayed calls.
+        May be called from any thread."""
+        self.closed = True
+        if not isInIOThread():
+            reactor.callFromThread(self.close)
+            return
+        for call in self.calls.values():
+            if call.active():
+                call.cancel()
+        self.calls = {}
+        self.batches = {}
+
+def _data_field(name):
+    """Returns a function reading a field of a message's data."""
+    def key(msg):
+        data = msg.get('data')
+        if isinstance(data, dict):
+            return data.get(name)
+        return None
+    return key
+
+class BoundedQueue(object):
+    """Thread safe FIFO queue with a maximum size and an overflow policy.
+
+    Attributes:
+        max_size: Maximum number of queued items
+        overflow: What to do when the queue is full, one of BLOCK,
+                  DROP_OLDEST or DROP_NEWEST
+        items: The queued items
+        condition: Guards the items
+        closed: Whether the queue has been closed
+        dropped: Number of items discarded because the queue was full
+        on_drop: Called with each item discarded, None to just count them
+    """
+    def __init__(self, max_size, overflow=BLOCK, on_drop=None):
+        """Initialize the queue.
+
+        Args:
+            max_size: Maximum number of queued items
+            overflow: What to do when the queue is full
+            on_drop: Optional function called with each item discarded,
+                     outside of the queue's lock
+        """
+        if overflow not in (BLOCK, DROP_OLDEST, DROP_NEWEST):
+            raise ValueError('Unknown overflow policy: %s' % overflow)
+        self.max_size = max_size
+        self.overflow = overflow
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.on_drop = on_drop
+
+    def put(self, item):
+        """Adds an item, applying the overflow policy if the queue is full.
+
+        Args:
+            item: The item to add
+        """
+        discarded = None
+        with self.condition:
+            if len(self.items) >= self.max_size:
+                if self.overflow == DROP_NEWEST:
+                    self.dropped += 1
+                    discarded = item
+                elif self.overflow == DROP_OLDEST:
+                    discarded = self.items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self.items) >= self.max_size and not self.closed:
+                        self.condition.wait()
+            if discarded is not item:
+                self.items.append(item)
+                self.condition.notify_all()
+        if discarded is not None and self.on_drop is not None:
+            self.on_drop(discarded)
+
+    def get(self):
+        """Removes and returns the oldest item, waiting for one if needed.
+
+        Returns:
+            The item, or None once the queue is closed and empty
+        """
+        with self.condition:
+            while not self.items:
+                if self.closed:
+                    return None
+                self.condition.wait()
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        """Closes the queue, waking anything waiting on it."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+class ThreadPoolDispatcher(object):
+    """Calls listeners on a pool of worker threads.
+
+    Messages wait in a single bounded queue shared by all workers, so
+    messages on the same channel may be delivered out of order. Use
+    OrderedDispatcher when per channel order matters.
+
+    Attributes:
+        queue: The queue of messages waiting to be delivered
+        workers: The worker threads
+    """
+    def __init__(self, workers=4, max_queue=10000, overflow=BLOCK):
+        """Initialize the dispatcher and start its workers.
+
+        Args:
+            workers: Number of worker threads
+            max_queue: Maximum number of messages waiting to be delivered
+            overflow: What to do when the queue is full, one of BLOCK,
+                      DROP_OLDEST or DROP_NEWEST
+        """
+        self.queue = BoundedQueue(max_queue, overflow, _dropped)
+        self.workers = [_start_worker(self.queue, 'BayeuxDispatcher-%d' % i)
+            for i in range(workers)]
+
+    @property
+    def dropped(self):
+        """Number of messages discarded because the queue was full."""
+        return self.queue.dropped
+
+    def dispatch(self, channel, listeners, msg):
+        """Queues a message for delivery to its listeners.
+
+        Args:
+            channel: The channel the message was received on
+            listeners: The listeners to call
+            msg: The message
+        """
+        self.queue.put((channel, listeners, msg))
+
+    def stop(self):
+        """Stops the workers once the queued messages are delivered."""
+        self.queue.close()
+
+class OrderedDispatcher(object):
+    """Calls listeners on worker threads, keeping each channel in order.
+
+    Every channel is assigned to one worker by hashing its name, so the
+    messages on a channel are delivered one at a time in the order they
+    were received while different channels are delivered in parallel.
+    Each worker has its own bounded queue.
+
+    Attributes:
+        queues: The queue for each worker
+        workers: The worker threads
+    """
+    def __init__(self, workers=4, max_queue=10000, overflow=BLOCK):
+        """Initialize the dispatcher and start its workers.
+
+        Args:
+            workers: Number of worker threads
+            max_queue: Maximum number of messages waiting for each worker
+            overflow: What to do when a queue is full, one of BLOCK,
+                      DROP_OLDEST or DROP_NEWEST
+        """
+        self.queues = [BoundedQueue(max_queue, overflow, _dropped)
+            for _ in range(workers)]
+        self.workers = [_start_worker(queue, 'BayeuxDispatcher-%d' % i)
+            for i, queue in enumerate(self.queues)]
+
+    @property
+    def dropped(self):
+        """Number of messages discarded because a queue was full."""
+        return sum(queue.dropped for queue in self.queues)
+
+    def queue_for(self, channel):
+        """Returns the queue that delivers messages for a channel.
+
+        Args:
+            channel: The channel
+
+        Returns:
+            The BoundedQueue for the channel
+        """
+        return self.queues[hash(channel) % len(self.queues)]
+
+    def dispatch(self, channel, listeners, msg):
+        """Queues a message for delivery to its listeners.
+
+        Args:
+            channel: The channel the message was received on
+            listeners: The listeners to call
+            msg: The message
+        """
+        self.queue_for(channel).put((channel, listeners, msg))
+
+    def stop(self):
+        """Stops the workers once the queued messages are delivered."""
+        for queue in self.queues:
+            queue.close()
+
+def _dropped(item):
+    """Tells the held listeners of a discarded message that it will not
+    be delivered.
+
+    Args:
+        item: The discarded (channel, listeners, msg) tuple
+    """
+    channel, listeners, msg = item
+    for listener in listeners:
+        #Unwrap listeners timed by BayeuxStats
+        listener = getattr(listener, 'listener', listener)
+        if isinstance(listener, HeldListener):
+            listener.dropped(msg)
+
+def _start_worker(queue, name):
+    """Starts a daemon thread delivering messages from a queue.
+
+    Args:
+        queue: The BoundedQueue to take messages from
+        name: The name of the thread
+
+    Returns:
+        The started thread
+    """
+    def run():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            _call_listeners(*item)
+    thread = threading.Thread(name=name, target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
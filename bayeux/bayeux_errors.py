@@ -0,0 +1,14 @@
+class BayeuxError(Exception):
+    """Base class for errors raised by the bayeux client."""
+
+class NoReplyError(BayeuxError):
+    """Raised when the server did not reply to a message that was sent."""
+
+class PublishError(BayeuxError):
+    """Raised when the server rejects a published message."""
+
+class QueueFullError(BayeuxError):
+    """Raised when too many messages are waiting to be sent."""
+
+class TransportError(BayeuxError):
+    """Raised when a request to the server fails or its connection is lost."""
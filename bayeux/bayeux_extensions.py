@@ -0,0 +1,66 @@
+from . import bayeux_constants
+
+class BayeuxExtension(object):
+    """Base class for extensions that see every message sent and received.
+
+    Extensions are called on the reactor thread, outgoing with each
+    message of a batch just before it is encoded and incoming with each
+    message as soon as it is decoded, before it is matched to its reply
+    or passed to the listeners. They change the messages in place, usually
+    their 'ext' field. Subclasses override the hooks they need.
+    """
+    def outgoing(self, msg):
+        """Called with a message about to be sent.
+
+        Args:
+            msg: The message, including its clientId
+        """
+        pass
+
+    def incoming(self, msg):
+        """Called with a message received from the server.
+
+        Args:
+            msg: The decoded message
+        """
+        pass
+
+class AckExtension(BayeuxExtension):
+    """Acknowledges the messages received with each connect.
+
+    Servers that support the ack extension number the batches of messages
+    they send in connect replies and keep each one queued until the next
+    connect acknowledges it, so messages lost along with a reply are sent
+    again and delivered ones are dropped from the server's queue at once.
+
+    Attributes:
+        enabled: Whether the server agreed to acks in the last handshake
+        batch: The id of the last batch received, sent with the next
+               connect
+    """
+    def __init__(self):
+        self.enabled = False
+        self.batch = 0
+
+    def outgoing(self, msg):
+        channel = msg['channel']
+        if channel == bayeux_constants.HANDSHAKE_CHANNEL:
+            #A new session numbers its batches from the start
+            self.enabled = False
+            self.batch = 0
+            msg.setdefault('ext', {})['ack'] = True
+        elif channel == bayeux_constants.CONNECT_CHANNEL and self.enabled:
+            msg.setdefault('ext', {})['ack'] = self.batch
+
+    def incoming(self, msg):
+        channel = msg.get('channel')
+        ext = msg.get('ext')
+        if channel == bayeux_constants.HANDSHAKE_CHANNEL:
+            self.enabled = bool(msg.get('successful') and ext and
+                ext.get('ack') is True)
+        elif (channel == bayeux_constants.CONNECT_CHANNEL and self.enabled and
+                msg.get('successful') and ext):
+            batch = ext.get('ack')
+            #bool is an int too, but only a batch id is a number here
+            if isinstance(batch, (int, long)) and not isinstance(batch, bool):
+                self.batch = batch
@@ -0,0 +1,79 @@
+import logging
+
+#Logger used by every module in the package. Messages propagate to the
+#root logger, so logging.basicConfig still shows them.
+logger = logging.getLogger('bayeux')
+
+class PayloadSampler(object):
+    """Decides which debug logs of message payloads are written.
+
+    Payload logs on busy channels can cost more than handling the messages
+    themselves, so each channel can log only every nth payload, or none.
+
+    Attributes:
+        every: Log every nth payload on channels without their own
+               setting, 0 to log none
+        channels: Per channel settings, by channel
+        counts: Payloads seen so far, by channel
+    """
+    def __init__(self, every=1):
+        """Initialize the sampler.
+
+        Args:
+            every: Log every nth payload, 0 to log none
+        """
+        self.every = every
+        self.channels = {}
+        self.counts = {}
+
+    def set(self, every, channel=None):
+        """Changes how often payloads are logged.
+
+        Args:
+            every: Log every nth payload, 0 to log none
+            channel: The channel to change, None to change the default
+        """
+        if channel is None:
+            self.every = every
+        else:
+            self.channels[channel] = every
+        self.counts = {}
+
+    def sample(self, channel):
+        """Returns whether to log a payload on a channel.
+
+        Args:
+            channel: The channel the payload was sent or received on
+        """
+        every = self.channels.get(channel, self.every)
+        if every <= 1:
+            return every == 1
+        count = self.counts.get(channel, 0)
+        self.counts[channel] = count + 1
+        return count % every == 0
+
+sampler = PayloadSampler()
+
+def set_payload_sampling(every, channel=None):
+    """Logs only every nth message payload at debug level.
+
+    Args:
+        every: Log every nth payload, 1 for all of them and 0 for none
+        channel: The channel to apply this to, None for every channel
+                 without its own setting
+    """
+    sampler.set(every, channel)
+
+def debug_payload(channel, msg, *args):
+    """Logs a message payload at debug level.
+
+    Nothing is formatted unless debug logging is enabled for the package
+    logger and the sampler picks this payload.
+
+    Args:
+        channel: The channel the payload was sent or received on
+        msg: The log message format
+        args: The arguments for the format
+    """
+    if logger.isEnabledFor(logging.DEBUG) and sampler.sample(channel):
+        logger.debug(msg, *args)
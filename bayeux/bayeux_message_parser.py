@@ -0,0 +1,230 @@
+import re
+import time
+
+from . import bayeux_stats
+from .bayeux_codec import get_codec
+
+#Characters that change the parser state outside of a JSON string
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+#Characters that change the parser state inside of a JSON string
+_STRING = re.compile(r'["\\]')
+
+class LazyMessage(dict):
+    """A message whose data is only decoded when it is first read.
+
+    Reading msg['data'] or msg.get('data') decodes it, other ways of
+    reading the dict, such as items or iterating over it, only see the
+    rest of the message until then. Call decode to get a plain message.
+
+    Attributes:
+        raw: The JSON text of the data, None once it has been decoded
+        codec: The codec to decode it with
+    """
+    __slots__ = ('raw', 'codec')
+
+    def __init__(self, envelope, raw, codec):
+        dict.__init__(self, envelope)
+        self.raw = raw
+        self.codec = codec
+
+    def __missing__(self, key):
+        raw = self.raw
+        if key != 'data':
+            raise KeyError(key)
+        if raw is None:
+            #Decoded by another thread since the lookup, which sets the
+            #data before clearing raw
+            return dict.__getitem__(self, key)
+        data = self['data'] = self.codec.decode(raw)
+        self.raw = None
+        return data
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (key == 'data' and
+            self.raw is not None)
+
+    def decode(self):
+        """Decodes the data if it has not been, and returns the message."""
+        self.get('data')
+        return self
+
+class BayeuxMessageParser(object):
+    """Incremental parser for the message array in a bayeux response.
+
+    Bayeux responses are a JSON array of message objects. Rather than
+    buffering the whole response and decoding it at the end, the parser
+    tracks the JSON structure as data arrives and decodes each message as
+    soon as its closing brace is seen. Only the message currently being
+    received is buffered.
+
+    In lazy mode only the envelope of each message is decoded up front.
+    An object or array under its 'data' key is kept as JSON text and
+    decoded the first time a listener reads it, see LazyMessage, so
+    messages nobody listens to are never decoded in full.
+
+    Attributes:
+        callback: Called with each decoded message
+        codec: Codec used to decode each message
+        stats: BayeuxStats to record decode times in, None if disabled
+        chunks: Pieces of the message currently being received
+        depth: Current nesting depth of the JSON structure
+        msg_depth: Depth at which the current message started, None if
+                   no message is in progress
+        in_string: Whether the parser is inside a JSON string
+        escaped: Whether the next character is escaped
+        lazy: Whether to leave the data of each message to be decoded
+              when it is read
+        msg_len: Length of the current message held in chunks
+        spans: (start, end) of the objects and arrays directly inside the
+               current message, in lazy mode
+    """
+    def __init__(self, callback, codec=None, stats=None, lazy=False):
+        """Initialize the parser.
+
+        Args:
+            callback: Called with each message (a dict) once it is decoded
+            codec: Optional codec used to decode messages, the standard
+                   json codec by default
+            stats: Optional BayeuxStats to record decode times in
+            lazy: Whether to decode only the envelope of each message up
+                  front
+        """
+        self.callback = callback
+        self.codec = get_codec(codec)
+        self.stats = stats
+        self.chunks = []
+        self.depth = 0
+        self.msg_depth = None
+        self.in_string = False
+        self.escaped = False
+        self.lazy = lazy
+        self.msg_len = 0
+        self.spans = []
+
+    def feed(self, data):
+        """Feeds the next piece of the response to the parser.
+
+        Complete messages found in the data are decoded and passed to the
+        callback before this returns.
+
+        Args:
+            data: The next piece of the response body
+
+        Raises:
+            ValueError: If a complete message could not be decoded. The
+                        parser skips the bad message and can continue to
+                        be fed.
+        """
+        pos = 0
+        start = 0 if self.msg_depth is not None else None
+        end = len(data)
+        error = None
+        if self.escaped and end:
+            self.escaped = False
+            pos = 1
+        while pos < end:
+            if self.in_string:
+                match = _STRING.search(data, pos)
+                if match is None:
+                    break
+                pos = match.start()
+                if data[pos] == '"':
+                    self.in_string = False
+                    pos += 1
+                elif pos + 1 < end:
+                    pos += 2
+                else:
+                    self.escaped = True
+                    pos += 1
+                continue
+            match = _STRUCTURE.search(data, pos)
+            if match is None:
+                break
+            pos = match.start()
+            char = data[pos]
+            if char == '"':
+                self.in_string = True
+            elif char == '{' or char == '[':
+                if char == '{' and self.msg_depth is None and self.depth <= 1:
+                    self.msg_depth = self.depth
+                    start = pos
+                self.depth += 1
+                if (self.lazy and self.msg_depth is not None and
+                        self.depth == self.msg_depth + 2):
+                    self.spans.append(self.msg_len + pos - start)
+            else:
+                self.depth -= 1
+                if (self.lazy and self.msg_depth is not None and
+                        self.depth == self.msg_depth + 1):
+                    self.spans[-1] = (self.spans[-1],
+                        self.msg_len + pos + 1 - start)
+                elif self.depth == self.msg_depth:
+                    self.chunks.append(data[start:pos + 1])
+                    try:
+                        message = self._decode(''.join(self.chunks))
+                    except ValueError as e:
+                        error = e
+                    else:
+                        self.callback(message)
+                    self.chunks = []
+                    self.msg_depth = None
+                    self.msg_len = 0
+                    self.spans = []
+                    start = None
+            pos += 1
+        if start is not None:
+            self.chunks.append(data[start:])
+            self.msg_len += end - start
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Signals the end of the response.
+
+        Returns:
+            True if the response ended cleanly, False if a message was
+            left incomplete.
+        """
+        complete = self.msg_depth is None
+        self.chunks = []
+        self.depth = 0
+        self.msg_depth = None
+        self.in_string = False
+        self.escaped = False
+        self.msg_len = 0
+        self.spans = []
+        return complete
+
+    def _decode(self, message):
+        """Decodes a single message.
+
+        Args:
+            message: The JSON text of one message
+
+        Returns:
+            The decoded message, a LazyMessage in lazy mode if it has data
+        """
+        if self.stats is None:
+            return self._decode_message(message)
+        start = time.time()
+        decoded = self._decode_message(message)
+        self.stats.observe(bayeux_stats.DECODE_TIME, time.time() - start)
+        return decoded
+
+    def _decode_message(self, message):
+        if not self.spans:
+            return self.codec.decode(message)
+        for start, end in self.spans:
+            key = message.rfind('"data"', 0, start)
+            if key >= 0 and message[key + 6:start].strip() == ':':
+                envelope = self.codec.decode(''.join((message[:start],
+                    'null', message[end:])))
+                del envelope['data']
+                return LazyMessage(envelope, message[start:end], self.codec)
+        return self.codec.decode(message)
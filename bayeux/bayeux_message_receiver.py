@@ -1,29 +1,93 @@
-import collections
-import json
-import logging
+from . import bayeux_constants
+from . import bayeux_stats
+import time
 
+from twisted.internet import defer
 from twisted.internet.protocol import Protocol
+from twisted.web.client import ResponseDone
 
-class BayeuxMessageReceiver(Protocol):
-    """Protocol class that handles incoming messages from the bayeux server.
+from .bayeux_channel_trie import ChannelTrie
+from .bayeux_codec import get_codec
+from .bayeux_dispatcher import HeldListener, InlineDispatcher
+from .bayeux_logging import debug_payload, logger
+from .bayeux_message_parser import BayeuxMessageParser
+
+class BayeuxMessageReceiver(object):
+    """Handles incoming messages from the bayeux server.
+
+    The receiver holds the listeners for each event. Events may be
+    wildcard patterns such as '/foo/*' or '/foo/**'. Every response from
+    the server is read by its own BayeuxResponseReceiver, created through
+    new_response, which passes each message back here as soon as it has
+    been parsed.
+
+    Listeners for meta channels are always called on the reactor thread.
+    Listeners for other channels are called through the dispatcher, which
+    may hand them off to worker threads.
 
     Attributes:
-        listeners: Dictionary of listeners for different events
-        buf: The current message buffer
+        listeners: Trie of listeners for different events
+        replies: Dictionary of Deferreds waiting for a reply, by message id
+        dispatcher: Delivers messages to listeners of non-meta channels
+        inline: Delivers messages to listeners of meta channels
+        codec: Codec used to decode incoming messages
+        stats: BayeuxStats to record activity in, None if disabled
+        lazy: Whether the data of each message is only decoded when a
+              listener reads it, see BayeuxMessageParser
+        replay: BayeuxReplay tracking the replay id of each message, None
+                if disabled
+        dedup: BayeuxDedup dropping messages received twice, None if
+               disabled
+        holding: Whether any HeldListener has been registered
+        held: The HeldListeners registered, closed when they are
+              deregistered or the receiver is stopped
+        extensions: The BayeuxExtensions every message sent and received
+                    goes through, in order. Replaced rather than changed
+                    so it can be read without a lock.
     """
-    def __init__(self):
-        """Initialize the message receiver."""
-        self.listeners = collections.defaultdict(set)
-        self.buf = ''
+    def __init__(self, dispatcher=None, codec=None, stats=None, lazy=False):
+        """Initialize the message receiver.
+
+        Args:
+            dispatcher: Optional dispatcher used to call listeners of
+                        non-meta channels, by default they are called
+                        directly on the reactor thread
+            codec: Optional codec used to decode incoming messages, see
+                   bayeux_codec.get_codec
+            stats: Optional BayeuxStats to record activity in, shared
+                   with the sender
+            lazy: Whether to decode only the envelope of each message up
+                  front, leaving its data to be decoded when it is read
+        """
+        self.listeners = ChannelTrie()
+        self.inline = InlineDispatcher()
+        self.dispatcher = dispatcher or self.inline
+        self.codec = get_codec(codec)
+        self.stats = stats
+        self.lazy = lazy
+        self.replay = None
+        self.dedup = None
+        self.holding = False
+        self.held = []
+        self.extensions = ()
+        self.replies = {}
 
     def register(self, event, callback):
         """Register a callback for a particular event
 
         Args:
-            event: The event to register for (e.g. '/foo/bar')
-            callback: The callback to trigger upon receipt of the message
+            event: The event to register for (e.g. '/foo/bar' or '/foo/*')
+            callback: The callback to trigger upon receipt of the message,
+                      may be a HeldListener
+
+        Returns:
+            False if the callback was already registered for the event
         """
-        self.listeners[event].add(callback)
+        added = self.listeners.add(event, callback)
+        if added and isinstance(callback, HeldListener):
+            self.held.append(callback)
+            self.holding = True
+        return added
 
     def deregister(self, event, callback):
         """Deregister a callback for a particular event.
@@ -35,52 +99,207 @@ class BayeuxMessageReceiver(Protocol):
         Returns:
             The number of remaining listeners for the specified event
         """
-        if event in self.listeners and callback in self.listeners[event]:
-            self.listeners[event].remove(callback)
+        if self.held:
+            for listener in list(self.listeners.get(event)):
+                if isinstance(listener, HeldListener) and listener == callback:
+                    self._close_held(listener)
+        return self.listeners.remove(event, callback)
 
-        return len(self.listeners[event])
+    def _close_held(self, listener):
+        """Closes a HeldListener that is no longer registered."""
+        self.held = [held for held in self.held if held is not listener]
+        listener.close()
 
-    def dataReceived(self, data):
-        """Called when data is received from the bayeux server.
-    
-        This is called by the Twisted protocol classes when 
-        data is received from the server. This can potentially be called 
-        multiple times per message so buffer up the data.
+    def response_done(self):
+        """Tells the HeldListeners that every message of a response has
+        been dispatched. Must be called on the reactor thread."""
+        for listener in self.held:
+            listener.response_done()
+
+    def stop(self):
+        """Stops the dispatcher and closes the HeldListeners, so nothing
+        they still hold is delivered."""
+        for listener in self.held:
+            listener.close()
+        self.held = []
+        self.dispatcher.stop()
+
+    def expect_reply(self, msg_id, d):
+        """Waits for the server's reply to a message.
 
         Args:
-            data: The data string that was sent from the bayeux server
+            msg_id: The id of the message that was sent
+            d: The Deferred to fire with the reply
         """
-        logging.debug('dataReceived: %s' % data)
-        self.buf += data
+        self.replies[msg_id] = d
 
-    def connectionLost(self, reason):
-        """Called after an entire message is received.
+    def cancel_reply(self, msg_id):
+        """Stops waiting for the reply to a message.
 
-        This is called by the Twisted protocol classes after all data has 
-        been received. Parses the data that was received and issues callbacks 
-        to listeners based on the content of the message.
+        Args:
+            msg_id: The id of the message that was sent
+
+        Returns:
+            True if the reply was still being waited for
+        """
+        return self.replies.pop(msg_id, None) is not None
+
+    def new_response(self):
+        """Creates a protocol to read a single response from the server.
+
+        Returns:
+            A BayeuxResponseReceiver to pass to response.deliverBody
+        """
+        return BayeuxResponseReceiver(self)
+
+    def dispatch(self, msg):
+        """Dispatches a single message received from the server.
 
         Args:
-            reason: The reason why the connection was lost
-        """        
-        try:
-            data = json.loads(self.buf)
-            logging.debug('connectionLost: %s' % data)
-            for msg in data:
-                if 'channel' in msg:
-                    self.notify(msg['channel'], msg)
-        except ValueError as e:
-            print 'Error parsing data: ', self.buf
-            print e
-        self.buf = ''
+            msg: The decoded message
+        """
+        extensions = self.extensions
+        if extensions:
+            for extension in extensions:
+                extension.incoming(msg)
+        channel = msg.get('channel')
+        #Only replies carry 'successful', messages published by other
+        #clients may reuse an id that we are waiting on
+        if 'successful' in msg:
+            #Replies to our own publishes are not data for the listeners
+            if channel is not None and channel.startswith(
+                    bayeux_constants.META_CHANNEL_PREFIX):
+                self.notify(channel, msg)
+            d = self.replies.pop(msg.get('id'), None)
+            if d is not None:
+                d.callback(msg)
+        elif channel is not None:
+            self.notify(channel, msg)
 
     def notify(self, event, data):
         """Notify listeners that data was received for the specified event.
 
+        For messages on other than meta channels, the replay extension
+        records the cursor once the dispatcher has run the listeners.
+
         Args:
             event: The event
             data: The data
         """
-        logging.debug('notify: %s' % event)
-        for listener in self.listeners.get(event, []):
-            listener(data)
\ No newline at end of file
+        debug_payload(event, 'notify: %s: %s', event, data)
+        stats = self.stats
+        if stats is not None:
+            stats.incr_channel(event, bayeux_stats.RECEIVED)
+        meta = event.startswith(bayeux_constants.META_CHANNEL_PREFIX)
+        if (self.dedup is not None and not meta and
+                self.dedup.is_duplicate(event, data)):
+            if stats is not None:
+                stats.incr_channel(event, bayeux_stats.DUPLICATES)
+            return
+        listeners = self.listeners.match(event)
+        if listeners and self.holding:
+            #Held listeners deliver messages they keep back themselves
+            listeners = [listener for listener in listeners
+                if not isinstance(listener, HeldListener) or
+                listener.offer(data)]
+        delivered = None
+        if self.replay is not None and not meta:
+            delivered = self.replay.dispatching(event, data)
+        if listeners:
+            if stats is None:
+                #Copy, the listeners may change before a worker gets to them
+                listeners = list(listeners)
+            else:
+                stats.incr_channel(event, bayeux_stats.DISPATCHED)
+                listeners = [stats.timed(listener) for listener in listeners]
+            if delivered is not None:
+                #Runs once the listeners have, in the same worker
+                listeners.append(delivered)
+            if meta:
+                self.inline.dispatch(event, listeners, data)
+            else:
+                self.dispatcher.dispatch(event, listeners, data)
+        elif delivered is not None:
+            delivered(data)
+
+class BayeuxResponseReceiver(Protocol):
+    """Protocol class that reads a single response from the bayeux server.
+
+    Messages are parsed incrementally and dispatched to the shared
+    BayeuxMessageReceiver as soon as each one is complete, so only the
+    message currently being received is held in memory.
+
+    Attributes:
+        receiver: The message receiver to dispatch messages to
+        parser: The incremental message parser for this response
+        finished: Deferred fired once the whole response has been read
+        size: Number of bytes received, after any decompression
+        compressed_size: Number of bytes received before decompression,
+                         None if the response was not compressed
+        started: The time the response's headers arrived, None without
+                 stats
+    """
+    def __init__(self, receiver):
+        """Initialize the response receiver.
+
+        Args:
+            receiver: The message receiver to dispatch messages to
+        """
+        self.receiver = receiver
+        self.parser = BayeuxMessageParser(receiver.dispatch, receiver.codec,
+            receiver.stats, receiver.lazy)
+        self.finished = defer.Deferred(self._cancel)
+        self.size = 0
+        self.compressed_size = None
+        self.started = time.time() if receiver.stats is not None else None
+
+    def dataReceived(self, data):
+        """Called when data is received from the bayeux server.
+
+        This is called by the Twisted protocol classes when
+        data is received from the server. This can potentially be called
+        multiple times per response. Any messages completed by the data
+        are dispatched immediately.
+
+        Args:
+            data: The data string that was sent from the bayeux server
+        """
+        logger.debug('dataReceived: %s', data)
+        self.size += len(data)
+        try:
+            self.parser.feed(data)
+        except ValueError as e:
+            logger.error('Error parsing message: %s', e)
+
+    def connectionLost(self, reason):
+        """Called after the entire response is received.
+
+        Args:
+            reason: The reason why the connection was lost
+        """
+        if not self.parser.close():
+            logger.error('Response ended with an incomplete message')
+        self.receiver.response_done()
+        if not reason.check(ResponseDone):
+            logger.debug('connectionLost: %s', reason.getErrorMessage())
+        stats = self.receiver.stats
+        if stats is not None:
+            wire_size = self.size
+            if self.compressed_size is not None:
+                wire_size = self.compressed_size
+            stats.incr(bayeux_stats.RESPONSES)
+            stats.incr(bayeux_stats.BYTES_RECEIVED, wire_size)
+            stats.observe(bayeux_stats.RESPONSE_BYTES, self.size)
+            stats.observe(bayeux_stats.WIRE_BYTES, wire_size)
+            stats.observe(bayeux_stats.READ_TIME, time.time() - self.started)
+        if not self.finished.called:
+            self.finished.callback(None)
+
+    def _cancel(self, d):
+        """Abandons the response, closing its connection.
+
+        Args:
+            d: The finished Deferred being cancelled
+        """
+        if self.transport is not None:
+            self.transport.stopProducing()
@@ -1,59 +1,214 @@
-import bayeux_constants
+from . import bayeux_constants
+from . import bayeux_stats
+import collections
+import itertools
 import logging
+import threading
+import time
 
 from cookielib import CookieJar
 
 from twisted.internet import defer, reactor
 from twisted.internet.defer import succeed
-from twisted.web.client import Agent, CookieAgent, HTTPConnectionPool
+from twisted.web.client import Agent, CookieAgent
 from twisted.web.http_headers import Headers
+from twisted.python.threadable import isInIOThread
 from twisted.web.iweb import IBodyProducer
 from zope.interface import implements
-import pprint
-import copy
 
-#TODO Use join for string building or 'msg'.format formatting
+from .bayeux_compression import decoding_agent
+from .bayeux_errors import NoReplyError, PublishError, QueueFullError
+from .bayeux_logging import debug_payload, logger
+from .bayeux_pool import BayeuxConnectionPool, CountingConnectionPool
+from .bayeux_websocket import (BayeuxWebSocketTransport, websocket_available,
+    websocket_url)
 
 class BayeuxMessageSender(object):
     """Responsible for sending messages to the bayeux server from the client.
 
+    Messages are queued and sent to the server in batches. A batch is sent
+    once batch_window seconds have passed since the first message was
+    queued, or as soon as max_batch_size messages are waiting. Every batch
+    is sent as a single compact JSON array in one request, encoded with
+    the receiver's codec, and the replies are matched back to their
+    messages by id. Up to max_in_flight batches may be waiting on the
+    server at once; further messages keep gathering in the queue until one
+    of them completes.
+
+    Batched messages are held until the client id is known, so they can be
+    sent before the handshake completes.
+
+    The handshake is always sent over HTTP. If websockets are enabled and
+    the server supports them, later messages are sent over a websocket
+    instead, falling back to HTTP long-polling if it cannot be opened or
+    is lost.
+
+    HTTP requests go over two lanes, as the bayeux spec recommends. The
+    long-poll connect, which the server holds, has a persistent connection
+    of its own. Everything else goes over a BayeuxConnectionPool, which
+    may be shared with the senders of other sessions, so a held connect
+    never delays a subscribe or publish or makes it open a new connection.
+    Each sender keeps its own cookies.
+
+    With compression, HTTP requests accept gzip and deflate encoded
+    responses, which are decompressed piece by piece as they arrive and
+    fed straight to the receiver's parser.
+
     Attributes:
-        agent: The twisted agent to use to send the data
+        pool: The BayeuxConnectionPool control and publish requests are
+              sent over
+        owns_pool: Whether the pool was created by this sender, and is
+                   closed with it
+        connect_pool: The pool holding the connection for connects
+        cookie_jar: The session's cookies
+        agent: The twisted agent to use to send control and publish
+               requests
+        connect_agent: The twisted agent to use to send connects
         client_id: The client id to use when sending messages
-        msg_id: A message id counter
+        msg_id: A message id counter, safe to use from any thread
         server: The bayeux server to send messages to
         receiver: The message receiver
         oauth_header: if authorization is required
+        batch_window: Time in seconds to gather messages into a batch
+        max_batch_size: Maximum number of messages sent in one request
+        max_in_flight: Maximum number of batches waiting on the server
+        in_flight: Number of batches currently waiting on the server
+        outbox: Messages handed over from other threads, waiting to be
+                moved to the queue on the reactor thread
+        drain_scheduled: Whether the outbox is due to be drained
+        queue: Messages waiting to be sent
+        flush_call: The pending delayed call that sends the queue
+        flushing: Whether the queue is currently being sent
+        publish_slots: Semaphore bounding the number of outstanding
+                       publishes
+        use_websocket: Whether to use a websocket when the server
+                       supports it
+        websocket_url: The url to open the websocket on
+        websocket: The websocket transport, None when using long-polling
+        connection_type: The bayeux connection type currently in use
+        connect_timeout: Time in seconds after which a long-polling connect
+                         request is abandoned, None to wait forever
+        compression: Whether responses may be compressed
     """
-    def __init__(self, server, receiver, oauth_header=None):
+    def __init__(self, server, receiver, oauth_header=None,
+        batch_window=bayeux_constants.BATCH_WINDOW,
+        max_batch_size=bayeux_constants.MAX_BATCH_SIZE,
+        max_in_flight=bayeux_constants.MAX_IN_FLIGHT,
+        max_pending=bayeux_constants.MAX_PENDING_PUBLISHES,
+        use_websocket=True, ws_url=None, pool=None, compression=False):
         """Initialize the message sender.
 
         Args:
             server: The bayeux server to send messages to
             receiver: The message receiver to pass the responses to
+            oauth_header: if authorization is required, this is the full
+                          header value
+            batch_window: Time in seconds to gather messages into a batch
+            max_batch_size: Maximum number of messages sent in one request
+            max_in_flight: Maximum number of batches waiting on the server
+            max_pending: Maximum number of publishes that have not yet been
+                         acknowledged by the server
+            use_websocket: Whether to use a websocket when the server
+                           supports it and autobahn is installed
+            ws_url: The url to open the websocket on, by default the
+                    server url with a ws or wss scheme
+            pool: A BayeuxConnectionPool shared with other senders, by
+                  default the sender creates its own
+            compression: Whether to accept gzip and deflate encoded
+                         responses
         """
         self.cookie_jar = CookieJar()
-        self.agent = CookieAgent(Agent(reactor, pool=HTTPConnectionPool(reactor)), self.cookie_jar)
-        self.client_id = -1 #Will be set upon receipt of the handshake response
-        self.msg_id = 0
+        self.owns_pool = pool is None
+        if pool is None:
+            #Leave room for the handshake or disconnect alongside the
+            #batches
+            pool = BayeuxConnectionPool(max_in_flight + 1)
+        self.pool = pool
+        self.agent = pool.agent(self.cookie_jar)
+        self.connect_pool = CountingConnectionPool(reactor)
+        self.connect_pool.maxPersistentPerHost = 1
+        self.connect_agent = CookieAgent(Agent(reactor,
+            pool=self.connect_pool), self.cookie_jar)
+        self.compression = compression
+        if compression:
+            self.agent = decoding_agent(self.agent)
+            self.connect_agent = decoding_agent(self.connect_agent)
+        self.client_id = None #Will be set upon receipt of the handshake response
+        self.msg_id = itertools.count(1)
         self.server = server
         self.receiver = receiver
         self.oauth_header = oauth_header
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.outbox = collections.deque()
+        self.drain_scheduled = False
+        self.queue = []
+        self.flush_call = None
+        self.flushing = False
+        self.publish_slots = threading.Semaphore(max_pending)
+        self.use_websocket = use_websocket and websocket_available()
+        self.websocket_url = ws_url or websocket_url(server)
+        self.websocket = None
+        self.connection_type = bayeux_constants.LONG_POLLING
+        self.connect_timeout = None
+
+    def close(self):
+        """Closes the persistent connections to the server.
+
+        A shared pool is left open for the other senders using it.
+
+        Returns:
+            A Deferred that fires once the connections are closed
+        """
+        ds = [self.connect_pool.closeCachedConnections()]
+        if self.owns_pool:
+            ds.append(self.pool.close())
+        if self.websocket is not None:
+            ds.append(self._close_websocket())
+        return defer.DeferredList(ds)
 
     def connect(self, errback=None):
         """Sends a connect request message to the server
 
+        The connect message is held by the server until it has messages
+        to deliver, so it is always sent on its own rather than batched.
+
         Args:
             errback: Optional callback issued if there is an error
                      during sending.
+
+        Returns:
+            A Deferred that fires with the server's reply
+        """
+        message = {
+            'channel': bayeux_constants.CONNECT_CHANNEL,
+            'id': self.get_next_id(),
+            'connectionType': self.connection_type
+            }
+        logger.debug('connect: %s', message)
+        d = self.send_message(message, batch=False)
+        stats = self.receiver.stats
+        if stats is not None:
+            d.addCallback(self._connect_replied, stats, time.time())
+        if errback is not None:
+            d.addErrback(errback)
+        return d
+
+    def _connect_replied(self, reply, stats, sent):
+        """Records the round trip time of a connect.
+
+        Args:
+            reply: The server's reply, passed on unchanged
+            stats: The BayeuxStats to record in
+            sent: The time the connect was sent
+
+        Returns:
+            The reply
         """
-        message = 'message={{"channel":"{0}","clientId":"{1}","id":"{2}",\
-            "connectionType":"long-polling"}}'.format(
-                bayeux_constants.CONNECT_CHANNEL,
-                self.client_id,
-                self.get_next_id())
-        logging.debug('connect: %s' % message)
-        self.send_message(message, errback)
+        stats.observe(bayeux_stats.CONNECT_RTT, time.time() - sent)
+        return reply
 
     def disconnect(self, errback=None):
         """Sends a disconnect request message to the server.
@@ -61,13 +216,16 @@ class BayeuxMessageSender(object):
         Args:
             errback: Optional callback issued if there is an error
                 during sending.
+
+        Returns:
+            A Deferred that fires with the server's reply
         """
-        message = 'message={{"channel":"{0}","clientId":"{1}","id":"{2}"}}'.format(
-            bayeux_constants.DISCONNECT_CHANNEL,
-            self.client_id,
-            self.get_next_id())
-        logging.debug('disconnect: %s' % message)
-        self.send_message(message, errback)
+        message = {
+            'channel': bayeux_constants.DISCONNECT_CHANNEL,
+            'id': self.get_next_id()
+            }
+        logger.debug('disconnect: %s', message)
+        return self.send_message(message, errback)
 
     def get_next_id(self):
         """Increments and returns the next msg id to use.
@@ -75,70 +233,303 @@ class BayeuxMessageSender(object):
         Returns:
             The next message id to use
         """
-        self.msg_id += 1
-        return self.msg_id
+        return str(next(self.msg_id))
 
-    def handshake(self, errback=None):
+    def handshake(self, errback=None, ext=None):
         """Sends a handshake request to the server.
 
+        A handshake starts a new session, so batched messages are held
+        until the new client id is set.
+
         Args:
             errback: Optional callback issued if there is an error
                 during sending.
-        """
-        message = '''message={{"channel":"{0}","id":"{1}",
-            "supportedConnectionTypes":["callback-polling", "long-polling"],
-            "version":"1.0","minimumVersion":"1.0"}}'''.format(
-                bayeux_constants.HANDSHAKE_CHANNEL,
-                self.get_next_id())
-        logging.debug('handshake: %s' % message)
-        self.send_message(message, errback)
+            ext: Optional ext to send with the handshake
 
-    def send_message(self, message, errback=None):
+        Returns:
+            A Deferred that fires with the server's reply
+        """
+        self.client_id = None
+        if self.websocket is not None:
+            reactor.callFromThread(self._close_websocket)
+        connection_types = [bayeux_constants.CALLBACK_POLLING,
+            bayeux_constants.LONG_POLLING]
+        if self.use_websocket:
+            connection_types.insert(0, bayeux_constants.WEBSOCKET)
+        message = {
+            'channel': bayeux_constants.HANDSHAKE_CHANNEL,
+            'id': self.get_next_id(),
+            'supportedConnectionTypes': connection_types,
+            'version': '1.0',
+            'minimumVersion': '1.0'
+            }
+        if ext is not None:
+            message['ext'] = ext
+        logger.debug('handshake: %s', message)
+        if self.receiver.stats is not None:
+            self.receiver.stats.incr(bayeux_stats.HANDSHAKES)
+        return self.send_message(message, errback, batch=False)
+
+    def send_message(self, message, errback=None, batch=True):
         """Helper method to send a message.
 
         Args:
             message: The message to send
             errback: Optional callback issued if there is an error
                 during sending.
+            batch: Whether the message may be held back and sent along
+                with other messages. If False it is sent immediately in a
+                request of its own.
+
+        Returns:
+            A Deferred that fires with the server's reply to the message.
+            Callbacks run on the reactor thread.
+        """
+        stats = self.receiver.stats
+        if stats is not None:
+            stats.incr(bayeux_stats.MESSAGES_SENT)
+            stats.observe(bayeux_stats.QUEUE_DEPTH,
+                len(self.outbox) + len(self.queue))
+        d = defer.Deferred()
+        if errback is not None:
+            d.addErrback(errback)
+        self._enqueue(message, d, batch)
+        return d
+
+    def _enqueue(self, message, d, batch):
+        """Hands a message over to the reactor thread to be sent.
+
+        Messages are collected in the outbox and moved to the queue in one
+        go, so a burst of sends from another thread only wakes the reactor
+        once. Sends made on the reactor thread are moved straight away.
+
+        Args:
+            message: The message to send
+            d: The Deferred to fire with the reply
+            batch: Whether the message may be batched
+        """
+        self.outbox.append((message, d, batch))
+        if isInIOThread():
+            self._drain()
+        elif not self.drain_scheduled:
+            self.drain_scheduled = True
+            #Make sure that our send happens on the reactor thread
+            reactor.callFromThread(self._drain)
+
+    def _drain(self):
+        """Moves messages from the outbox to the queue.
+
+        Must be called on the reactor thread.
+        """
+        #Clear the flag first so anything added while draining schedules
+        #another drain rather than being left behind
+        self.drain_scheduled = False
+        outbox = self.outbox
+        while outbox:
+            message, d, batch = outbox.popleft()
+            self.receiver.expect_reply(message['id'], d)
+            if batch:
+                self.queue.append((message, d))
+            else:
+                self._transmit([(message, d)])
+        if len(self.queue) >= self.max_batch_size:
+            self.flush()
+        elif self.queue and self.flush_call is None:
+            self.flush_call = reactor.callLater(self.batch_window,
+                self.flush)
+
+    def flush(self):
+        """Sends queued messages to the server.
+
+        Sends as many batches as the in flight limit allows, the rest are
+        sent as earlier batches complete. Nothing is sent until the client
+        id is known. Must be called on the reactor thread.
+        """
+        if self.flush_call is not None:
+            if self.flush_call.active():
+                self.flush_call.cancel()
+            self.flush_call = None
+        if self.client_id is None or self.flushing:
+            return
+        self.flushing = True
+        try:
+            while self.queue and self.in_flight < self.max_in_flight:
+                entries = self.queue[:self.max_batch_size]
+                del self.queue[:self.max_batch_size]
+                self.in_flight += 1
+                self._transmit(entries).addBoth(self._batch_done)
+        finally:
+            self.flushing = False
+
+    def _batch_done(self, _):
+        """Called when a batch has completed, to send any waiting batch."""
+        self.in_flight -= 1
+        if self.queue and self.flush_call is None:
+            self.flush()
+
+    def _transmit(self, entries):
+        """Sends a batch of messages over the current transport.
+
+        Args:
+            entries: List of (message, deferred) tuples to send
+
+        Returns:
+            A Deferred that fires once the batch has completed
+        """
+        for msg, _ in entries:
+            if msg['channel'] != bayeux_constants.HANDSHAKE_CHANNEL:
+                msg['clientId'] = self.client_id
+        extensions = self.receiver.extensions
+        if extensions:
+            for extension in extensions:
+                for msg, _ in entries:
+                    extension.outgoing(msg)
+        channel = entries[0][0]['channel']
+        #Handshakes always go over HTTP, they are never batched
+        if (self.websocket is not None and
+                channel != bayeux_constants.HANDSHAKE_CHANNEL):
+            return self.websocket.send(entries)
+        if channel == bayeux_constants.CONNECT_CHANNEL:
+            return self._post(entries, self.connect_agent,
+                self.connect_timeout)
+        d = self.pool.acquire(self.server)
+        d.addCallback(lambda _: self._post(entries, self.agent))
+
+        def release(result):
+            self.pool.release(self.server)
+            return result
+        return d.addBoth(release)
+
+    def negotiate(self, connection_types):
+        """Picks the transport to use after a successful handshake.
+
+        Opens a websocket if it is enabled and the server supports it.
+        Must be called on the reactor thread.
+
+        Args:
+            connection_types: The connection types supported by the server
+
+        Returns:
+            A Deferred that fires once the transport is ready. It never
+            fails, if the websocket cannot be opened long-polling is used.
+        """
+        if not (self.use_websocket and
+                bayeux_constants.WEBSOCKET in connection_types):
+            return defer.succeed(self.connection_type)
+        headers = {}
+        if self.oauth_header is not None:
+            headers['Authorization'] = self.oauth_header
+        websocket = BayeuxWebSocketTransport(self.websocket_url,
+            self.receiver, headers, self._websocket_lost)
+
+        def opened(_):
+            self.websocket = websocket
+            self.connection_type = bayeux_constants.WEBSOCKET
+            return self.connection_type
+
+        def failed(reason):
+            logger.warning('Could not open websocket, using long-polling: %s'
+                % reason.getErrorMessage())
+            return self.connection_type
+        d = websocket.open(bayeux_constants.WEBSOCKET_OPEN_TIMEOUT)
+        return d.addCallbacks(opened, failed)
+
+    def _websocket_lost(self, reason):
+        """Called when the websocket is lost, to fall back to long-polling.
+
+        Args:
+            reason: The reason the websocket was closed
+        """
+        logger.warning('Websocket lost, falling back to long-polling')
+        self.websocket = None
+        self.connection_type = bayeux_constants.LONG_POLLING
+        self.connect_timeout = None
+
+    def _close_websocket(self):
+        """Closes the websocket and goes back to long-polling.
+
+        Returns:
+            A Deferred that fires once the websocket is closed
+        """
+        websocket = self.websocket
+        self.websocket = None
+        self.connection_type = bayeux_constants.LONG_POLLING
+        self.connect_timeout = None
+        if websocket is None:
+            return defer.succeed(None)
+        return websocket.close()
+
+    def _post(self, entries, agent, timeout=None):
+        """Sends a batch of messages to the server in one request.
+
+        Args:
+            entries: List of (message, deferred) tuples to send
+            agent: The agent for the lane to send the request on
+            timeout: Optional time in seconds after which the request is
+                     abandoned and its messages fail
+
+        Returns:
+            A Deferred that fires once the request has completed
         """
-        def do_send():
-            headers_dict = {
-                'Content-Type': ['application/x-www-form-urlencoded'],
-                'Host': [self.server[8:]]
-                }
-            if not self.oauth_header is None:
-                headers_dict['Authorization'] = [self.oauth_header]
-            logging.debug("headers dictionary: %s", headers_dict)
-            logging.debug("message: %s", str(message))
-            headers = Headers(headers_dict)
-            logging.debug("headers object:")
-            for header in headers.getAllRawHeaders():
-                logging.debug("> %s", header)
-            d = self.agent.request('POST',
-                self.server,
-                headers,
-                BayeuxProducer(str(message)))
-            logging.debug("send_message.do_send(): d object:\n%s", str(d))
-
-            def cb(response):
-                logging.debug("send_message.do_send.cb(): response version: %s", response.version)
-                logging.debug("send_message.do_send.cb(): response code: %s", response.code)
-                logging.debug("send_message.do_send.cb(): response phrase: %s", response.phrase)
-                logging.debug("send_message.do_send.cb(): response headers:\n%s", pprint.pformat(list(response.headers.getAllRawHeaders())))
-                response.deliverBody(self.receiver)
-                return d
-
-            def error(reason):
-                logging.error('Error sending msg: %s' % reason)
-                logging.error(reason.getErrorMessage())
-                logging.debug(reason.value.reasons[0].printTraceback())
-                if errback is not None:
-                    errback(reason)
-
-            d.addCallback(cb)
-            d.addErrback(error)
-        #Make sure that our send happens on the reactor thread
-        reactor.callFromThread(do_send)
+        codec = self.receiver.codec
+        message = codec.encode([msg for msg, _ in entries])
+        headers_dict = {'Content-Type': [codec.content_type]}
+        if not self.oauth_header is None:
+            headers_dict['Authorization'] = [self.oauth_header]
+        logger.debug('POST %s headers: %s message: %s', self.server,
+            headers_dict, message)
+        stats = self.receiver.stats
+        sent = time.time() if stats is not None else None
+        d = agent.request('POST',
+            self.server,
+            Headers(headers_dict),
+            BayeuxProducer(message))
+
+        def cb(response):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('response: %s %s %s headers: %s',
+                    response.version, response.code, response.phrase,
+                    list(response.headers.getAllRawHeaders()))
+            protocol = self.receiver.new_response()
+            response.deliverBody(protocol)
+            return protocol.finished
+
+        def done(_):
+            if stats is not None:
+                stats.observe(bayeux_stats.RESPONSE_TIME, time.time() - sent)
+            #Anything still waiting after the whole response was read is
+            #never going to get a reply
+            for msg, reply in entries:
+                if self.receiver.cancel_reply(msg['id']):
+                    reply.errback(NoReplyError(
+                        'No reply to message %s' % msg['id']))
+
+        def error(reason):
+            logger.error('Error sending msg: %s', reason.getErrorMessage())
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(reason.getTraceback())
+            for msg, reply in entries:
+                if self.receiver.cancel_reply(msg['id']):
+                    reply.errback(reason)
+
+        d.addCallback(cb)
+        if timeout is not None:
+            d.addTimeout(timeout, reactor)
+        d.addCallbacks(done, error)
+        return d
+
+    def lane_stats(self):
+        """Returns how often each lane reused its connections.
+
+        Returns:
+            A dict with 'connect' and 'control' lanes, each as returned by
+            CountingConnectionPool.snapshot. A shared control lane counts
+            the requests of every sender using it.
+        """
+        return {
+            'connect': self.connect_pool.snapshot(),
+            'control': self.pool.snapshot(),
+            }
 
     def set_client_id(self, client_id):
         """Sets the client id to use for request messages that are sent.
@@ -152,36 +543,101 @@ class BayeuxMessageSender(object):
             client_id: The client id to use when sending requests to the server
         """
         self.client_id = client_id
+        #Send anything that was held waiting for the client id
+        reactor.callFromThread(self.flush)
+
+    def publish(self, channel, data, errback=None, block=True):
+        """Publishes data to a channel.
 
-    def subscribe(self, subscription, errback=None):
+        Publishes are batched with other messages. At most max_pending
+        publishes can be waiting for an acknowledgement, beyond that the
+        call blocks until one completes. Calls made on the reactor thread,
+        or with block set to False, fail with QueueFullError instead.
+
+        Args:
+            channel: The channel to publish to (e.g. '/foo/bar')
+            data: The data to publish, anything that can be JSON encoded
+            errback: Optional callback issued if there is an error
+                during sending
+            block: Whether to wait for room in the queue
+
+        Returns:
+            A Deferred that fires with the server's acknowledgement, or
+            fails with PublishError if the server rejected the message.
+            Callbacks run on the reactor thread.
+        """
+        if not self.publish_slots.acquire(block and not isInIOThread()):
+            return defer.fail(QueueFullError(
+                'Too many publishes waiting for acknowledgement'))
+        message = {
+            'channel': channel,
+            'id': self.get_next_id(),
+            'data': data
+            }
+        debug_payload(channel, 'publish: %s', message)
+        d = defer.Deferred()
+        d.addBoth(self._publish_done)
+        if errback is not None:
+            d.addErrback(errback)
+        self._enqueue(message, d, True)
+        return d
+
+    def _publish_done(self, result):
+        """Frees the queue slot held by a publish and checks the ack.
+
+        Args:
+            result: The server's reply or the failure
+
+        Returns:
+            The reply if the publish succeeded
+        """
+        self.publish_slots.release()
+        if isinstance(result, dict) and not result.get('successful'):
+            raise PublishError(result.get('error', 'Publish failed'))
+        return result
+
+    def subscribe(self, subscription, errback=None, ext=None):
         """Sends a subscribe request to the server.
 
         Args:
-            subscription: The subscription path (e.g. '/foo/bar')
+            subscription: The subscription path (e.g. '/foo/bar'), or a
+                          list of them
             errback: Optional callback issued if there is an error
                 during sending
+            ext: Optional ext to send with the subscribe
+
+        Returns:
+            A Deferred that fires with the server's reply
         """
-        message = 'message={{"channel":"{0}","clientId":"{1}","id":"{2}",\
-            "subscription":"{3}"}}'.format(
-                bayeux_constants.SUBSCRIBE_CHANNEL,
-                self.client_id, self.get_next_id(), subscription)
-        logging.debug('subscribe: %s' % message)
-        self.send_message(message, errback)
+        message = {
+            'channel': bayeux_constants.SUBSCRIBE_CHANNEL,
+            'id': self.get_next_id(),
+            'subscription': subscription
+            }
+        if ext is not None:
+            message['ext'] = ext
+        logger.debug('subscribe: %s', message)
+        return self.send_message(message, errback)
 
     def unsubscribe(self, subscription, errback=None):
         """Sends an unsubscribe request to the server.
 
         Args:
-            subscription: The subscription path (e.g. '/foo/bar')
+            subscription: The subscription path (e.g. '/foo/bar'), or a
+                          list of them
             errback: Optional callback issued if there is an error
                 during sending
+
+        Returns:
+            A Deferred that fires with the server's reply
         """
-        message = 'message={{"channel":"{0}","clientId":"{1}","id":"{2}",\
-            "subscriptions":"{3}"}}'.format(
-                bayeux_constants.UNSUBSCRIBE_CHANNEL,
-                self.clientId, self.get_next_id(), subscriptions)
-        logging.debug('unsubscribe: %s' % message)
-        self.send_message(message, errback)
+        message = {
+            'channel': bayeux_constants.UNSUBSCRIBE_CHANNEL,
+            'id': self.get_next_id(),
+            'subscription': subscription
+            }
+        logger.debug('unsubscribe: %s', message)
+        return self.send_message(message, errback)
 
 class BayeuxProducer(object):
     implements(IBodyProducer)
@@ -207,7 +663,6 @@ class BayeuxProducer(object):
             consumer: The consumer to write to
         Returns:
         """
-        logging.debug("BayeuxProducer.startProducing: message to send:\n%s", self.body)
         consumer.write(self.body)
         return succeed(None)
 
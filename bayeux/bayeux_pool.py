@@ -0,0 +1,125 @@
+from urlparse import urlsplit
+
+from twisted.internet import defer, reactor
+from twisted.web.client import Agent, CookieAgent, HTTPConnectionPool
+
+from . import bayeux_constants
+
+class CountingConnectionPool(HTTPConnectionPool):
+    """HTTPConnectionPool that counts how often its connections are reused.
+
+    Twisted's HTTP/1.1 client sends one request at a time on a connection,
+    so reuse is what saves setting up TCP and TLS again.
+
+    Attributes:
+        requests: Number of connections handed out for a request
+        opened: Number of new connections opened for a request
+    """
+    def __init__(self, reactor, persistent=True):
+        HTTPConnectionPool.__init__(self, reactor, persistent)
+        self.requests = 0
+        self.opened = 0
+
+    def getConnection(self, key, endpoint):
+        self.requests += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self.opened += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def snapshot(self):
+        """Returns the counts.
+
+        Returns:
+            A dict with the number of 'requests', the new 'connections'
+            opened for them and the requests that 'reused' a connection
+        """
+        return {
+            'requests': self.requests,
+            'connections': self.opened,
+            'reused': self.requests - self.opened,
+            }
+
+class BayeuxConnectionPool(object):
+    """Persistent HTTP connections for control and publish traffic, which
+    several senders can share.
+
+    Every sender using the pool keeps its own cookies, so sessions stay
+    separate on the server while their requests reuse the same
+    connections. The number of requests open to each host at once is
+    limited. Long-poll connects do not use this pool, each sender keeps a
+    connection of its own for them.
+
+    Attributes:
+        pool: The CountingConnectionPool the connections are kept in
+        max_per_host: Maximum number of requests open to a host
+        limits: Semaphore limiting the requests to each host, by host
+    """
+    def __init__(self, max_per_host=bayeux_constants.MAX_CONNECTIONS_PER_HOST):
+        """Initialize the pool.
+
+        Args:
+            max_per_host: Maximum number of requests open to one host at
+                          once
+        """
+        self.pool = CountingConnectionPool(reactor)
+        self.pool.maxPersistentPerHost = max_per_host
+        self.max_per_host = max_per_host
+        self.limits = {}
+
+    def agent(self, cookie_jar):
+        """Returns an agent that sends requests over the pool.
+
+        Args:
+            cookie_jar: The CookieJar holding the session's cookies
+
+        Returns:
+            The agent
+        """
+        return CookieAgent(Agent(reactor, pool=self.pool), cookie_jar)
+
+    def acquire(self, url):
+        """Waits for room to send a request to the host of a url.
+
+        Must be called on the reactor thread, and release must be called
+        once the request has completed.
+
+        Args:
+            url: The url the request is for
+
+        Returns:
+            A Deferred that fires once the request may be sent
+        """
+        key = host_key(url)
+        limit = self.limits.get(key)
+        if limit is None:
+            limit = self.limits[key] = defer.DeferredSemaphore(
+                self.max_per_host)
+        return limit.acquire()
+
+    def release(self, url):
+        """Frees the room taken by acquire.
+
+        Args:
+            url: The url the request was for
+        """
+        self.limits[host_key(url)].release()
+
+    def snapshot(self):
+        """Returns the reuse counts, see CountingConnectionPool.snapshot."""
+        return self.pool.snapshot()
+
+    def close(self):
+        """Closes the idle persistent connections.
+
+        Returns:
+            A Deferred that fires once they are closed
+        """
+        return self.pool.closeCachedConnections()
+
+def host_key(url):
+    """Returns the (scheme, host, port) a url's requests are sent to."""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    return parts.scheme, parts.hostname, port
@@ -0,0 +1,357 @@
+import struct
+import zope.interface
+from threading import RLock, Thread
+
+from twisted.internet import reactor
+from twisted.internet.protocol import Factory, ReconnectingClientFactory
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python.threadable import isInIOThread
+
+from . import bayeux_constants
+from .bayeux_codec import get_codec
+from .bayeux_logging import logger
+from .bayeux_message_parser import LazyMessage
+from .bayeux_message_receiver import BayeuxMessageReceiver
+from .interfaces import IMessengerService
+
+#Requests sent by relay clients
+SUBSCRIBE = 'subscribe'
+UNSUBSCRIBE = 'unsubscribe'
+PUBLISH = 'publish'
+
+def _frame(payload):
+    """Returns a payload with its 4 byte length prefix."""
+    return struct.pack('!I', len(payload)) + payload
+
+class RelayProtocol(Int32StringReceiver):
+    """The relay's side of the connection to one local client.
+
+    Attributes:
+        subscriptions: The patterns the local client subscribed to
+    """
+    MAX_LENGTH = bayeux_constants.RELAY_MAX_FRAME
+
+    def connectionMade(self):
+        self.subscriptions = set()
+
+    def stringReceived(self, string):
+        relay = self.factory.relay
+        try:
+            request = relay.codec.decode(string)
+            op = request['op']
+            channel = request['channel']
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Bad request from relay client: %r', string)
+            return
+        if op == SUBSCRIBE:
+            relay.subscribe(self, channel)
+        elif op == UNSUBSCRIBE:
+            relay.unsubscribe(self, channel)
+        elif op == PUBLISH:
+            d = relay.client.publish(channel, request.get('data'),
+                block=False)
+            d.addErrback(self._publish_error, channel)
+        else:
+            logger.warning('Unknown relay request: %s', op)
+
+    def _publish_error(self, reason, channel):
+        """Logs a relay client's publish that failed upstream, as the
+        relay client is not told."""
+        logger.warning('Relayed publish to %s failed: %s', channel,
+            reason.getErrorMessage())
+
+    def connectionLost(self, reason):
+        relay = self.factory.relay
+        for pattern in list(self.subscriptions):
+            relay.unsubscribe(self, pattern)
+
+class BayeuxRelay(object):
+    """Shares one upstream bayeux session with local processes.
+
+    The relay subscribes to the upstream server through its BayeuxClient
+    on behalf of RelayClients that connect to it over a Unix domain
+    socket, so the server sees a single session however many processes
+    on the host consume the channels. A pattern is subscribed upstream
+    while at least one local client wants it. Each message is encoded
+    once for each pattern it matched, and the same frame is written to
+    every local client subscribed to that pattern.
+
+    Frames are a 4 byte big endian length followed by the message encoded
+    with the codec. Relay clients send subscribe, unsubscribe and publish
+    requests the same way.
+
+    Attributes:
+        client: The BayeuxClient keeping the upstream session
+        path: The path of the Unix domain socket
+        codec: Codec used for the frames, shared with the RelayClients
+        subscribers: The local connections subscribed to each pattern
+        listeners: The listener registered upstream for each pattern
+        port: The listening port, None when not listening
+        frames: Number of message frames encoded
+        writes: Number of message frames written to local clients
+    """
+    def __init__(self, client, path, codec=None):
+        """Initialize the relay.
+
+        Args:
+            client: The BayeuxClient to share
+            path: The path of the Unix domain socket to listen on
+            codec: The codec for the frames, see bayeux_codec.get_codec.
+                   The relay clients must use the same one.
+        """
+        self.client = client
+        self.path = path
+        self.codec = get_codec(codec)
+        self.subscribers = {}
+        self.listeners = {}
+        self.port = None
+        self.frames = 0
+        self.writes = 0
+
+    def start(self):
+        """Starts the upstream client and listens for local clients."""
+        self.client.start()
+        reactor.callFromThread(self._listen)
+
+    def _listen(self):
+        factory = Factory()
+        factory.protocol = RelayProtocol
+        factory.relay = self
+        self.port = reactor.listenUNIX(self.path, factory)
+
+    def stop(self):
+        """Stops listening and disconnects the local clients.
+
+        The upstream client is left running, stop it separately.
+        """
+        reactor.callFromThread(self._close)
+
+    def _close(self):
+        if self.port is not None:
+            self.port.stopListening()
+            self.port = None
+        for connections in list(self.subscribers.values()):
+            for protocol in list(connections):
+                protocol.transport.loseConnection()
+
+    def subscribe(self, protocol, pattern):
+        """Subscribes a local client to a pattern. Must be called on the
+        reactor thread.
+
+        Args:
+            protocol: The RelayProtocol of the local client
+            pattern: The channel pattern
+        """
+        protocol.subscriptions.add(pattern)
+        connections = self.subscribers.get(pattern)
+        if connections is None:
+            connections = self.subscribers[pattern] = set()
+            listener = self.listeners[pattern] = (
+                lambda msg: self._forward(pattern, msg))
+            try:
+                self.client.register(pattern, listener)
+            except ValueError as e:
+                logger.warning('Bad relay subscription: %s', e)
+                del self.subscribers[pattern]
+                del self.listeners[pattern]
+                protocol.subscriptions.discard(pattern)
+                return
+        connections.add(protocol)
+
+    def unsubscribe(self, protocol, pattern):
+        """Unsubscribes a local client from a pattern, and the upstream
+        session once no local client wants it. Must be called on the
+        reactor thread.
+
+        Args:
+            protocol: The RelayProtocol of the local client
+            pattern: The channel pattern
+        """
+        protocol.subscriptions.discard(pattern)
+        connections = self.subscribers.get(pattern)
+        if connections is None:
+            return
+        connections.discard(protocol)
+        if not connections:
+            del self.subscribers[pattern]
+            self.client.deregister(pattern, self.listeners.pop(pattern))
+
+    def _forward(self, pattern, msg):
+        """Writes a message to the local clients subscribed to a pattern."""
+        if not isInIOThread():
+            #Called by a dispatcher worker
+            reactor.callFromThread(self._forward, pattern, msg)
+            return
+        connections = self.subscribers.get(pattern)
+        if not connections:
+            return
+        if isinstance(msg, LazyMessage):
+            msg.decode()
+        frame = _frame(self.codec.encode([pattern, msg]))
+        self.frames += 1
+        for protocol in connections:
+            protocol.transport.write(frame)
+        self.writes += len(connections)
+
+class RelayClientProtocol(Int32StringReceiver):
+    """A RelayClient's connection to the relay."""
+    MAX_LENGTH = bayeux_constants.RELAY_MAX_FRAME
+
+    def connectionMade(self):
+        self.factory.resetDelay()
+        self.factory.client.connected(self)
+
+    def stringReceived(self, string):
+        client = self.factory.client
+        try:
+            pattern, msg = client.receiver.codec.decode(string)
+        except (ValueError, TypeError):
+            logger.warning('Bad frame from relay: %r', string)
+            return
+        client.received(pattern, msg)
+
+    def connectionLost(self, reason):
+        self.factory.client.disconnected(self)
+
+class RelayClient(object):
+    zope.interface.implements(IMessengerService)
+    """Client that receives bayeux messages through a BayeuxRelay.
+
+    Used like a BayeuxClient, but subscriptions and publishes go to the
+    relay over its Unix domain socket instead of to the server. The
+    connection is retried if the relay goes away, and the subscriptions
+    are sent again once it is back. Publishes made while disconnected are
+    dropped.
+
+    Attributes:
+        path: The path of the relay's Unix domain socket
+        receiver: Holds the listeners and calls them through its
+                  dispatcher
+        subscriptions: The patterns subscribed to
+        factory: The factory connecting to the relay
+        protocol: The connection to the relay, None while disconnected
+        started: Whether the client has been started
+        lock: Guards the subscriptions
+    """
+    def __init__(self, path, codec=None, dispatcher=None):
+        """Initialize the client.
+
+        Args:
+            path: The path of the relay's Unix domain socket
+            codec: The codec for the frames, the same as the relay's
+            dispatcher: How listener callbacks are called, see
+                        BayeuxClient
+        """
+        self.path = path
+        self.receiver = BayeuxMessageReceiver(dispatcher, codec)
+        self.subscriptions = set()
+        self.factory = ReconnectingClientFactory()
+        self.factory.protocol = RelayClientProtocol
+        self.factory.client = self
+        self.factory.maxDelay = bayeux_constants.RELAY_RECONNECT_MAX
+        self.protocol = None
+        self.started = False
+        self.lock = RLock()
+
+    def start(self):
+        """Connects to the relay, running the reactor if it is not."""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            if not reactor.running:
+                thread = Thread(name='RelayClient-Thread', target=reactor.run,
+                    args=(False,))
+                thread.daemon = True
+                thread.start()
+            reactor.callFromThread(self._connect)
+
+    def _connect(self):
+        self.factory.continueTrying = True
+        reactor.connectUNIX(self.path, self.factory)
+
+    def stop(self):
+        """Disconnects from the relay."""
+        with self.lock:
+            if not self.started:
+                return
+            self.started = False
+            reactor.callFromThread(self._disconnect)
+
+    def _disconnect(self):
+        self.factory.stopTrying()
+        if self.protocol is not None:
+            self.protocol.transport.loseConnection()
+
+    def register(self, id, callback):
+        """Subscribe for a particular event.
+
+        Args:
+            id: The event to subscribe to (e.g. '/foo/bar' or '/foo/*')
+            callback: The callback to trigger upon receipt of the message
+        """
+        with self.lock:
+            self.receiver.register(id, callback)
+            if id not in self.subscriptions:
+                self.subscriptions.add(id)
+                self._send({'op': SUBSCRIBE, 'channel': id})
+
+    def deregister(self, id, callback):
+        """Unsubscribe for a particular event.
+
+        Args:
+            id: The event to unsubscribe from
+            callback: The callback to unsubscribe
+        """
+        with self.lock:
+            if (self.receiver.deregister(id, callback) == 0 and
+                    id in self.subscriptions):
+                self.subscriptions.remove(id)
+                self._send({'op': UNSUBSCRIBE, 'channel': id})
+
+    def publish(self, id, data):
+        """Publishes data to a channel through the relay's session.
+
+        The relay does not report whether the server accepted it.
+
+        Args:
+            id: The channel to publish to
+            data: The data to publish
+        """
+        self._send({'op': PUBLISH, 'channel': id, 'data': data})
+
+    def _send(self, request):
+        """Sends a request to the relay from any thread."""
+        frame = _frame(self.receiver.codec.encode(request))
+        if isInIOThread():
+            self._write(frame, request)
+        else:
+            reactor.callFromThread(self._write, frame, request)
+
+    def _write(self, frame, request):
+        if self.protocol is not None:
+            self.protocol.transport.write(frame)
+        elif request['op'] == PUBLISH:
+            logger.warning('Not connected to the relay, dropping publish to '
+                '%s', request['channel'])
+
+    def connected(self, protocol):
+        """Called once connected to the relay, to send the subscriptions."""
+        self.protocol = protocol
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for pattern in subscriptions:
+            protocol.transport.write(_frame(self.receiver.codec.encode(
+                {'op': SUBSCRIBE, 'channel': pattern})))
+
+    def disconnected(self, protocol):
+        """Called when the connection to the relay is lost."""
+        if self.protocol is protocol:
+            self.protocol = None
+
+    def received(self, pattern, msg):
+        """Delivers a message from the relay to the pattern's listeners."""
+        listeners = self.receiver.listeners.get(pattern)
+        if listeners:
+            self.receiver.dispatcher.dispatch(msg.get('channel'),
+                list(listeners), msg)
@@ -0,0 +1,385 @@
+import collections
+import json
+import os
+import threading
+
+from twisted.internet import reactor
+from twisted.python.threadable import isInIOThread
+
+from . import bayeux_constants
+from .bayeux_channel_trie import DEEP_WILDCARD, WILDCARD
+from .bayeux_dispatcher import HeldListener
+from .bayeux_logging import logger
+
+class ReplayStore(object):
+    """Append-only store of the last replay id seen on each channel.
+
+    Every update is appended to the file as one JSON line and the last
+    line for a channel wins when the file is loaded, so nothing is ever
+    rewritten in place and a crash can only lose updates that had not
+    been synced yet. Updates are buffered and written in one go every
+    sync_every updates or when sync is called. Once the file holds
+    compact_lines records, mostly stale ones, it is rewritten with just
+    the current cursors.
+
+    Without a path the cursors are only kept in memory, which still lets
+    a client resume after it has to handshake again.
+
+    Attributes:
+        path: The file the cursors are kept in, None to keep them in memory
+        cursors: The last replay id by channel
+        pending: Updates not yet written, by channel
+        sync_every: Number of buffered updates that triggers a sync
+        fsync: Whether each sync waits for the data to reach the disk
+        compact_lines: Number of records in the file that triggers a
+                       rewrite
+        lines: Number of records in the file
+        file: The file open for appending
+        lock: Guards the cursors and the file
+    """
+    def __init__(self, path=None,
+        sync_every=bayeux_constants.REPLAY_SYNC_EVERY, fsync=True,
+        compact_lines=bayeux_constants.REPLAY_COMPACT_LINES):
+        """Initialize the store, loading any cursors already in the file.
+
+        Args:
+            path: The file to keep the cursors in, None to keep them in
+                  memory
+            sync_every: Number of buffered updates that triggers a sync
+            fsync: Whether each sync waits for the data to reach the disk
+            compact_lines: Number of records in the file that triggers a
+                           rewrite
+        """
+        self.path = path
+        self.cursors = {}
+        self.pending = {}
+        self.sync_every = sync_every
+        self.fsync = fsync
+        self.compact_lines = compact_lines
+        self.lines = 0
+        self.file = None
+        self.lock = threading.Lock()
+        if path is not None:
+            self._load()
+            self.file = open(path, 'a')
+
+    def _load(self):
+        """Reads the cursors from the file."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    channel, replay_id = json.loads(line)
+                except ValueError:
+                    #A record cut short by a crash, the ones before it stand
+                    logger.warning('Skipping bad record in %s: %r',
+                        self.path, line)
+                    continue
+                self.cursors[channel] = replay_id
+                self.lines += 1
+
+    def get(self, channel):
+        """Returns the last replay id seen on a channel, None if there is
+        none."""
+        return self.cursors.get(channel)
+
+    def under(self, pattern):
+        """Returns the last replay id seen on each channel a wildcard
+        pattern matches.
+
+        Args:
+            pattern: The channel pattern (e.g. '/foo/*')
+
+        Returns:
+            A dict of replay ids by channel
+        """
+        prefix = pattern.strip('/').split('/')
+        wildcard = prefix.pop()
+        with self.lock:
+            cursors = list(self.cursors.items())
+        matched = {}
+        for channel, replay_id in cursors:
+            segments = channel.strip('/').split('/')
+            if (segments[:len(prefix)] == prefix and
+                    len(segments) > len(prefix) and
+                    (wildcard == DEEP_WILDCARD or
+                        len(segments) == len(prefix) + 1)):
+                matched[channel] = replay_id
+        return matched
+
+    def record(self, channel, replay_id):
+        """Records the replay id of a message.
+
+        Args:
+            channel: The channel the message was received on
+            replay_id: The message's replay id
+        """
+        with self.lock:
+            self.cursors[channel] = replay_id
+            if self.file is None:
+                return
+            self.pending[channel] = replay_id
+            if len(self.pending) < self.sync_every:
+                return
+            self._sync()
+
+    def sync(self):
+        """Writes the buffered updates to the file."""
+        with self.lock:
+            self._sync()
+
+    def _sync(self):
+        if not self.pending or self.file is None:
+            return
+        pending, self.pending = self.pending, {}
+        self.file.write(''.join(_record(channel, replay_id)
+            for channel, replay_id in pending.items()))
+        self.lines += len(pending)
+        if (self.lines >= self.compact_lines and
+                self.lines > 2 * len(self.cursors)):
+            self._compact()
+        else:
+            self._flush(self.file)
+
+    def _compact(self):
+        """Rewrites the file with only the current cursors.
+
+        The new file is written alongside and renamed over the old one,
+        so the store is never left without a complete copy.
+        """
+        self.file.close()
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(''.join(_record(channel, replay_id)
+                for channel, replay_id in self.cursors.items()))
+            self._flush(f)
+        os.rename(temp, self.path)
+        self.lines = len(self.cursors)
+        self.file = open(self.path, 'a')
+
+    def _flush(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def close(self):
+        """Syncs and closes the file."""
+        with self.lock:
+            self._sync()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class DeliveryListener(HeldListener):
+    """Listener dispatched after a message's listeners, telling the
+    BayeuxReplay the message has been delivered, or dropped."""
+    def __init__(self, replay, channel, entry):
+        """Initialize the listener.
+
+        Args:
+            replay: The BayeuxReplay to tell
+            channel: The channel the message was received on
+            entry: The message's entry in the replay's pending
+        """
+        HeldListener.__init__(self,
+            lambda msg: replay.delivered(channel, entry))
+
+    def dropped(self, msg):
+        self.callback(msg)
+
+def _record(channel, replay_id):
+    """Returns the line that stores a cursor."""
+    return json.dumps([channel, replay_id], separators=(',', ':')) + '\n'
+
+def replay_id(msg):
+    """Returns the replay id of a message.
+
+    Uses the replayId in the event of the message data, as Salesforce
+    streaming sends it, or else the message's own id.
+
+    Args:
+        msg: The message
+
+    Returns:
+        The replay id, None if the message has none
+    """
+    data = msg.get('data')
+    if isinstance(data, dict):
+        event = data.get('event')
+        if isinstance(event, dict) and 'replayId' in event:
+            return event['replayId']
+    return msg.get('id')
+
+class BayeuxReplay(object):
+    """Replay extension that resumes subscriptions where they left off.
+
+    Asks for replay support in the handshake, tracks the replay id of
+    every message received, and sends the last one seen on a channel in
+    the ext of its subscribe. After a new handshake or a restart the
+    server then sends what was published in between.
+
+    Cursors are kept by the channel each message arrived on, so the
+    subscribe to a wildcard pattern carries the cursor of every channel
+    it matches that has one, along with the default for the pattern.
+
+    A channel's cursor only moves past a message once its listeners have
+    run, and every message received on the channel before it has been
+    delivered too, so messages still waiting in a threaded dispatcher's
+    queues are replayed after a crash. Messages a dispatcher drops count
+    as delivered. Messages a conflating or batching listener holds back
+    count as delivered once they are handed to it.
+
+    Attributes:
+        store: The ReplayStore holding the cursors
+        default: Replay id sent for channels without a cursor (e.g. -1
+                 for new messages only, -2 for everything the server
+                 still has), None to send none
+        key: Function returning a message's replay id
+        sync_interval: Longest time in seconds an update waits to be
+                       written
+        sync_call: The pending delayed call that syncs the store
+        pending: The [replay id, delivered] of the messages dispatched
+                 and not yet recorded, in order, by channel
+    """
+    def __init__(self, store=None, default=None, key=replay_id,
+        sync_interval=bayeux_constants.REPLAY_SYNC_INTERVAL):
+        """Initialize the extension.
+
+        Args:
+            store: A ReplayStore, or the path of the file for one. By
+                   default cursors are only kept in memory.
+            default: Replay id to send for channels without a cursor
+            key: Function returning the replay id of a message, or None
+                 if it has none
+            sync_interval: Longest time in seconds an update waits to be
+                           written
+        """
+        if not isinstance(store, ReplayStore):
+            store = ReplayStore(store)
+        self.store = store
+        self.default = default
+        self.key = key
+        self.sync_interval = sync_interval
+        self.sync_call = None
+        self.pending = {}
+
+    def handshake_ext(self):
+        """Returns the ext to send with a handshake."""
+        return {'replay': True}
+
+    def subscribe_ext(self, subscription):
+        """Returns the ext to send with a subscribe.
+
+        Args:
+            subscription: The channel being subscribed to, or a list of
+                          them sent in one message
+
+        Returns:
+            The ext, None if there is no replay id to send
+        """
+        if not isinstance(subscription, list):
+            subscription = [subscription]
+        cursors = {}
+        for channel in subscription:
+            if channel.rstrip('/').endswith(WILDCARD):
+                cursors.update(self.store.under(channel))
+                if self.default is not None:
+                    cursors[channel] = self.default
+                continue
+            cursor = self.store.get(channel)
+            if cursor is None:
+                cursor = self.default
+            if cursor is not None:
+                cursors[channel] = cursor
+        if not cursors:
+            return None
+        return {'replay': cursors}
+
+    def seen(self, channel, msg):
+        """Records a message that has been delivered.
+
+        Must be called on the reactor thread.
+
+        Args:
+            channel: The channel the message was received on
+            msg: The message
+        """
+        cursor = self.key(msg)
+        if cursor is not None:
+            self._record(channel, cursor)
+
+    def _record(self, channel, cursor):
+        self.store.record(channel, cursor)
+        if self.store.pending and self.sync_call is None:
+            self.sync_call = reactor.callLater(self.sync_interval,
+                self._sync_later)
+
+    def dispatching(self, channel, msg):
+        """Notes a message about to be dispatched, so its cursor is
+        recorded once it has been delivered.
+
+        Must be called on the reactor thread, in the order the messages
+        were received.
+
+        Args:
+            channel: The channel the message was received on
+            msg: The message
+
+        Returns:
+            A listener to dispatch after the message's listeners, which
+            records the cursor when called or when its delivery is
+            dropped, or None if the message has no replay id
+        """
+        cursor = self.key(msg)
+        if cursor is None:
+            return None
+        entry = [cursor, False]
+        self.pending.setdefault(channel, collections.deque()).append(entry)
+        return DeliveryListener(self, channel, entry)
+
+    def delivered(self, channel, entry):
+        """Marks a dispatched message delivered, recording the cursor of
+        the last message on the channel delivered along with every one
+        before it. May be called from any thread.
+
+        Args:
+            channel: The channel the message was received on
+            entry: The message's entry in pending
+        """
+        if not isInIOThread():
+            #Called by a dispatcher worker
+            reactor.callFromThread(self.delivered, channel, entry)
+            return
+        entry[1] = True
+        queue = self.pending.get(channel)
+        cursor = None
+        while queue and queue[0][1]:
+            cursor = queue.popleft()[0]
+        if not queue:
+            self.pending.pop(channel, None)
+        if cursor is not None:
+            self._record(channel, cursor)
+
+    def _sync_later(self):
+        self.sync_call = None
+        self.store.sync()
+
+    def sync(self):
+        """Writes any buffered cursor updates to the store. May be called
+        from any thread."""
+        self.store.sync()
+
+    def close(self):
+        """Syncs and closes the store. May be called from any thread."""
+        if isInIOThread():
+            self._cancel_sync()
+        else:
+            reactor.callFromThread(self._cancel_sync)
+        self.store.close()
+
+    def _cancel_sync(self):
+        if self.sync_call is not None:
+            if self.sync_call.active():
+                self.sync_call.cancel()
+            self.sync_call = None
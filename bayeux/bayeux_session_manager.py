@@ -0,0 +1,126 @@
+from threading import RLock
+
+from twisted.internet import reactor
+
+from . import bayeux_constants
+from .bayeux_client import BayeuxClient
+from .bayeux_pool import BayeuxConnectionPool
+
+class BayeuxSessionManager(object):
+    """Runs many independent bayeux sessions in one process.
+
+    Each session is a BayeuxClient with its own server, credentials,
+    cookies and subscriptions. They share the reactor and a
+    BayeuxConnectionPool, so sessions on the same host reuse each other's
+    persistent connections and are held to one limit on the requests open
+    to it. Sessions are started, stopped and removed one at a time, and
+    none of that stops the reactor.
+
+    Attributes:
+        pool: The BayeuxConnectionPool shared by the sessions
+        defaults: Keyword arguments passed to every BayeuxClient
+        sessions: The clients by session name
+        lock: Guards the sessions
+    """
+    def __init__(self, max_per_host=bayeux_constants.MAX_CONNECTIONS_PER_HOST,
+        **defaults):
+        """Initialize the manager.
+
+        Args:
+            max_per_host: Maximum number of requests, other than long-poll
+                          connects, open to one host at once over all of
+                          the sessions
+            defaults: Keyword arguments for BayeuxClient used by every
+                      session unless add_session overrides them
+        """
+        self.pool = BayeuxConnectionPool(max_per_host)
+        self.defaults = defaults
+        self.sessions = {}
+        self.lock = RLock()
+
+    def add_session(self, name, server, **kwargs):
+        """Creates a session.
+
+        The session is not started, register its listeners and then call
+        start on it or on the manager.
+
+        Args:
+            name: Name to refer to the session by
+            server: The bayeux server the session connects to
+            kwargs: Keyword arguments for BayeuxClient, on top of the
+                    manager's defaults
+
+        Returns:
+            The session's BayeuxClient
+
+        Raises:
+            ValueError: If there already is a session with that name
+        """
+        options = dict(self.defaults)
+        options.update(kwargs)
+        with self.lock:
+            if name in self.sessions:
+                raise ValueError('There already is a session named %s' % name)
+            client = BayeuxClient(server, pool=self.pool,
+                manage_reactor=False, **options)
+            self.sessions[name] = client
+        return client
+
+    def get_session(self, name):
+        """Returns the BayeuxClient for a session, or None if there is no
+        session with that name."""
+        with self.lock:
+            return self.sessions.get(name)
+
+    def remove_session(self, name):
+        """Stops a session, disconnecting it from its server, and lets go
+        of its connections.
+
+        Args:
+            name: The session's name
+
+        Returns:
+            The session's BayeuxClient, None if there was no such session
+        """
+        with self.lock:
+            client = self.sessions.pop(name, None)
+        if client is not None:
+            client.stop()
+            client.destroy()
+        return client
+
+    def start(self):
+        """Starts every session that has not been started."""
+        with self.lock:
+            clients = list(self.sessions.values())
+        for client in clients:
+            client.start()
+
+    def stop(self):
+        """Stops every session. They can be started again."""
+        with self.lock:
+            clients = list(self.sessions.values())
+        for client in clients:
+            client.stop()
+
+    def stats(self):
+        """Returns the stats of every session that records them.
+
+        Returns:
+            A dict of BayeuxClient.stats snapshots by session name
+        """
+        with self.lock:
+            clients = list(self.sessions.items())
+        return dict((name, client.stats()) for name, client in clients
+            if client.receiver.stats is not None)
+
+    def close(self):
+        """Removes every session and closes the idle shared connections.
+
+        The reactor is left running.
+        """
+        with self.lock:
+            names = list(self.sessions)
+        for name in names:
+            self.remove_session(name)
+        reactor.callFromThread(self.pool.close)
@@ -0,0 +1,404 @@
+import bisect
+import hashlib
+import os
+import pickle
+import struct
+import subprocess
+import sys
+import time
+import zope.interface
+from threading import RLock
+
+from . import bayeux_constants
+from .bayeux_logging import logger
+from .interfaces import IMessengerService
+
+#The directory holding the package, found while the working directory is
+#still the one it was imported from
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class HashRing(object):
+    """Consistent hash ring assigning keys to nodes.
+
+    Every node is placed on the ring at several points, and a key belongs
+    to the node at the first point after the key's hash. Adding or
+    removing a node only moves the keys next to its points, about one in
+    every number of nodes.
+
+    Attributes:
+        replicas: Number of points for each node
+        points: The sorted hashes of the points
+        nodes: The node at each point, by hash
+    """
+    def __init__(self, nodes=(), replicas=bayeux_constants.SHARD_REPLICAS):
+        """Initialize the ring.
+
+        Args:
+            nodes: The nodes to start with
+            replicas: Number of points for each node
+        """
+        self.replicas = replicas
+        self.points = []
+        self.nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        """Adds a node to the ring."""
+        for i in range(self.replicas):
+            point = _hash('%s-%d' % (node, i))
+            self.nodes[point] = node
+            bisect.insort(self.points, point)
+
+    def remove(self, node):
+        """Removes a node from the ring."""
+        for i in range(self.replicas):
+            point = _hash('%s-%d' % (node, i))
+            if self.nodes.get(point) == node:
+                del self.nodes[point]
+                self.points.remove(point)
+
+    def node_for(self, key):
+        """Returns the node a key belongs to.
+
+        Raises:
+            ValueError: If the ring has no nodes
+        """
+        if not self.points:
+            raise ValueError('The hash ring has no nodes')
+        i = bisect.bisect(self.points, _hash(key)) % len(self.points)
+        return self.nodes[self.points[i]]
+
+def _hash(key):
+    """Returns a stable hash of a string, the same in every process."""
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+class Shard(object):
+    """The parent's handle on one worker process.
+
+    The worker runs a BayeuxClient and takes commands from the parent on
+    its stdin, answering each on its stdout, as pickles. Commands carry a
+    4 byte length prefix so the worker can skip one it cannot unpickle.
+
+    Attributes:
+        name: The shard's name on the hash ring
+        process: The worker process
+        lock: Keeps one command at a time on the pipes
+    """
+    def __init__(self, name, server, client_kwargs):
+        """Starts the worker process.
+
+        Args:
+            name: The shard's name
+            server: The bayeux server its client connects to
+            client_kwargs: Keyword arguments for its BayeuxClient
+        """
+        self.name = name
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([_PACKAGE_ROOT] +
+            [os.path.abspath(path) for path in sys.path if path])
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', __name__], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, env=env)
+        self.lock = RLock()
+        self.call('init', server, client_kwargs)
+
+    def call(self, command, *args):
+        """Runs a command in the worker and returns its result.
+
+        Raises:
+            Whatever the command raised in the worker, or EOFError if the
+            worker has exited
+        """
+        payload = pickle.dumps((command, args), pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.process.stdin.write(struct.pack('!I', len(payload)) + payload)
+            self.process.stdin.flush()
+            ok, result = pickle.load(self.process.stdout)
+        if not ok:
+            raise result
+        return result
+
+    def alive(self):
+        """Returns whether the worker process is running."""
+        return self.process.poll() is None
+
+    def close(self):
+        """Stops the worker's client and waits for the worker to exit."""
+        if self.alive():
+            try:
+                self.call('close')
+            except (EOFError, IOError):
+                pass
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+
+class ShardedBayeuxClient(object):
+    zope.interface.implements(IMessengerService)
+    """Spreads subscriptions over several worker processes.
+
+    Each worker process runs its own BayeuxClient with its own session,
+    decoding and calling the listeners of its share of the channels, so
+    throughput grows with the number of cores. Channels are assigned to
+    workers by consistent hashing of their names, and resize moves only
+    the channels whose worker changed.
+
+    Listeners run in the worker processes, so they must be picklable,
+    such as functions defined at the top level of a module.
+
+    Attributes:
+        server: The bayeux server the workers connect to
+        client_kwargs: Keyword arguments for each worker's BayeuxClient
+        ring: The HashRing assigning channels to shards
+        shards: The Shards by name
+        listeners: The listeners registered for each channel
+        started: Whether the workers' clients have been started
+        lock: Guards the shards and listeners
+    """
+    def __init__(self, server, shards=bayeux_constants.SHARDS,
+        replicas=bayeux_constants.SHARD_REPLICAS, **client_kwargs):
+        """Initialize the client and start its worker processes.
+
+        Args:
+            server: The bayeux server to connect to
+            shards: Number of worker processes
+            replicas: Number of points for each shard on the hash ring
+            client_kwargs: Keyword arguments for each BayeuxClient
+        """
+        self.server = server
+        self.client_kwargs = client_kwargs
+        self.ring = HashRing(replicas=replicas)
+        self.shards = {}
+        self.listeners = {}
+        self.started = False
+        self.lock = RLock()
+        self.resize(shards)
+
+    def shard_for(self, id):
+        """Returns the Shard that handles a channel."""
+        with self.lock:
+            return self.shards[self.ring.node_for(id)]
+
+    def start(self):
+        """Starts the client in every worker."""
+        with self.lock:
+            self.started = True
+            for shard in self.shards.values():
+                shard.call('start')
+
+    def stop(self):
+        """Stops the client in every worker. It can be started again."""
+        with self.lock:
+            self.started = False
+            for shard in self.shards.values():
+                shard.call('stop')
+
+    def close(self):
+        """Stops every worker process."""
+        with self.lock:
+            shards = list(self.shards.values())
+            self.shards = {}
+        for shard in shards:
+            shard.close()
+
+    def register(self, id, callback):
+        """Subscribe for a particular event in the worker that handles it.
+
+        Args:
+            id: The event to subscribe to (e.g. '/foo/bar' or '/foo/*')
+            callback: The picklable callback to trigger upon receipt of
+                      the message
+        """
+        with self.lock:
+            self.shard_for(id).call('register', id, callback)
+            self.listeners.setdefault(id, []).append(callback)
+
+    def deregister(self, id, callback):
+        """Unsubscribe for a particular event.
+
+        Args:
+            id: The event to unsubscribe from
+            callback: The callback to unsubscribe
+        """
+        with self.lock:
+            self.shard_for(id).call('deregister', id, callback)
+            callbacks = self.listeners.get(id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self.listeners.pop(id, None)
+
+    def publish(self, id, data):
+        """Publish data through the session of the worker that handles
+        the channel, without waiting for the server to acknowledge it.
+
+        Args:
+            id: The channel to publish to
+            data: The data to publish
+        """
+        self.shard_for(id).call('publish', id, data)
+
+    def resize(self, shards):
+        """Changes the number of worker processes.
+
+        Channels whose worker changes are deregistered from the old one
+        and registered with the new one.
+
+        Args:
+            shards: The number of worker processes
+        """
+        if shards < 1:
+            raise ValueError('There must be at least one shard')
+        with self.lock:
+            before = dict((id, self.ring.node_for(id))
+                for id in self.listeners) if self.shards else {}
+            names = ['shard-%d' % i for i in range(shards)]
+            for name in names:
+                if name not in self.shards:
+                    shard = Shard(name, self.server, self.client_kwargs)
+                    if self.started:
+                        shard.call('start')
+                    self.shards[name] = shard
+                    self.ring.add(name)
+            removed = [self.shards[name] for name in self.shards
+                if name not in names]
+            for shard in removed:
+                self.ring.remove(shard.name)
+            for id, old in before.items():
+                new = self.ring.node_for(id)
+                if new == old:
+                    continue
+                for callback in self.listeners[id]:
+                    if old in self.shards and self.shards[old].alive():
+                        self.shards[old].call('deregister', id, callback)
+                    self.shards[new].call('register', id, callback)
+            for shard in removed:
+                del self.shards[shard.name]
+                shard.close()
+
+    def health(self):
+        """Returns the state of every worker.
+
+        Returns:
+            A dict by shard name of dicts with whether the worker is
+            'alive', its 'pid', the 'channels' it handles and, if it is
+            alive, whether its client is 'started' and 'handshook'
+        """
+        with self.lock:
+            shards = list(self.shards.values())
+            counts = {}
+            for id in self.listeners:
+                name = self.ring.node_for(id)
+                counts[name] = counts.get(name, 0) + 1
+        health = {}
+        for shard in shards:
+            state = {'alive': shard.alive(), 'pid': shard.process.pid,
+                'channels': counts.get(shard.name, 0)}
+            if state['alive']:
+                try:
+                    state.update(shard.call('health'))
+                except (EOFError, IOError):
+                    state['alive'] = False
+            health[shard.name] = state
+        return health
+
+    def stats(self):
+        """Returns the stats of every worker and their totals.
+
+        The workers' clients must have been created with stats.
+
+        Returns:
+            A dict with the 'counters' and 'channels' of every worker
+            added up, and each worker's BayeuxClient.stats snapshot under
+            'shards' by shard name
+        """
+        with self.lock:
+            shards = list(self.shards.values())
+        snapshots = dict((shard.name, shard.call('stats'))
+            for shard in shards)
+        counters = {}
+        channels = {}
+        for snapshot in snapshots.values():
+            if snapshot is None:
+                continue
+            _add(counters, snapshot['counters'])
+            for channel, counts in snapshot['channels'].items():
+                _add(channels.setdefault(channel, {}), counts)
+        return {'counters': counters, 'channels': channels,
+            'shards': snapshots}
+
+def _add(totals, counts):
+    """Adds counts to totals by name."""
+    for name, count in counts.items():
+        totals[name] = totals.get(name, 0) + count
+
+def _read(stream, size):
+    """Reads exactly size bytes, or returns None at the end of the stream."""
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def _publish_error(reason, channel):
+    """Logs a publish that failed in a worker, as the parent is not told."""
+    logger.warning('Shard publish to %s failed: %s', channel,
+        reason.getErrorMessage())
+
+def _serve():
+    """Runs a worker, taking commands from the parent on stdin.
+
+    The parent reads replies from stdout, so anything the worker prints
+    goes to stderr instead.
+    """
+    #Imported here so the parent never loads the reactor for its workers
+    from twisted.internet import reactor
+    from .bayeux_client import BayeuxClient
+    commands = getattr(sys.stdin, 'buffer', sys.stdin)
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    client = None
+    while True:
+        header = _read(commands, 4)
+        if header is None:
+            break
+        payload = _read(commands, struct.unpack('!I', header)[0])
+        if payload is None:
+            break
+        command = None
+        try:
+            command, args = pickle.loads(payload)
+            if command == 'init':
+                server, client_kwargs = args
+                client = BayeuxClient(server, **client_kwargs)
+                result = None
+            elif command == 'publish':
+                d = client.publish(args[0], args[1], block=False)
+                d.addErrback(_publish_error, args[0])
+                result = None
+            elif command == 'health':
+                result = {'started': client.started,
+                    'handshook': client.is_handshook}
+            elif command == 'close':
+                client.destroy()
+                #Let the disconnect finish before the worker exits
+                deadline = time.time() + bayeux_constants.SHARD_CLOSE_TIMEOUT
+                while reactor.running and time.time() < deadline:
+                    time.sleep(0.01)
+                result = None
+            else:
+                result = getattr(client, command)(*args)
+            reply = (True, result)
+        except Exception as e:
+            logger.exception('Shard command %s failed', command)
+            reply = (False, e)
+        pickle.dump(reply, replies, pickle.HIGHEST_PROTOCOL)
+        replies.flush()
+        if command == 'close':
+            break
+
+if __name__ == '__main__':
+    _serve()
@@ -0,0 +1,249 @@
+import math
+import threading
+import time
+
+from .bayeux_logging import logger
+
+#Counters
+HANDSHAKES = 'handshakes' #Handshake requests sent
+RECONNECTS = 'reconnects' #Reconnects after a failed connect or handshake
+MESSAGES_SENT = 'messages_sent' #Messages passed to send_message
+RESPONSES = 'responses' #HTTP responses and websocket frames received
+BYTES_RECEIVED = 'bytes_received' #Bytes of responses and frames as received
+
+#Per channel counters
+RECEIVED = 'received' #Messages received on the channel
+DISPATCHED = 'dispatched' #Messages passed to at least one listener
+DUPLICATES = 'duplicates' #Messages dropped as already received
+
+#Histograms
+RESPONSE_BYTES = 'response_bytes' #Size of each response in bytes
+WIRE_BYTES = 'wire_bytes' #Size of each response as received, compressed or not
+RESPONSE_TIME = 'response_time' #Seconds from each request to its last byte
+READ_TIME = 'read_time' #Seconds from each response's headers to its end
+DECODE_TIME = 'decode_time' #Seconds taken to decode each message
+CALLBACK_TIME = 'callback_time' #Seconds spent in each listener call
+CONNECT_RTT = 'connect_rtt' #Seconds from sending a connect to its reply
+QUEUE_DEPTH = 'queue_depth' #Messages waiting to be sent, at each send
+
+class Histogram(object):
+    """Records the distribution of a value in logarithmic buckets.
+
+    Values are counted in buckets that grow by a fixed factor, so memory
+    use does not depend on the number of values recorded and percentiles
+    are accurate to within that factor.
+
+    Attributes:
+        base: Factor between the bounds of adjacent buckets
+        buckets: Number of values recorded, by bucket index
+        count: Number of values recorded
+        total: Sum of the values recorded
+        min: Smallest value recorded, None if there are none
+        max: Largest value recorded, None if there are none
+    """
+    def __init__(self, base=1.1):
+        """Initialize the histogram.
+
+        Args:
+            base: Factor between the bounds of adjacent buckets
+        """
+        self.base = base
+        self.log_base = math.log(base)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """Records a value.
+
+        Args:
+            value: The value, values of zero or less share one bucket
+        """
+        if value > 0:
+            index = int(math.floor(math.log(value) / self.log_base))
+        else:
+            index = None
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """Returns an estimate of a percentile.
+
+        Args:
+            p: The percentile, between 0 and 100
+
+        Returns:
+            The upper bound of the bucket holding the percentile, limited
+            to the largest value recorded, or None if nothing is recorded
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        #Put the bucket for zero and below first
+        for index in sorted(self.buckets, key=lambda i: (i is not None, i)):
+            seen += self.buckets[index]
+            if seen >= rank:
+                if index is None:
+                    return max(self.min, 0)
+                return min(self.max, self.base ** (index + 1))
+        return self.max
+
+    def snapshot(self):
+        """Returns a summary of the values recorded.
+
+        Returns:
+            A dict with the count, sum, min, max, mean, p50, p90 and p99
+        """
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.total / float(self.count) if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            }
+
+class BayeuxStats(object):
+    """Counters and histograms describing what a client is doing.
+
+    Instrumented code holds a reference to the stats, or None when they
+    are disabled, and checks it before doing any work so disabled stats
+    cost a single comparison.
+
+    Values may be recorded from any thread. Exporters are called on the
+    reactor thread with a snapshot at a fixed interval.
+
+    Attributes:
+        counters: Counts by name
+        channels: Per channel counts by channel, then by name
+        histograms: Histograms by name
+        lock: Guards the counters and histograms
+        exporters: The running exporter loops
+    """
+    def __init__(self):
+        """Initialize the stats."""
+        self.lock = threading.Lock()
+        self.exporters = []
+        self.reset()
+
+    def reset(self):
+        """Clears every counter and histogram."""
+        with self.lock:
+            self.counters = {}
+            self.channels = {}
+            self.histograms = {}
+
+    def incr(self, name, count=1):
+        """Increments a counter.
+
+        Args:
+            name: The counter name (e.g. HANDSHAKES)
+            count: Amount to add
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def incr_channel(self, channel, name):
+        """Increments a per channel counter.
+
+        Args:
+            channel: The channel
+            name: The counter name (e.g. RECEIVED)
+        """
+        with self.lock:
+            counts = self.channels.get(channel)
+            if counts is None:
+                counts = self.channels[channel] = {}
+            counts[name] = counts.get(name, 0) + 1
+
+    def observe(self, name, value):
+        """Records a value in a histogram.
+
+        Args:
+            name: The histogram name (e.g. DECODE_TIME)
+            value: The value to record
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(value)
+
+    def timed(self, listener):
+        """Wraps a listener so the time spent in it is recorded.
+
+        Args:
+            listener: The listener
+
+        Returns:
+            A callable that calls the listener, records CALLBACK_TIME and
+            returns what the listener returned, with the listener in its
+            listener attribute
+        """
+        def call(msg):
+            start = time.time()
+            try:
+                return listener(msg)
+            finally:
+                self.observe(CALLBACK_TIME, time.time() - start)
+        call.listener = listener
+        return call
+
+    def snapshot(self):
+        """Returns the current values.
+
+        Returns:
+            A dict with 'counters', 'channels' and 'histograms', each
+            histogram summarised by Histogram.snapshot
+        """
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'channels': dict((channel, dict(counts))
+                    for channel, counts in self.channels.items()),
+                'histograms': dict((name, histogram.snapshot())
+                    for name, histogram in self.histograms.items()),
+                }
+
+    def add_exporter(self, exporter, interval):
+        """Calls an exporter with a snapshot at a fixed interval.
+
+        Args:
+            exporter: Called on the reactor thread with each snapshot
+            interval: Time in seconds between snapshots
+        """
+        #Imported here so the stats can be used without Twisted by the
+        #asyncio client
+        from twisted.internet import reactor, task
+
+        def export():
+            try:
+                exporter(self.snapshot())
+            except Exception:
+                logger.exception('Error exporting stats')
+        loop = task.LoopingCall(export)
+        self.exporters.append(loop)
+        reactor.callFromThread(loop.start, interval, False)
+
+    def stop(self):
+        """Stops calling the exporters."""
+        exporters, self.exporters = self.exporters, []
+        if not exporters:
+            return
+        from twisted.internet import reactor
+
+        def stop():
+            for loop in exporters:
+                if loop.running:
+                    loop.stop()
+        reactor.callFromThread(stop)
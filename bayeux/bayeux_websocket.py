@@ -0,0 +1,236 @@
+import urlparse
+
+from twisted.internet import defer, reactor
+from twisted.internet.endpoints import HostnameEndpoint, wrapClientTLS
+from twisted.internet.error import ConnectionLost
+
+from . import bayeux_stats
+from .bayeux_logging import logger
+from .bayeux_message_parser import BayeuxMessageParser
+
+try:
+    from autobahn.twisted.websocket import (WebSocketClientFactory,
+        WebSocketClientProtocol)
+except ImportError:
+    #Websocket support is optional, without autobahn the client only
+    #uses long-polling
+    WebSocketClientFactory = None
+    WebSocketClientProtocol = object
+
+def websocket_available():
+    """Returns whether the websocket transport can be used."""
+    return WebSocketClientFactory is not None
+
+def websocket_url(server):
+    """Returns the websocket url for a bayeux server.
+
+    Args:
+        server: The http(s) url of the bayeux server
+
+    Returns:
+        The same url with a ws or wss scheme
+    """
+    scheme, rest = server.split('://', 1)
+    return ('wss' if scheme == 'https' else 'ws') + '://' + rest
+
+class BayeuxWebSocketProtocol(WebSocketClientProtocol):
+    """Protocol class for the websocket connection to the bayeux server.
+
+    Passes everything on to the BayeuxWebSocketTransport it belongs to.
+    """
+    def onOpen(self):
+        """Called once the websocket handshake has completed."""
+        self.factory.bayeux_transport.opened(self)
+
+    def onMessage(self, payload, isBinary):
+        """Called when a websocket message is received.
+
+        Args:
+            payload: The message, a JSON array of bayeux messages
+            isBinary: Whether this was a binary message
+        """
+        self.factory.bayeux_transport.message_received(payload)
+
+    def onClose(self, wasClean, code, reason):
+        """Called when the websocket connection is closed.
+
+        Args:
+            wasClean: Whether the close handshake completed
+            code: The close status code
+            reason: The close reason
+        """
+        self.factory.bayeux_transport.closed(reason)
+
+class BayeuxWebSocketTransport(object):
+    """Sends and receives bayeux messages over a single websocket.
+
+    Every batch is sent as one websocket message. Replies arrive
+    asynchronously on the same connection and are dispatched to the
+    receiver, which matches them to their messages by id.
+
+    Attributes:
+        url: The websocket url of the bayeux server
+        receiver: The message receiver to dispatch messages to
+        headers: Extra headers for the websocket opening handshake
+        on_close: Called with the reason when the connection is lost
+        protocol: The websocket protocol once connected
+        parser: Parser for incoming websocket messages
+        sent: Messages sent on this connection, by id, with the Deferreds
+              waiting for their replies
+        open_deferred: Deferred fired when the connection is open
+        close_deferreds: Deferreds waiting for the connection to close
+    """
+    def __init__(self, url, receiver, headers=None, on_close=None):
+        """Initialize the websocket transport.
+
+        Args:
+            url: The websocket url of the bayeux server
+            receiver: The message receiver to dispatch messages to
+            headers: Optional dictionary of extra headers to send when
+                     opening the connection
+            on_close: Optional callback issued with the reason when the
+                      connection is lost
+        """
+        self.url = url
+        self.receiver = receiver
+        self.headers = headers or {}
+        self.on_close = on_close
+        self.protocol = None
+        self.parser = BayeuxMessageParser(receiver.dispatch, receiver.codec,
+            receiver.stats, receiver.lazy)
+        self.sent = {}
+        self.open_deferred = None
+        self.close_deferreds = []
+
+    def open(self, timeout):
+        """Opens the websocket connection.
+
+        Args:
+            timeout: Time in seconds to wait for the connection to open
+
+        Returns:
+            A Deferred that fires once the connection is open
+        """
+        factory = WebSocketClientFactory(self.url, headers=self.headers)
+        factory.protocol = BayeuxWebSocketProtocol
+        #Messages are validated when they are decoded, skip autobahn's much
+        #slower pure Python UTF-8 check of every frame
+        factory.setProtocolOptions(utf8validateIncoming=False)
+        factory.bayeux_transport = self
+        parts = urlparse.urlparse(self.url)
+        endpoint = HostnameEndpoint(reactor, parts.hostname,
+            parts.port or (443 if parts.scheme == 'wss' else 80))
+        if parts.scheme == 'wss':
+            #Needs pyOpenSSL, so only imported when it is used
+            from twisted.internet.ssl import optionsForClientTLS
+            endpoint = wrapClientTLS(
+                optionsForClientTLS(unicode(parts.hostname)), endpoint)
+        self.open_deferred = defer.Deferred()
+        self.open_deferred.addTimeout(timeout, reactor)
+        endpoint.connect(factory).addErrback(self._open_failed)
+        return self.open_deferred
+
+    def opened(self, protocol):
+        """Called by the protocol once the connection is open.
+
+        Args:
+            protocol: The connected websocket protocol
+        """
+        self.protocol = protocol
+        if self.open_deferred is not None and not self.open_deferred.called:
+            self.open_deferred.callback(self)
+        else:
+            #Opening timed out, nobody is going to use this connection
+            protocol.sendClose()
+
+    def _open_failed(self, reason):
+        """Called if the connection could not be made.
+
+        Args:
+            reason: The reason the connection failed
+        """
+        if not self.open_deferred.called:
+            self.open_deferred.errback(reason)
+
+    def send(self, entries):
+        """Sends a batch of messages.
+
+        Args:
+            entries: List of (message, deferred) tuples to send
+
+        Returns:
+            A Deferred that fires once the batch has been written. Replies
+            are delivered through the receiver.
+        """
+        if self.protocol is None:
+            reason = ConnectionLost('Websocket is not connected')
+            for msg, reply in entries:
+                if self.receiver.cancel_reply(msg['id']):
+                    reply.errback(reason)
+            return defer.succeed(None)
+        for msg, reply in entries:
+            self.sent[msg['id']] = reply
+        if len(self.sent) > 2 * len(self.receiver.replies) + 1000:
+            #Forget about messages that have already been replied to
+            self.sent = dict((msg_id, reply) for msg_id, reply
+                in self.sent.iteritems() if msg_id in self.receiver.replies)
+        self.protocol.sendMessage(
+            self.receiver.codec.encode([msg for msg, _ in entries]))
+        return defer.succeed(None)
+
+    def message_received(self, payload):
+        """Called by the protocol when a websocket message is received.
+
+        Args:
+            payload: The message, a JSON array of bayeux messages
+        """
+        stats = self.receiver.stats
+        if stats is not None:
+            stats.incr(bayeux_stats.RESPONSES)
+            stats.incr(bayeux_stats.BYTES_RECEIVED, len(payload))
+            stats.observe(bayeux_stats.RESPONSE_BYTES, len(payload))
+        try:
+            self.parser.feed(payload)
+        except ValueError as e:
+            logger.error('Error parsing message: %s', e)
+        self.parser.close()
+        self.receiver.response_done()
+
+    def closed(self, reason):
+        """Called by the protocol when the connection is closed.
+
+        Fails every message sent on this connection that is still waiting
+        for a reply.
+
+        Args:
+            reason: The close reason
+        """
+        logger.info('Websocket closed: %s', reason)
+        was_open = self.protocol is not None
+        self.protocol = None
+        if self.open_deferred is not None and not self.open_deferred.called:
+            self.open_deferred.errback(ConnectionLost(reason))
+        failure = ConnectionLost(reason)
+        for msg_id, reply in self.sent.items():
+            if self.receiver.cancel_reply(msg_id):
+                reply.errback(failure)
+        self.sent = {}
+        if was_open and self.on_close is not None:
+            self.on_close(reason)
+        close_deferreds, self.close_deferreds = self.close_deferreds, []
+        for d in close_deferreds:
+            d.callback(None)
+
+    def close(self):
+        """Closes the websocket connection.
+
+        Returns:
+            A Deferred that fires once the connection is closed
+        """
+        self.on_close = None
+        if self.protocol is None:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.close_deferreds.append(d)
+        self.protocol.sendClose()
+        return d
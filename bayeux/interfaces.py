@@ -17,6 +17,14 @@ class IMessengerService(zope.interface.Interface):
 			callback: The callback to register
 		"""
 
+	def publish(id, data):
+		"""Publish data to a specific message id.
+
+		Args:
+			id: The id of the message to publish to
+			data: The data to publish
+		"""
+
 	def deregister(id, callback):
 		"""Deregister a callback for a specific message id.
 		
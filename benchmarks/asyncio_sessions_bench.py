@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Measures how many AsyncBayeuxClient sessions one process can run.
+
+Starts the asyncio fake server from test/fake_asyncio_bayeux_server.py
+and the given number of clients on the same event loop, all subscribed
+to one channel, then feeds the channel for a while. Reports:
+
+    start s     time to handshake and subscribe every session
+    KB/session  resident memory added per session
+    msgs/s      messages delivered to listeners per second, over all
+                sessions
+    p50/p99 ms  delay from the server publishing a message to a listener
+                being called with it
+
+The server shares the process and the loop, so the throughput and
+latency figures include its work too. Each session holds two or more
+sockets open on each side, so the open file limit is raised as far as
+it is allowed to go.
+
+Needs Python 3.7 or later.
+
+Usage: python3 benchmarks/asyncio_sessions_bench.py [--sessions N]
+    [--rate N] [--duration S]
+"""
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../test'))
+
+import argparse
+import asyncio
+import resource
+import time
+
+from bayeux.bayeux_asyncio import AsyncBayeuxClient
+from fake_asyncio_bayeux_server import FakeAsyncBayeuxServer
+
+CHANNEL = '/bench'
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def resident_kb():
+    """Returns the current resident memory of this process in KB."""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+async def run(args):
+    server = FakeAsyncBayeuxServer(connect_timeout=args.connect_timeout)
+    url = await server.start()
+    latencies = []
+    received = [0]
+
+    def listener(msg):
+        received[0] += 1
+        latencies.append(time.time() - msg['data']['sent'])
+
+    memory = resident_kb()
+    start = time.time()
+    clients = [AsyncBayeuxClient(url) for _ in range(args.sessions)]
+    for client in clients:
+        await client.register(CHANNEL, listener)
+    await asyncio.gather(*[client.start() for client in clients])
+    while len([session for session in server.sessions.values()
+            if CHANNEL in session.subscriptions]) < args.sessions:
+        await asyncio.sleep(0.01)
+    started = time.time() - start
+    per_session = (resident_kb() - memory) / float(args.sessions)
+
+    server.start_feed(CHANNEL, args.rate, args.payload)
+    await asyncio.sleep(args.warmup)
+    del latencies[:]
+    received[0] = 0
+    await asyncio.sleep(args.duration)
+    count = received[0]
+    measured = list(latencies)
+
+    await asyncio.gather(*[client.stop() for client in clients])
+    await server.close()
+    print('%8d %8.2f %11.1f %10.0f %8.1f %8.1f' % (args.sessions, started,
+        per_session, count / args.duration,
+        percentile(measured, 50) * 1000, percentile(measured, 99) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=10,
+        help='messages per second published on the channel')
+    parser.add_argument('--payload', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--connect-timeout', type=float, default=30,
+        help='seconds the server holds each connect')
+    args = parser.parse_args()
+    limit = raise_file_limit()
+    if limit < args.sessions * 6:
+        print('warning: open file limit %d may be too low for %d sessions'
+            % (limit, args.sessions))
+    print('%8s %8s %11s %10s %8s %8s' % ('sessions', 'start s',
+        'KB/session', 'msgs/s', 'p50 ms', 'p99 ms'))
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+"""End-to-end throughput and latency benchmark for BayeuxClient.
+
+Starts the fake server from test/fake_bayeux_server.py in a separate
+process, feeding a channel at a fixed rate, and subscribes to it with a
+BayeuxClient running in this process. After a warm up, reports for each
+transport and payload size:
+
+    msgs/s      messages delivered to the listener per second
+    p50/p99 ms  delay from the server publishing a message to the listener
+                being called with it
+    mem KB      growth of this process's resident memory over the run
+    cpu us/msg  CPU time this process spent per message received
+
+The server runs in its own process so the CPU figures only cover the
+client. Set --rate above what the client can keep up with to find its
+maximum throughput; latency then grows over the run.
+
+Usage: python benchmarks/client_bench.py [--rate N] [--duration S]
+"""
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import argparse
+import resource
+import subprocess
+import time
+
+from twisted.internet import defer, reactor, task
+
+from bayeux.bayeux_client import BayeuxClient
+from bayeux.bayeux_websocket import websocket_available
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+    'test', 'fake_bayeux_server.py')
+CHANNEL = '/bench'
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def resident_kb():
+    """Returns the current resident memory of this process in KB."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024
+    except IOError:
+        #Not Linux, fall back to the peak which only ever grows
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+class Listener(object):
+    """Counts the feed messages received and how late they were."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.latencies = []
+
+    def __call__(self, msg):
+        self.count += 1
+        self.latencies.append(time.time() - msg['data']['sent'])
+
+def start_server(args, transport, payload):
+    """Starts the fake server process.
+
+    Returns:
+        The process and the url of the server
+    """
+    connection_types = 'long-polling'
+    if transport == 'websocket':
+        connection_types = 'websocket,long-polling'
+    proc = subprocess.Popen([sys.executable, SERVER, '--port', '0',
+        '--channel', CHANNEL, '--rate', str(args.rate),
+        '--payload', str(payload), '--connection-types', connection_types],
+        stdout=subprocess.PIPE)
+    port = int(proc.stdout.readline())
+    return proc, 'http://127.0.0.1:%d/cometd' % port
+
+@defer.inlineCallbacks
+def run_scenario(args, transport, payload):
+    proc, url = start_server(args, transport, payload)
+    listener = Listener()
+    client = BayeuxClient(url, use_websocket=(transport == 'websocket'),
+        stats=args.stats)
+    client.register(CHANNEL, listener)
+    client.start()
+    try:
+        yield task.deferLater(reactor, args.warmup, lambda: None)
+        listener.reset()
+        start, cpu, mem = time.time(), cpu_seconds(), resident_kb()
+        yield task.deferLater(reactor, args.duration, lambda: None)
+        elapsed = time.time() - start
+        cpu = cpu_seconds() - cpu
+        mem = resident_kb() - mem
+        count = listener.count
+        print '%-13s %8d %10.0f %8.2f %8.2f %8d %10.1f' % (
+            client.sender.connection_type, payload, count / elapsed,
+            percentile(listener.latencies, 50) * 1000,
+            percentile(listener.latencies, 99) * 1000, mem,
+            cpu / count * 1e6 if count else float('nan'))
+        sys.stdout.flush()
+    finally:
+        client.stop()
+        yield task.deferLater(reactor, 0.1, client.sender.close)
+        proc.terminate()
+        proc.wait()
+
+@defer.inlineCallbacks
+def run(args):
+    transports = args.transports.split(',')
+    if 'websocket' in transports and not websocket_available():
+        print 'autobahn is not installed, skipping websocket'
+        transports.remove('websocket')
+    print '%d msgs/s offered, %.0fs warm up, %.0fs measured' % (args.rate,
+        args.warmup, args.duration)
+    print '%-13s %8s %10s %8s %8s %8s %10s' % ('transport', 'payload',
+        'msgs/s', 'p50 ms', 'p99 ms', 'mem KB', 'cpu us/msg')
+    try:
+        for transport in transports:
+            for payload in args.payloads.split(','):
+                yield run_scenario(args, transport, int(payload))
+    finally:
+        reactor.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rate', type=int, default=5000,
+        help='messages per second published by the server')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--payloads', default='64,1024,16384',
+        help='comma separated payload sizes in bytes')
+    parser.add_argument('--transports', default='long-polling,websocket')
+    parser.add_argument('--stats', action='store_true',
+        help='run the client with stats enabled to measure their cost')
+    args = parser.parse_args()
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
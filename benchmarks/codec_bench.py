@@ -0,0 +1,73 @@
+#!/usr/bin/python
+"""Compares the JSON codecs used to encode and decode bayeux messages.
+
+Encodes batches of publish messages the way the sender does and decodes
+the same batches the way the message parser does, once per message, for
+every codec that can be imported here. The old form encoded bodies
+(message=<json> with the standard json module) are included for
+comparison. Reports messages per second and the encoded size of a batch.
+
+Usage: python benchmarks/codec_bench.py [--batch N] [--rounds N]
+"""
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import argparse
+import json
+import time
+import urllib
+
+from bayeux.bayeux_codec import available_codecs, get_codec
+
+class FormCodec(object):
+    """How the sender encoded request bodies before."""
+    def encode(self, messages):
+        return urllib.urlencode({'message': json.dumps(messages)})
+
+    def decode(self, data):
+        return json.loads(data)
+
+def make_batch(size, payload):
+    return [{'channel': '/bench/%d' % (i % 10), 'id': str(i),
+        'clientId': '1a2b3c4d5e6f',
+        'data': {'seq': i, 'time': time.time(), 'body': 'x' * payload,
+            'tags': ['alpha', 'beta'], 'ok': True}}
+        for i in range(size)]
+
+def timed(f, rounds):
+    start = time.time()
+    for _ in range(rounds):
+        f()
+    return time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--payload', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=500)
+    args = parser.parse_args()
+    batch = make_batch(args.batch, args.payload)
+    singles = [json.dumps(msg) for msg in batch]
+    codecs = [('form+json', FormCodec())] + [(name, get_codec(name))
+        for name in available_codecs()]
+
+    print '%d messages per batch, %d byte payloads, %d rounds' % (
+        args.batch, args.payload, args.rounds)
+    print '%-10s %8s %14s %14s' % ('codec', 'bytes', 'encode msg/s',
+        'decode msg/s')
+    total = args.batch * args.rounds
+    for name, codec in codecs:
+        size = len(codec.encode(batch))
+        encode = timed(lambda: codec.encode(batch), args.rounds)
+
+        def decode():
+            for data in singles:
+                codec.decode(data)
+        decoded = timed(decode, args.rounds)
+        print '%-10s %8d %14.0f %14.0f' % (name, size, total / encode,
+            total / decoded)
+
+if __name__ == '__main__':
+    main()
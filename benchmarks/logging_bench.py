@@ -0,0 +1,124 @@
+#!/usr/bin/python
+"""Measures what logging costs the receive path.
+
+Feeds responses straight into the message receiver, the way the HTTP
+client delivers them, and reports messages received per second. The
+eager rows repeat the formatting the receive path used to do on every
+response, chunk and message before logging decided whether to write
+anything; the lazy rows use the current code. Log output goes to
+/dev/null so only the cost of formatting and the logging calls is
+measured.
+
+Usage: python benchmarks/logging_bench.py [--messages N] [--payload N]
+"""
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import argparse
+import json
+import logging
+import pprint
+import time
+
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
+
+from bayeux import bayeux_logging
+from bayeux.bayeux_message_receiver import (BayeuxMessageReceiver,
+    BayeuxResponseReceiver)
+
+HEADERS = Headers({'Content-Type': ['application/json;charset=UTF-8'],
+    'Date': ['Mon, 01 Jan 2024 00:00:00 GMT'],
+    'Set-Cookie': ['BAYEUX_BROWSER=1a2b3c4d5e6f; Path=/'],
+    'Server': ['Jetty(9.4)']})
+
+class EagerResponseReceiver(BayeuxResponseReceiver):
+    """Formats every chunk and its headers like the old receive path."""
+    def __init__(self, receiver):
+        BayeuxResponseReceiver.__init__(self, receiver)
+        logging.debug("send_message._post.cb(): response version: %s",
+            ('HTTP', 1, 1))
+        logging.debug("send_message._post.cb(): response code: %s", 200)
+        logging.debug("send_message._post.cb(): response phrase: %s", 'OK')
+        logging.debug("send_message._post.cb(): response headers:\n%s",
+            pprint.pformat(list(HEADERS.getAllRawHeaders())))
+
+    def dataReceived(self, data):
+        logging.debug('dataReceived: %s' % data)
+        BayeuxResponseReceiver.dataReceived(self, data)
+
+class EagerMessageReceiver(BayeuxMessageReceiver):
+    """Formats every message like the old receive path."""
+    def new_response(self):
+        return EagerResponseReceiver(self)
+
+    def notify(self, event, data):
+        logging.debug('notify: %s' % event)
+        BayeuxMessageReceiver.notify(self, event, data)
+
+def make_responses(args):
+    """Returns the response bodies split into chunks."""
+    responses = []
+    seq = 0
+    for _ in range(args.messages // args.batch):
+        body = json.dumps([{'channel': '/bench/%d' % (i % 10),
+            'data': {'seq': seq + i, 'payload': 'x' * args.payload}}
+            for i in range(args.batch)])
+        seq += args.batch
+        responses.append([body[i:i + args.chunk]
+            for i in range(0, len(body), args.chunk)])
+    return responses
+
+def receive(receiver, responses):
+    """Feeds every response to the receiver.
+
+    Returns:
+        The time taken in seconds
+    """
+    done = Failure(ResponseDone())
+    start = time.time()
+    for chunks in responses:
+        protocol = receiver.new_response()
+        for chunk in chunks:
+            protocol.dataReceived(chunk)
+        protocol.connectionLost(done)
+    return time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--batch', type=int, default=50,
+        help='messages per response')
+    parser.add_argument('--payload', type=int, default=256)
+    parser.add_argument('--chunk', type=int, default=4096,
+        help='bytes per dataReceived call')
+    args = parser.parse_args()
+    responses = make_responses(args)
+    count = len(responses) * args.batch
+
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    logging.getLogger().addHandler(handler)
+    scenarios = [
+        ('eager', logging.INFO, 1, EagerMessageReceiver),
+        ('lazy', logging.INFO, 1, BayeuxMessageReceiver),
+        ('eager', logging.DEBUG, 1, EagerMessageReceiver),
+        ('lazy', logging.DEBUG, 1, BayeuxMessageReceiver),
+        ('lazy', logging.DEBUG, 100, BayeuxMessageReceiver),
+        ]
+    print '%d messages, %d per response, %d byte payloads' % (count,
+        args.batch, args.payload)
+    print '%-8s %-6s %8s %12s' % ('logging', 'level', 'sampled', 'msgs/s')
+    for name, level, every, receiver_class in scenarios:
+        logging.getLogger().setLevel(level)
+        bayeux_logging.set_payload_sampling(every)
+        receiver = receiver_class()
+        receiver.register('/bench/*', lambda msg: None)
+        elapsed = receive(receiver, responses)
+        print '%-8s %-6s %8s %12.0f' % (name, logging.getLevelName(level),
+            '1/%d' % every, count / elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+"""Compares heartbeat scheduling with threading.Timer and reactor.callLater.
+
+Simulates a number of clients each running a connect loop, where every
+heartbeat schedules the next one after the connect interval. The old
+client did this with a threading.Timer per heartbeat that hopped back to
+the reactor with callFromThread; the client now uses reactor.callLater.
+Reports the peak thread count and the latency between when each heartbeat
+was due and when it ran on the reactor thread.
+
+The first two rows time these stand-in loops. The BayeuxClient row runs
+real clients against the fake server from test/fake_bayeux_server.py, in
+this process, which holds each connect for the interval. It times the
+connects and handshakes the clients schedule through _schedule, from
+when each was due to when it ran.
+
+Usage: python benchmarks/timer_bench.py [--clients N] [--beats N]
+"""
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../test'))
+
+import argparse
+import threading
+import time
+
+from twisted.internet import defer, reactor, task
+from twisted.web.server import Site
+
+from bayeux.bayeux_client import BayeuxClient
+from fake_bayeux_server import FakeBayeuxServer
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+class Loop(object):
+    """Runs the heartbeats for all clients with one scheduling method."""
+    def __init__(self, clients, beats, interval, schedule):
+        self.remaining = clients
+        self.beats = beats
+        self.interval = interval
+        self.schedule = schedule
+        self.latencies = []
+        self.peak_threads = threading.active_count()
+        self.done = defer.Deferred()
+        for _ in range(clients):
+            self.next_beat(beats)
+
+    def next_beat(self, beats):
+        due = time.time() + self.interval
+        self.schedule(self.interval, self.beat, due, beats)
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def beat(self, due, beats):
+        self.latencies.append(time.time() - due)
+        if beats > 1:
+            self.next_beat(beats - 1)
+        else:
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.callback(self)
+
+def thread_timer(delay, f, *args):
+    """How the client scheduled heartbeats before."""
+    timer = threading.Timer(delay, reactor.callFromThread, [f] + list(args))
+    timer.start()
+
+def reactor_timer(delay, f, *args):
+    """How the client schedules heartbeats now."""
+    reactor.callLater(delay, f, *args)
+
+class TimedClient(BayeuxClient):
+    """BayeuxClient recording when each scheduled call was due and ran."""
+    def __init__(self, server, loop, beats):
+        BayeuxClient.__init__(self, server, use_websocket=False,
+            manage_reactor=False)
+        self.loop = loop
+        self.beats = beats
+
+    def _schedule(self, delay, f):
+        due = time.time() + delay
+
+        def beat():
+            self.loop.latencies.append(time.time() - due)
+            self.beats -= 1
+            if self.beats == 0:
+                self.loop.finished(self)
+            f()
+        BayeuxClient._schedule(self, delay, beat)
+        self.loop.peak_threads = max(self.loop.peak_threads,
+            threading.active_count())
+
+class ClientLoop(object):
+    """Runs real clients until each has made its scheduled calls."""
+    def __init__(self, url, clients, beats):
+        self.remaining = clients
+        self.latencies = []
+        self.peak_threads = threading.active_count()
+        self.done = defer.Deferred()
+        self.clients = [TimedClient(url, self, beats)
+            for _ in range(clients)]
+        for client in self.clients:
+            client.start()
+
+    def finished(self, client):
+        client.stop()
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.callback(self)
+
+@defer.inlineCallbacks
+def run_clients(args):
+    """Times the scheduling of real clients against the fake server."""
+    server = FakeBayeuxServer(connection_types=('long-polling',),
+        connect_timeout=args.interval)
+    port = reactor.listenTCP(0, Site(server), interface='127.0.0.1')
+    loop = yield ClientLoop('http://127.0.0.1:%d/cometd' %
+        port.getHost().port, args.clients, args.beats).done
+    #Let the disconnects go out before closing the connections
+    yield task.deferLater(reactor, 0.1, lambda: None)
+    for client in loop.clients:
+        client.sender.close()
+    server.close()
+    yield port.stopListening()
+    defer.returnValue(loop)
+
+@defer.inlineCallbacks
+def run(args):
+    print '%d clients, %d heartbeats each, %.3fs interval' % (
+        args.clients, args.beats, args.interval)
+    print '%-18s %8s %10s %10s %10s' % ('method', 'threads', 'p50 ms',
+        'p99 ms', 'total s')
+    for name, schedule in (('threading.Timer', thread_timer),
+            ('reactor.callLater', reactor_timer)):
+        start = time.time()
+        loop = yield Loop(args.clients, args.beats, args.interval,
+            schedule).done
+        print '%-18s %8d %10.3f %10.3f %10.2f' % (name, loop.peak_threads,
+            percentile(loop.latencies, 50) * 1000,
+            percentile(loop.latencies, 99) * 1000, time.time() - start)
+    start = time.time()
+    loop = yield run_clients(args)
+    print '%-18s %8d %10.3f %10.3f %10.2f' % ('BayeuxClient',
+        loop.peak_threads, percentile(loop.latencies, 50) * 1000,
+        percentile(loop.latencies, 99) * 1000, time.time() - start)
+    reactor.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--beats', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.01)
+    args = parser.parse_args()
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -11,5 +11,7 @@ setup(name='python-bayeux-client',
       url='http://github.com/dkmadigan/python-bayeux-client',
       license="LICENSE.txt",
       long_description=open('README.md').read(),
-      packages=['bayeux']
+      packages=['bayeux'],
+      extras_require={'websocket': ['autobahn'], 'ujson': ['ujson'],
+          'orjson': ['orjson']}
      )
\ No newline at end of file
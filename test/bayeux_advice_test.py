@@ -0,0 +1,61 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+import unittest as pyunit
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from bayeux.bayeux_backoff import Backoff
+from bayeux.bayeux_client import BayeuxClient
+from fake_server_mixin import FakeServerMixin
+
+class BackoffTest(pyunit.TestCase):
+    def test_grows_to_maximum(self):
+        backoff = Backoff(initial=1, maximum=5, multiplier=2, jitter=0)
+        self.assertEqual([backoff.next() for _ in range(5)], [1, 2, 4, 5, 5])
+        backoff.reset()
+        self.assertEqual(backoff.next(), 1)
+
+    def test_jitter(self):
+        backoff = Backoff(initial=10, maximum=10, jitter=0.5)
+        delays = [backoff.next() for _ in range(100)]
+        self.assertTrue(all(5 <= delay <= 10 for delay in delays))
+        self.assertTrue(len(set(delays)) > 1)
+
+class AdviceTest(FakeServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.client = BayeuxClient(self.listen(),
+            backoff=Backoff(initial=0.01, jitter=0))
+        reactor.callLater(0, self.client.start)
+
+    @defer.inlineCallbacks
+    def test_advice_is_applied(self):
+        yield self.wait_for(lambda: self.client.connected)
+        self.assertEqual(self.client.advice['timeout'], 50)
+        self.assertEqual(self.client.connect_interval, 0)
+        self.assertEqual(self.client.sender.connect_timeout, 10.05)
+
+    @defer.inlineCallbacks
+    def test_handshake_advice(self):
+        self.client.register('/foo', lambda msg: None)
+        yield self.wait_for(lambda: self.client.connected)
+        #The server forgets the client, so the next connect is answered
+        #with advice to handshake again
+        self.server.close()
+        yield self.wait_for(
+            lambda: len(self.sent('/meta/handshake')) == 2 and
+            self.client.connected)
+        self.assertEqual(len(self.sent('/meta/subscribe')), 2)
+
+    @defer.inlineCallbacks
+    def test_none_advice_stops_client(self):
+        yield self.wait_for(lambda: self.client.connected)
+        self.server.reconnect_advice = 'none'
+        self.server.close()
+        yield self.wait_for(lambda: not self.client.started)
+        self.assertEqual(len(self.sent('/meta/handshake')), 1)
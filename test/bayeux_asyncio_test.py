@@ -0,0 +1,156 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+import time
+import unittest
+
+#The asyncio client needs Python 3.7, but this file is also collected by
+#the Python 2 test run so it must not use async syntax itself
+ASYNCIO = sys.version_info >= (3, 7)
+if ASYNCIO:
+    import asyncio
+    from bayeux.bayeux_asyncio import AsyncBayeuxClient
+    from bayeux.bayeux_backoff import Backoff
+    from bayeux.bayeux_errors import BayeuxError, NoReplyError
+    from fake_asyncio_bayeux_server import (FakeAsyncBayeuxServer,
+        append_later)
+
+@unittest.skipIf(not ASYNCIO, 'the asyncio client needs Python 3.7')
+class AsyncBayeuxClientTest(unittest.TestCase):
+    """Runs the asyncio client against the asyncio fake server."""
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            self.run_loop(client.stop())
+        self.run_loop(self.server.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_loop(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def start(self, sessions=1, **server_kwargs):
+        self.server = FakeAsyncBayeuxServer(connect_timeout=0.1, seed=1,
+            **server_kwargs)
+        url = self.run_loop(self.server.start())
+        self.messages = [[] for _ in range(sessions)]
+        for messages in self.messages:
+            client = AsyncBayeuxClient(url,
+                backoff=Backoff(initial=0.01, maximum=0.05, jitter=0))
+            self.clients.append(client)
+            self.run_loop(client.register('/feed',
+                lambda msg, messages=messages: messages.append(msg)))
+        self.run_loop(asyncio.gather(*[client.start()
+            for client in self.clients]))
+
+    def wait_for(self, condition, timeout=5):
+        """Runs the loop until condition is true."""
+        deadline = time.time() + timeout
+        while not condition():
+            self.assertTrue(time.time() < deadline, 'timed out')
+            self.run_loop(asyncio.sleep(0.01))
+
+    def subscribed(self, count=1):
+        return len([session for session in self.server.sessions.values()
+            if '/feed' in session.subscriptions]) == count
+
+    def test_feed_is_delivered_in_order(self):
+        self.start()
+        self.wait_for(self.subscribed)
+        self.server.start_feed('/feed', rate=1000, payload_size=100, count=200)
+        self.wait_for(lambda: len(self.messages[0]) == 200)
+        self.assertEqual([msg['data']['seq'] for msg in self.messages[0]],
+            list(range(200)))
+
+    def test_many_sessions(self):
+        self.start(sessions=50)
+        self.wait_for(lambda: self.subscribed(50))
+        self.server.start_feed('/feed', rate=1000, count=20)
+        self.wait_for(lambda: all(len(messages) == 20
+            for messages in self.messages))
+        self.assertEqual(len(self.server.sessions), 50)
+
+    def test_publish_is_acknowledged(self):
+        self.start()
+        self.wait_for(self.subscribed)
+        reply = self.run_loop(self.clients[0].publish('/feed', {'n': 1}))
+        self.assertTrue(reply['successful'])
+        self.wait_for(lambda: len(self.messages[0]) == 1)
+        self.assertEqual(self.messages[0][0]['data'], {'n': 1})
+
+    def test_publishes_are_batched(self):
+        self.start()
+        client = self.clients[0]
+        self.run_loop(asyncio.gather(*[client.publish('/other', n)
+            for n in range(10)]))
+        published = [msg for msg in self.server.received
+            if msg['channel'] == '/other']
+        self.assertEqual(len(published), 10)
+
+    def test_deregister_unsubscribes(self):
+        self.start()
+        self.wait_for(self.subscribed)
+        client = self.clients[0]
+        listener = list(client.listeners.get('/feed'))[0]
+        self.run_loop(client.deregister('/feed', listener))
+        self.assertTrue(self.subscribed(0))
+
+    def test_recovers_from_errors(self):
+        self.start(error_rate=0.3)
+        self.wait_for(self.subscribed)
+        self.server.start_feed('/feed', rate=200)
+        self.wait_for(lambda: len(self.messages[0]) >= 50)
+
+    def test_recovers_from_expired_sessions(self):
+        self.start()
+        self.wait_for(self.subscribed)
+        self.server.start_feed('/feed', rate=200)
+        self.wait_for(lambda: len(self.messages[0]) >= 10)
+        self.server.expire_sessions()
+        received = len(self.messages[0])
+        self.wait_for(lambda: len(self.messages[0]) >= received + 10)
+        handshakes = [msg for msg in self.server.received
+            if msg['channel'] == '/meta/handshake']
+        self.assertEqual(len(handshakes), 2)
+
+    def test_stop_fails_waiting_publishes(self):
+        self.start()
+        client = self.clients[0]
+        client.client_id = None
+        publish = self.loop.create_task(client.publish('/other', 1))
+        self.run_loop(asyncio.sleep(0.05))
+        self.run_loop(client.stop())
+        self.assertRaises(NoReplyError, self.run_loop, publish)
+
+    def test_publish_after_stop_fails(self):
+        self.start()
+        client = self.clients[0]
+        self.run_loop(client.stop())
+        #Used to wait forever for a send that never happens
+        self.assertRaises(BayeuxError, self.run_loop,
+            asyncio.wait_for(client.publish('/other', 1), 1))
+
+    def test_coroutine_listeners_with_stats(self):
+        self.start()
+        client = AsyncBayeuxClient(self.clients[0].server, stats=True)
+        self.clients.append(client)
+        received = []
+        self.run_loop(client.register('/feed',
+            lambda msg: append_later(received, msg)))
+        self.run_loop(client.start())
+        self.wait_for(lambda: self.subscribed(2))
+        self.server.start_feed('/feed', rate=1000, count=5)
+        self.wait_for(lambda: len(received) == 5)
+        self.assertEqual(client.stats()['channels']['/feed']['dispatched'],
+            5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import unittest
+
+from bayeux.bayeux_channel_trie import ChannelTrie
+from bayeux.bayeux_message_receiver import BayeuxMessageReceiver
+
+class ChannelTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.trie = ChannelTrie()
+        for pattern in ('/foo/bar', '/foo/*', '/foo/**', '/**'):
+            self.trie.add(pattern, pattern)
+
+    def test_match(self):
+        self.assertEqual(self.trie.match('/foo/bar'),
+            set(['/foo/bar', '/foo/*', '/foo/**', '/**']))
+        self.assertEqual(self.trie.match('/foo/baz'),
+            set(['/foo/*', '/foo/**', '/**']))
+        self.assertEqual(self.trie.match('/foo/bar/baz'),
+            set(['/foo/**', '/**']))
+        self.assertEqual(self.trie.match('/foo'), set(['/**']))
+
+    def test_no_match(self):
+        trie = ChannelTrie()
+        trie.add('/foo/*', 'x')
+        self.assertEqual(trie.match('/bar/baz'), set())
+        self.assertEqual(trie.match('/foo'), set())
+
+    def test_remove_prunes(self):
+        self.assertEqual(self.trie.remove('/foo/bar', '/foo/bar'), 0)
+        self.assertNotIn('bar', self.trie.root.children['foo'].children)
+        self.assertEqual(self.trie.remove('/foo/missing', 'x'), 0)
+        self.assertEqual(self.trie.match('/foo/bar'),
+            set(['/foo/*', '/foo/**', '/**']))
+
+    def test_wildcard_must_be_last(self):
+        self.assertRaises(ValueError, self.trie.add, '/foo/*/bar', 'x')
+
+class WildcardDispatchTest(unittest.TestCase):
+    def test_receiver_dispatches_to_wildcards(self):
+        receiver = BayeuxMessageReceiver()
+        received = dict((pattern, []) for pattern in
+            ('/foo/*', '/foo/**', '/foo/bar'))
+        for pattern, messages in received.items():
+            receiver.register(pattern,
+                lambda msg, messages=messages: messages.append(msg['data']))
+        receiver.dispatch({'channel': '/foo/bar/baz', 'data': 1})
+        receiver.dispatch({'channel': '/foo/bar', 'data': 2})
+        receiver.dispatch({'channel': '/other', 'data': 3})
+        self.assertEqual(received['/foo/*'], [2])
+        self.assertEqual(received['/foo/**'], [1, 2])
+        self.assertEqual(received['/foo/bar'], [2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,23 +1,52 @@
 #!/usr/bin/python
+"""Manual client test.
+
+Connects to the server given on the command line, or to a local fake
+server feeding /members/demo and /chat/demo when none is given, and
+prints every message received.
+
+Usage: python test/bayeux_client_test.py [server url or ""] [seconds]
+"""
 import sys
 import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
 
 from bayeux.bayeux_client import BayeuxClient
 import time
 import logging
 
+from twisted.internet import reactor
+from twisted.web.server import Site
+
+from fake_bayeux_server import FakeBayeuxServer
+
 def cb(data):
 	print data
 
+def start_fake_server():
+	server = FakeBayeuxServer(connect_timeout=5)
+	port = reactor.listenTCP(0, Site(server), interface='127.0.0.1')
+	server.start_feed('/members/demo', rate=1)
+	server.start_feed('/chat/demo', rate=5)
+	return 'http://127.0.0.1:%d/cometd' % port.getHost().port
+
 def main():
 	logging.basicConfig(level=logging.INFO)
-	client = BayeuxClient('http://localhost:8080/cometd')
+	if len(sys.argv) > 1 and sys.argv[1]:
+		server = sys.argv[1]
+	else:
+		server = start_fake_server()
+	duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+	client = BayeuxClient(server)
 	client.register('/members/demo', cb)
 	client.register('/chat/demo', cb)
 	client.start()
-	time.sleep(500)
+	time.sleep(duration)
+	client.destroy()
+	#Give the disconnect a moment to go out before exiting
+	time.sleep(0.5)
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
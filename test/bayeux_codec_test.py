@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import json
+import unittest
+
+from bayeux.bayeux_codec import JsonCodec, available_codecs, get_codec
+from bayeux.bayeux_message_parser import BayeuxMessageParser
+
+MESSAGES = [
+    {'channel': '/foo', 'id': '1', 'clientId': 'abc',
+        'data': {'text': u'caf\xe9', 'values': [1, 2.5, None, True]}},
+    {'channel': '/meta/connect', 'id': '2', 'connectionType': 'long-polling'},
+    ]
+
+class BayeuxCodecTest(unittest.TestCase):
+    def test_default_is_json(self):
+        self.assertTrue(isinstance(get_codec(), JsonCodec))
+        self.assertEqual(get_codec().content_type, 'application/json')
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, get_codec, 'pickle')
+
+    def test_codec_objects_are_used_as_is(self):
+        codec = JsonCodec()
+        self.assertTrue(get_codec(codec) is codec)
+
+    def test_json_is_compact(self):
+        self.assertEqual(get_codec().encode([{'channel': '/a', 'id': '1'}]),
+            json.dumps([{'channel': '/a', 'id': '1'}]).replace(' ', ''))
+
+    def test_round_trip(self):
+        for name in available_codecs():
+            codec = get_codec(name)
+            self.assertEqual(codec.decode(codec.encode(MESSAGES)), MESSAGES,
+                name)
+            #Every codec must produce output the others can read
+            self.assertEqual(json.loads(codec.encode(MESSAGES)), MESSAGES,
+                name)
+
+    def test_invalid_json_raises_value_error(self):
+        for name in available_codecs():
+            self.assertRaises(ValueError, get_codec(name).decode, '{"a":')
+
+    def test_parser_uses_codec(self):
+        for name in available_codecs():
+            messages = []
+            parser = BayeuxMessageParser(messages.append, name)
+            parser.feed(json.dumps(MESSAGES))
+            self.assertEqual(messages, MESSAGES, name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import unittest as pyunit
+
+from bayeux.bayeux_client import BayeuxClient
+from bayeux.bayeux_dedup import BayeuxDedup
+from bayeux.bayeux_message_receiver import BayeuxMessageReceiver
+from bayeux.bayeux_stats import BayeuxStats
+
+class BayeuxDedupTest(pyunit.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.clock = lambda: self.now
+
+    def test_duplicates(self):
+        dedup = BayeuxDedup(clock=self.clock)
+        self.assertFalse(dedup.is_duplicate('/foo', {'id': '1'}))
+        self.assertFalse(dedup.is_duplicate('/foo', {'id': '2'}))
+        self.assertTrue(dedup.is_duplicate('/foo', {'id': '1'}))
+        self.assertFalse(dedup.is_duplicate('/bar', {'id': '1'}))
+        self.assertFalse(dedup.is_duplicate('/foo', {}))
+        self.assertEqual(dedup.snapshot(), {'hits': 1, 'misses': 3})
+
+    def test_window(self):
+        dedup = BayeuxDedup(window=10, clock=self.clock)
+        dedup.is_duplicate('/foo', {'id': '1'})
+        self.now = 5
+        self.assertTrue(dedup.is_duplicate('/foo', {'id': '1'}))
+        self.now = 11
+        self.assertFalse(dedup.is_duplicate('/foo', {'id': '1'}))
+
+    def test_size(self):
+        dedup = BayeuxDedup(size=3, clock=self.clock)
+        for i in range(5):
+            dedup.is_duplicate('/foo', {'id': i})
+        self.assertEqual(len(dedup.windows['/foo'].entries), 3)
+        self.assertFalse(dedup.is_duplicate('/foo', {'id': 0}))
+        self.assertTrue(dedup.is_duplicate('/foo', {'id': 4}))
+
+    def test_channels(self):
+        dedup = BayeuxDedup(channels={'/foo': lambda msg: msg['data']['seq'],
+            '/bar': None}, clock=self.clock)
+        self.assertFalse(dedup.is_duplicate('/foo',
+            {'id': '1', 'data': {'seq': 1}}))
+        self.assertTrue(dedup.is_duplicate('/foo',
+            {'id': '2', 'data': {'seq': 1}}))
+        dedup.is_duplicate('/bar', {'id': '1'})
+        self.assertTrue(dedup.is_duplicate('/bar', {'id': '1'}))
+        dedup.is_duplicate('/baz', {'id': '1'})
+        self.assertFalse(dedup.is_duplicate('/baz', {'id': '1'}))
+
+class ReceiverDedupTest(pyunit.TestCase):
+    def test_notify(self):
+        stats = BayeuxStats()
+        receiver = BayeuxMessageReceiver(stats=stats)
+        receiver.dedup = BayeuxDedup()
+        called = []
+        receiver.register('/foo', lambda msg: called.append(msg))
+        for msg_id in ('1', '2', '1'):
+            receiver.notify('/foo', {'id': msg_id, 'data': msg_id})
+        self.assertEqual([msg['id'] for msg in called], ['1', '2'])
+        self.assertEqual(stats.snapshot()['channels']['/foo'],
+            {'received': 3, 'dispatched': 2, 'duplicates': 1})
+
+    def test_client(self):
+        client = BayeuxClient('http://127.0.0.1:1/cometd', stats=True,
+            dedup=True)
+        self.assertTrue(client.receiver.dedup is client.dedup)
+        self.assertEqual(client.stats()['dedup'], {'hits': 0, 'misses': 0})
+        client.receiver.stats.stop()
+        self.assertEqual(BayeuxClient('http://127.0.0.1:1/cometd').dedup,
+            None)
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import threading
+import time
+import unittest
+
+from twisted.internet import defer, reactor, task
+from twisted.python.failure import Failure
+from twisted.trial import unittest as trial
+from twisted.web.client import ResponseDone
+
+from bayeux.bayeux_dispatcher import (BatchingListener, BoundedQueue,
+    ConflatingListener, HeldListener, InlineDispatcher, OrderedDispatcher,
+    ThreadPoolDispatcher, DROP_NEWEST, DROP_OLDEST)
+from bayeux.bayeux_message_receiver import BayeuxMessageReceiver
+from bayeux.bayeux_stats import BayeuxStats
+
+class BoundedQueueTest(unittest.TestCase):
+    def test_drop_oldest(self):
+        queue = BoundedQueue(2, DROP_OLDEST)
+        for i in range(4):
+            queue.put(i)
+        self.assertEqual(list(queue.items), [2, 3])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_drop_newest(self):
+        queue = BoundedQueue(2, DROP_NEWEST)
+        for i in range(4):
+            queue.put(i)
+        self.assertEqual(list(queue.items), [0, 1])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_closed_queue_drains(self):
+        queue = BoundedQueue(2)
+        queue.put(1)
+        queue.close()
+        self.assertEqual(queue.get(), 1)
+        self.assertEqual(queue.get(), None)
+
+class OrderedDispatcherTest(unittest.TestCase):
+    def test_channels_stay_in_order(self):
+        dispatcher = OrderedDispatcher(workers=3, max_queue=10)
+        received = dict((channel, []) for channel in ('/a', '/b', '/c'))
+        lock = threading.Lock()
+
+        def listener(msg):
+            with lock:
+                received[msg['channel']].append(msg['n'])
+        for n in range(100):
+            for channel in received:
+                dispatcher.dispatch(channel, [listener],
+                    {'channel': channel, 'n': n})
+        dispatcher.stop()
+        for worker in dispatcher.workers:
+            worker.join(5)
+        for channel in received:
+            self.assertEqual(received[channel], range(100))
+
+class ConflatingListenerTest(unittest.TestCase):
+    def test_slow_listener_gets_latest(self):
+        dispatcher = OrderedDispatcher(workers=1)
+        receiver = BayeuxMessageReceiver(dispatcher)
+        started = threading.Event()
+        release = threading.Event()
+        received = []
+
+        def listener(msg):
+            received.append((msg['data']['sym'], msg['data']['n']))
+            started.set()
+            release.wait(5)
+        receiver.register('/prices', ConflatingListener(listener, 'sym'))
+        receiver.notify('/prices', {'data': {'sym': 'a', 'n': 0}})
+        started.wait(5)
+        for n in range(1, 100):
+            for sym in ('a', 'b'):
+                receiver.notify('/prices', {'data': {'sym': sym, 'n': n}})
+        self.assertEqual(len(dispatcher.queues[0]), 1)
+        release.set()
+        dispatcher.stop()
+        dispatcher.workers[0].join(5)
+        self.assertEqual(received, [('a', 0), ('a', 99), ('b', 99)])
+
+    def test_deregister_by_callback(self):
+        receiver = BayeuxMessageReceiver()
+        listener = lambda msg: None
+        receiver.register('/prices', ConflatingListener(listener))
+        self.assertEqual(receiver.deregister('/prices', listener), 0)
+
+    def test_dropped_delivery_is_rearmed(self):
+        dispatcher = ThreadPoolDispatcher(workers=1, max_queue=1,
+            overflow=DROP_NEWEST)
+        receiver = BayeuxMessageReceiver(dispatcher, stats=BayeuxStats())
+        started = threading.Event()
+        release = threading.Event()
+        received = []
+
+        def block(msg):
+            started.set()
+            release.wait(5)
+        receiver.register('/block', block)
+        receiver.register('/prices', ConflatingListener(
+            lambda msg: received.append(msg['data'])))
+        receiver.notify('/block', {'data': 0})
+        started.wait(5)
+        receiver.notify('/block', {'data': 1})
+        #The queue is full, so the delivery for this one is dropped
+        receiver.notify('/prices', {'data': 1})
+        self.assertEqual(dispatcher.dropped, 1)
+        release.set()
+        while len(dispatcher.queue):
+            time.sleep(0.001)
+        for n in range(2, 6):
+            receiver.notify('/prices', {'data': n})
+        dispatcher.stop()
+        dispatcher.workers[0].join(5)
+        self.assertEqual(received[-1], 5)
+
+    def test_key_errors_fall_back_to_no_key(self):
+        receiver = BayeuxMessageReceiver()
+        received = []
+        receiver.register('/prices', ConflatingListener(
+            lambda msg: received.append(msg['data']),
+            lambda msg: msg['data']['sym']))
+        receiver.notify('/prices', {'data': 1})
+        receiver.notify('/prices', {'data': {'sym': 'a'}})
+        self.assertEqual(received, [1, {'sym': 'a'}])
+
+class HeldListenerTest(trial.TestCase):
+    def test_delivers_by_default(self):
+        receiver = BayeuxMessageReceiver()
+        received = []
+        receiver.register('/a', HeldListener(lambda msg: received.append(msg)))
+        receiver.notify('/a', {'data': 1})
+        self.assertEqual(received, [{'data': 1}])
+
+    def test_batches_are_dropped_on_deregister(self):
+        receiver = BayeuxMessageReceiver()
+        batches = []
+        callback = lambda batch: batches.append(batch)
+        listener = BatchingListener(callback, InlineDispatcher(), 10, 60)
+        receiver.register('/a', listener)
+        receiver.notify('/a', {'channel': '/a', 'data': 1})
+        call = listener.calls['/a']
+        receiver.deregister('/a', callback)
+
+        def check(_):
+            self.assertFalse(call.active())
+            self.assertEqual(listener.batches, {})
+            listener.flush('/a')
+            self.assertEqual(batches, [])
+        #Closing happens on the reactor thread
+        return task.deferLater(reactor, 0, lambda: None).addCallback(check)
+
+    @defer.inlineCallbacks
+    def test_batch_holds_a_response_read_in_chunks(self):
+        receiver = BayeuxMessageReceiver()
+        batches = []
+        receiver.register('/a', BatchingListener(
+            lambda batch: batches.append([msg['data'] for msg in batch]),
+            InlineDispatcher(), 10, 0))
+        response = receiver.new_response()
+        body = '[' + ','.join('{"channel":"/a","data":%d}' % i
+            for i in range(3)) + ']'
+        for chunk in (body[:20], body[20:50], body[50:]):
+            response.dataReceived(chunk)
+            yield task.deferLater(reactor, 0, lambda: None)
+        self.assertEqual(batches, [])
+        response.connectionLost(Failure(ResponseDone()))
+        self.assertEqual(batches, [[0, 1, 2]])
+
+    def test_stop_closes_batching_listeners(self):
+        receiver = BayeuxMessageReceiver()
+        listener = BatchingListener(lambda batch: None, InlineDispatcher(),
+            10, 60)
+        receiver.register('/a', listener)
+        receiver.notify('/a', {'channel': '/a', 'data': 1})
+        call = listener.calls['/a']
+        receiver.stop()
+        self.assertTrue(listener.closed)
+        return task.deferLater(reactor, 0, lambda: None).addCallback(
+            lambda _: self.assertFalse(call.active()))
+
+if __name__ == '__main__':
+    unittest.main()
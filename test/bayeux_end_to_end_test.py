@@ -0,0 +1,135 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from bayeux.bayeux_backoff import Backoff
+from bayeux.bayeux_client import BayeuxClient
+from fake_server_mixin import FakeServerMixin
+
+class EndToEndTest(FakeServerMixin, unittest.TestCase):
+    """Runs the client against fed and faulty fake servers."""
+    def start(self, use_websocket=False, **server_kwargs):
+        url = self.listen(connection_types=('websocket', 'long-polling'),
+            connect_timeout=0.1, seed=1, **server_kwargs)
+        self.client = BayeuxClient(url, use_websocket=use_websocket,
+            backoff=Backoff(initial=0.01, maximum=0.05, jitter=0))
+        self.messages = []
+        self.client.register('/feed', lambda msg: self.messages.append(msg))
+        reactor.callLater(0, self.client.start)
+
+    def subscribed(self):
+        return any('/feed' in session.subscriptions
+            for session in self.server.sessions.values())
+
+    @defer.inlineCallbacks
+    def test_feed_is_delivered_in_order(self):
+        self.start()
+        yield self.wait_for(self.subscribed)
+        self.server.start_feed('/feed', rate=1000, payload_size=100, count=200)
+        yield self.wait_for(lambda: len(self.messages) == 200)
+        self.assertEqual([msg['data']['seq'] for msg in self.messages],
+            range(200))
+        self.assertEqual(len(self.messages[0]['data']['payload']), 100)
+
+    @defer.inlineCallbacks
+    def test_recovers_from_errors(self):
+        self.start(error_rate=0.3, drop_rate=0.1)
+        yield self.wait_for(self.subscribed)
+        self.server.start_feed('/feed', rate=200)
+        yield self.wait_for(lambda: len(self.messages) >= 50)
+        self.assertTrue(self.client.started)
+
+    @defer.inlineCallbacks
+    def test_recovers_from_expired_sessions(self):
+        self.start()
+        yield self.wait_for(self.subscribed)
+        self.server.start_feed('/feed', rate=200)
+        yield self.wait_for(lambda: len(self.messages) >= 10)
+        self.server.expire_sessions()
+        received = len(self.messages)
+        yield self.wait_for(lambda: len(self.messages) >= received + 10)
+        self.assertEqual(len(self.sent('/meta/handshake')), 2)
+
+    @defer.inlineCallbacks
+    def test_control_traffic_does_not_wait_for_connects(self):
+        self.start()
+        yield self.wait_for(self.subscribed)
+        for i in range(20):
+            start = reactor.seconds()
+            yield self.client.publish('/other', i)
+            #Well under the 0.1 second connect hold
+            self.assertTrue(reactor.seconds() - start < 0.05)
+        lanes = self.client.sender.lane_stats()
+        self.assertEqual(lanes['connect']['connections'], 1)
+        self.assertEqual(lanes['control']['connections'], 1)
+        self.assertTrue(lanes['control']['reused'] >= 20)
+
+    @defer.inlineCallbacks
+    def test_batch_listener(self):
+        self.start()
+        batches = []
+        self.client.register_batch('/feed', lambda batch: batches.append(
+            [msg['data'] for msg in batch]), max_batch=20)
+        yield self.wait_for(self.subscribed)
+        self.server.publish_many('/feed', range(50))
+        yield self.wait_for(lambda: sum(map(len, batches)) == 50)
+        self.assertEqual(sum(batches, []), range(50))
+        self.assertEqual(max(map(len, batches)), 20)
+        self.assertEqual(len(self.messages), 50)
+
+    @defer.inlineCallbacks
+    def test_set_subscriptions(self):
+        self.start()
+        yield self.wait_for(self.subscribed)
+        ignore = lambda msg: None
+        self.client.subscription_batch = 100
+        channels = set('/many/%d' % i for i in range(250))
+        self.client.set_subscriptions(channels | set(['/feed']), ignore)
+        session = self.server.sessions.values()[0]
+        yield self.wait_for(lambda: session.subscriptions == channels |
+            set(['/feed']))
+        subscribes = self.sent('/meta/subscribe')
+        #'/feed' on its own after the handshake, then 250 in 3 messages
+        self.assertEqual(len(subscribes), 4)
+        kept = set('/many/%d' % i for i in range(200))
+        self.client.set_subscriptions(kept, ignore)
+        yield self.wait_for(lambda: session.subscriptions == kept)
+        unsubscribes = self.sent('/meta/unsubscribe')
+        self.assertEqual(len(unsubscribes), 1)
+        self.assertEqual(self.client.subscriptions, kept)
+        self.assertEqual(self.client.receiver.listeners.get('/feed'), set())
+        self.client.deregister_many(kept, ignore)
+        yield self.wait_for(lambda: not session.subscriptions)
+
+    @defer.inlineCallbacks
+    def test_one_channel_per_subscribe_by_default(self):
+        self.start()
+        yield self.wait_for(self.subscribed)
+        channels = ['/many/%d' % i for i in range(5)]
+        self.client.register_many(channels, lambda msg: None)
+        session = self.server.sessions.values()[0]
+        yield self.wait_for(lambda: set(channels) <= session.subscriptions)
+        subscribes = [msg['subscription']
+            for msg in self.sent('/meta/subscribe')]
+        self.assertEqual(sorted(subscribes), sorted(channels + ['/feed']))
+
+    @defer.inlineCallbacks
+    def test_register_many_rolls_back_bad_patterns(self):
+        self.start()
+        yield self.wait_for(self.subscribed)
+        callback = lambda msg: None
+        self.client.register('/kept', callback)
+        self.assertRaises(ValueError, self.client.register_many,
+            ['/kept', '/new', '/bad/*/x'], callback)
+        self.assertEqual(self.client.subscriptions, set(['/feed', '/kept']))
+        self.assertEqual(self.client.receiver.listeners.get('/new'), set())
+        self.assertEqual(self.client.receiver.listeners.get('/kept'),
+            set([callback]))
+        self.assertFalse([msg for msg in self.server.received
+            if msg.get('subscription') == '/new'])
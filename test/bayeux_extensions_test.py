@@ -0,0 +1,74 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+import unittest as pyunit
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from bayeux.bayeux_client import BayeuxClient
+from bayeux.bayeux_extensions import AckExtension, BayeuxExtension
+from fake_server_mixin import FakeServerMixin
+
+class AckExtensionTest(pyunit.TestCase):
+    def test_acks_batches(self):
+        ack = AckExtension()
+        handshake = {'channel': '/meta/handshake'}
+        ack.outgoing(handshake)
+        self.assertEqual(handshake['ext'], {'ack': True})
+        connect = {'channel': '/meta/connect'}
+        ack.outgoing(connect)
+        self.assertFalse('ext' in connect)
+        ack.incoming({'channel': '/meta/handshake', 'successful': True,
+            'ext': {'ack': True}})
+        ack.outgoing(connect)
+        self.assertEqual(connect['ext'], {'ack': 0})
+        ack.incoming({'channel': '/meta/connect', 'successful': True,
+            'ext': {'ack': 7}})
+        connect = {'channel': '/meta/connect', 'ext': {'other': 1}}
+        ack.outgoing(connect)
+        self.assertEqual(connect['ext'], {'other': 1, 'ack': 7})
+
+    def test_server_without_acks(self):
+        ack = AckExtension()
+        ack.outgoing({'channel': '/meta/handshake'})
+        ack.incoming({'channel': '/meta/handshake', 'successful': True})
+        connect = {'channel': '/meta/connect'}
+        ack.outgoing(connect)
+        self.assertFalse('ext' in connect)
+
+class TokenExtension(BayeuxExtension):
+    def __init__(self):
+        self.incoming_channels = []
+
+    def outgoing(self, msg):
+        msg.setdefault('ext', {})['token'] = 'secret'
+
+    def incoming(self, msg):
+        self.incoming_channels.append(msg.get('channel'))
+
+class ClientExtensionsTest(FakeServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.token = TokenExtension()
+        self.client = BayeuxClient(self.listen(), use_websocket=False,
+            extensions=[AckExtension()])
+        self.client.add_extension(self.token)
+        self.client.register('/feed', lambda msg: None)
+        reactor.callLater(0, self.client.start)
+
+    @defer.inlineCallbacks
+    def test_extensions_see_every_message(self):
+        yield self.wait_for(lambda: self.server.sessions and
+            '/feed' in self.server.sessions.values()[0].subscriptions)
+        self.server.publish('/feed', 'hello')
+        yield self.wait_for(lambda: '/feed' in self.token.incoming_channels)
+        for msg in self.server.received:
+            self.assertEqual(msg['ext']['token'], 'secret')
+        self.assertEqual(self.server.received[0]['ext']['ack'], True)
+        self.assertTrue('/meta/handshake' in self.token.incoming_channels)
+        self.client.remove_extension(self.token)
+        self.assertEqual(len(self.client.receiver.extensions), 1)
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import logging
+import unittest
+
+from bayeux import bayeux_logging
+from bayeux.bayeux_logging import PayloadSampler
+from bayeux.bayeux_message_receiver import BayeuxMessageReceiver
+
+class Payload(object):
+    """Counts how often it is formatted."""
+    def __init__(self):
+        self.formatted = 0
+
+    def __repr__(self):
+        self.formatted += 1
+        return 'payload'
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class PayloadSamplerTest(unittest.TestCase):
+    def test_every(self):
+        sampler = PayloadSampler(every=3)
+        self.assertEqual([sampler.sample('/a') for _ in range(6)],
+            [True, False, False, True, False, False])
+
+    def test_per_channel(self):
+        sampler = PayloadSampler()
+        sampler.set(0, '/noisy')
+        sampler.set(2, '/busy')
+        self.assertEqual([sampler.sample('/noisy') for _ in range(2)],
+            [False, False])
+        self.assertEqual([sampler.sample('/busy') for _ in range(2)],
+            [True, False])
+        self.assertEqual([sampler.sample('/quiet') for _ in range(2)],
+            [True, True])
+
+class LazyLoggingTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = bayeux_logging.logger
+        self.logger.addHandler(self.handler)
+        self.level = self.logger.level
+        self.receiver = BayeuxMessageReceiver()
+        self.receiver.register('/foo', lambda msg: None)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        bayeux_logging.set_payload_sampling(1)
+
+    def test_payloads_not_formatted_above_debug(self):
+        self.logger.setLevel(logging.INFO)
+        payload = Payload()
+        for _ in range(10):
+            self.receiver.notify('/foo', {'data': payload})
+        self.assertEqual(payload.formatted, 0)
+        self.assertEqual(self.handler.messages, [])
+
+    def test_payloads_sampled_at_debug(self):
+        self.logger.setLevel(logging.DEBUG)
+        bayeux_logging.set_payload_sampling(5, '/foo')
+        payload = Payload()
+        for _ in range(10):
+            self.receiver.notify('/foo', {'data': payload})
+        self.assertEqual(payload.formatted, 2)
+        self.assertEqual(len(self.handler.messages), 2)
+
+if __name__ == '__main__':
+    unittest.main()
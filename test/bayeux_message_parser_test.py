@@ -0,0 +1,94 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import json
+import unittest
+
+from bayeux.bayeux_message_parser import BayeuxMessageParser, LazyMessage
+
+class BayeuxMessageParserTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = []
+        self.parser = BayeuxMessageParser(self.messages.append)
+
+    def test_single_chunk(self):
+        self.parser.feed('[{"channel":"/a","data":{"x":[1,2]}},{"channel":"/b"}]')
+        self.assertEqual([m['channel'] for m in self.messages], ['/a', '/b'])
+        self.assertEqual(self.messages[0]['data'], {'x': [1, 2]})
+        self.assertTrue(self.parser.close())
+
+    def test_dispatches_each_message_when_complete(self):
+        self.parser.feed('[{"channel":"/a"},{"chan')
+        self.assertEqual(len(self.messages), 1)
+        self.parser.feed('nel":"/b"}]')
+        self.assertEqual(len(self.messages), 2)
+
+    def test_byte_at_a_time(self):
+        body = json.dumps([
+            {'channel': '/a', 'data': 'brace } and [ in "quotes" \\'},
+            {'channel': '/b', 'data': {'nested': [{}, []]}},
+        ])
+        for char in body:
+            self.parser.feed(char)
+        self.assertEqual(self.messages, json.loads(body))
+
+    def test_bare_object(self):
+        self.parser.feed('{"channel":"/a"}')
+        self.assertEqual(self.messages, [{'channel': '/a'}])
+
+    def test_only_current_message_is_buffered(self):
+        self.parser.feed('[{"channel":"/a"},{"channel":"/b"')
+        self.assertEqual(self.parser.chunks, ['{"channel":"/b"'])
+
+    def test_bad_message_is_skipped(self):
+        self.assertRaises(ValueError, self.parser.feed,
+            '[{"channel":/a},{"channel":"/b"}]')
+        self.assertEqual(self.messages, [{'channel': '/b'}])
+
+    def test_incomplete_response(self):
+        self.parser.feed('[{"channel":"/a"')
+        self.assertFalse(self.parser.close())
+        self.assertEqual(self.messages, [])
+
+class LazyParserTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = []
+        self.parser = BayeuxMessageParser(self.messages.append, lazy=True)
+
+    def test_data_is_decoded_when_read(self):
+        body = json.dumps([
+            {'channel': '/a', 'ext': {'k': [1]}, 'data': {'x': [1, '}']},
+                'id': '1'},
+            {'channel': '/b', 'data': 'text'},
+            {'channel': '/meta/connect', 'successful': True,
+                'advice': {'timeout': 0}},
+        ])
+        for char in body:
+            self.parser.feed(char)
+        lazy = self.messages[0]
+        self.assertTrue(isinstance(lazy, LazyMessage))
+        self.assertEqual(lazy.raw, '{"x": [1, "}"]}')
+        self.assertEqual(lazy['ext'], {'k': [1]})
+        self.assertTrue('data' in lazy)
+        self.assertEqual(lazy.get('data'), {'x': [1, '}']})
+        self.assertEqual(lazy.raw, None)
+        self.assertFalse(isinstance(self.messages[1], LazyMessage))
+        self.assertEqual(self.messages, json.loads(body))
+
+    def test_data_array_in_chunks(self):
+        self.parser.feed('[{"channel":"/a","data" : [1,')
+        self.parser.feed('{"y":2}],"id":"3"}]')
+        self.assertEqual(self.messages[0].raw, '[1,{"y":2}]')
+        self.assertEqual(self.messages[0].decode(),
+            {'channel': '/a', 'data': [1, {'y': 2}], 'id': '3'})
+
+    def test_data_inside_other_fields_is_left(self):
+        self.parser.feed('[{"channel":"/a","ext":{"data":{"z":1}}}]')
+        self.assertFalse(isinstance(self.messages[0], LazyMessage))
+        self.assertEqual(self.messages[0]['ext'], {'data': {'z': 1}})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+
+import json
+import zlib
+
+from twisted.internet import reactor, task
+from twisted.internet.defer import DeferredList
+from twisted.trial import unittest
+from twisted.web.resource import EncodingResourceWrapper, Resource
+from twisted.web.server import GzipEncoderFactory, Site
+
+from bayeux.bayeux_errors import PublishError, QueueFullError
+from bayeux.bayeux_message_receiver import BayeuxMessageReceiver
+from bayeux.bayeux_message_sender import BayeuxMessageSender
+from bayeux.bayeux_stats import BayeuxStats
+
+class RecordingResource(Resource):
+    """Replies successfully to every message and records each request."""
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.requests = []
+        self.content_types = []
+
+    def render_POST(self, request):
+        messages = json.loads(request.content.read())
+        self.requests.append(messages)
+        self.content_types.append(request.getHeader('content-type'))
+        return json.dumps([{'channel': msg['channel'], 'id': msg['id'],
+            'successful': msg['channel'] != '/reject'} for msg in messages])
+
+class DeflatingResource(RecordingResource):
+    """Replies like RecordingResource with a raw deflate encoded body, as
+    some servers send deflate."""
+    def render_POST(self, request):
+        body = RecordingResource.render_POST(self, request)
+        request.setHeader('content-encoding', 'deflate')
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+
+class BayeuxMessageSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.resource = RecordingResource()
+        self.port = reactor.listenTCP(0, Site(self.resource),
+            interface='127.0.0.1')
+        self.receiver = BayeuxMessageReceiver()
+        self.sender = BayeuxMessageSender(
+            'http://127.0.0.1:%d/cometd' % self.port.getHost().port,
+            self.receiver, batch_window=0.05, max_batch_size=3,
+            max_in_flight=1, max_pending=4)
+        self.sender.set_client_id('abc')
+
+    def tearDown(self):
+        #Let the connections go back to the pool before closing them
+        d = task.deferLater(reactor, 0.01, self.sender.close)
+        return d.addCallback(lambda _: self.port.stopListening())
+
+    def test_subscribes_are_batched(self):
+        ds = [self.sender.subscribe('/foo/%d' % i) for i in range(5)]
+
+        def check(replies):
+            self.assertEqual([len(r) for r in self.resource.requests], [3, 2])
+            self.assertEqual([reply['id'] for _, reply in replies],
+                [msg['id'] for r in self.resource.requests for msg in r])
+        return DeferredList(ds, fireOnOneErrback=True).addCallback(check)
+
+    def test_batches_are_sent_as_json(self):
+        d = self.sender.subscribe('/foo')
+
+        def check(reply):
+            self.assertEqual(self.resource.content_types,
+                ['application/json'])
+            self.assertEqual(self.resource.requests[0][0]['subscription'],
+                '/foo')
+        return d.addCallback(check)
+
+    def test_handshake_is_sent_alone(self):
+        subscribe = self.sender.subscribe('/foo')
+        handshake = self.sender.handshake()
+        #Batched messages wait for the client id of the new session
+        handshake.addCallback(lambda reply: self.sender.set_client_id('def'))
+
+        def check(replies):
+            self.assertEqual([[msg['channel'] for msg in r]
+                for r in self.resource.requests],
+                [['/meta/handshake'], ['/meta/subscribe']])
+            self.assertEqual(self.resource.requests[1][0]['clientId'], 'def')
+        d = DeferredList([subscribe, handshake], fireOnOneErrback=True)
+        return d.addCallback(check)
+
+    def test_batches_are_pipelined(self):
+        ds = [self.sender.publish('/foo', i) for i in range(4)]
+        ds.append(self.sender.subscribe('/bar'))
+
+        def check(replies):
+            #Only one batch may be in flight, so the rest gather behind it
+            self.assertEqual([len(r) for r in self.resource.requests], [3, 2])
+            self.assertEqual(self.resource.requests[0][0]['clientId'], 'abc')
+        return DeferredList(ds, fireOnOneErrback=True).addCallback(check)
+
+    def test_rejected_publish(self):
+        d = self.sender.publish('/reject', 'x')
+        return self.assertFailure(d, PublishError)
+
+    def test_publish_queue_full(self):
+        ds = [self.sender.publish('/foo', i) for i in range(4)]
+        d = self.sender.publish('/foo', 4, block=False)
+        self.assertFailure(d, QueueFullError)
+        return DeferredList(ds + [d], fireOnOneErrback=True)
+
+class CompressionTest(unittest.TestCase):
+    def start(self, resource):
+        self.resource = resource
+        self.port = reactor.listenTCP(0, Site(resource), interface='127.0.0.1')
+        self.stats = BayeuxStats()
+        self.receiver = BayeuxMessageReceiver(stats=self.stats)
+        self.sender = BayeuxMessageSender(
+            'http://127.0.0.1:%d/cometd' % self.port.getHost().port,
+            self.receiver, batch_window=0.05, max_batch_size=50,
+            compression=True)
+        self.sender.set_client_id('abc')
+
+    def tearDown(self):
+        d = task.deferLater(reactor, 0.01, self.sender.close)
+        return d.addCallback(lambda _: self.port.stopListening())
+
+    def check_compressed(self, _):
+        #Replies are dispatched before the end of the response is read
+        snapshot = self.stats.snapshot()
+        if 'read_time' not in snapshot['histograms']:
+            return task.deferLater(reactor, 0.01, self.check_compressed, _)
+        wire = snapshot['counters']['bytes_received']
+        body = snapshot['histograms']['response_bytes']['sum']
+        self.assertEqual(snapshot['histograms']['wire_bytes']['sum'], wire)
+        self.assertTrue(wire < body / 2)
+        self.assertEqual(snapshot['histograms']['response_time']['count'], 1)
+        self.assertEqual(snapshot['histograms']['read_time']['count'], 1)
+
+    def test_gzip(self):
+        self.start(EncodingResourceWrapper(RecordingResource(),
+            [GzipEncoderFactory()]))
+        ds = [self.sender.subscribe('/foo/%d' % i) for i in range(50)]
+        d = DeferredList(ds, fireOnOneErrback=True)
+        return d.addCallback(self.check_compressed)
+
+    def test_raw_deflate(self):
+        self.start(DeflatingResource())
+        ds = [self.sender.subscribe('/foo/%d' % i) for i in range(50)]
+        d = DeferredList(ds, fireOnOneErrback=True)
+        return d.addCallback(self.check_compressed)
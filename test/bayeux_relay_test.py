@@ -0,0 +1,101 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+import shutil
+import tempfile
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from bayeux import bayeux_relay
+from bayeux.bayeux_client import BayeuxClient
+from bayeux.bayeux_errors import PublishError
+from bayeux.bayeux_relay import BayeuxRelay, RelayClient
+from fake_server_mixin import FakeServerMixin
+
+class BayeuxRelayTest(FakeServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'relay.sock')
+        self.client = BayeuxClient(self.listen(), use_websocket=False)
+        self.relay = BayeuxRelay(self.client, path)
+        reactor.callLater(0, self.relay.start)
+        self.locals = [RelayClient(path) for _ in range(3)]
+        self.messages = [[] for _ in self.locals]
+        self.callbacks = []
+        for local, messages in zip(self.locals, self.messages):
+            callback = lambda msg, messages=messages: messages.append(msg)
+            self.callbacks.append(callback)
+            local.factory.initialDelay = 0.01
+            local.register('/feed', callback)
+            reactor.callLater(0, local.start)
+
+    def stop_client(self):
+        for local in self.locals:
+            local.stop()
+        self.relay.stop()
+        return FakeServerMixin.stop_client(self)
+
+    def tearDown(self):
+        d = FakeServerMixin.tearDown(self)
+        return d.addCallback(lambda _: shutil.rmtree(self.dir))
+
+    def upstream_subscriptions(self):
+        return set().union(*[session.subscriptions
+            for session in self.server.sessions.values()])
+
+    @defer.inlineCallbacks
+    def test_fan_out(self):
+        yield self.wait_for(lambda: '/feed' in self.upstream_subscriptions()
+            and len(self.relay.subscribers.get('/feed', ())) == 3)
+        self.server.start_feed('/feed', rate=1000, count=20)
+        yield self.wait_for(lambda: all(len(messages) == 20
+            for messages in self.messages))
+        for messages in self.messages:
+            self.assertEqual([msg['data']['seq'] for msg in messages],
+                range(20))
+        self.assertEqual(len(self.server.sessions), 1)
+        self.assertEqual(self.relay.frames, 20)
+        self.assertEqual(self.relay.writes, 60)
+
+    @defer.inlineCallbacks
+    def test_publish_and_unsubscribe(self):
+        yield self.wait_for(lambda: len(
+            self.relay.subscribers.get('/feed', ())) == 3)
+        self.locals[0].publish('/other', 'hello')
+        yield self.wait_for(lambda: self.sent('/other'))
+        for local, callback in zip(self.locals, self.callbacks):
+            local.deregister('/feed', callback)
+        yield self.wait_for(lambda: '/feed' not in self.relay.subscribers)
+        yield self.wait_for(lambda: self.sent('/meta/unsubscribe'))
+
+    @defer.inlineCallbacks
+    def test_failed_publish_is_logged(self):
+        warnings = []
+        self.patch(bayeux_relay.logger, 'warning',
+            lambda *args: warnings.append(args[0] % args[1:]))
+        self.patch(self.client, 'publish', lambda id, data, block:
+            defer.fail(PublishError('403::Denied')))
+        yield self.wait_for(lambda: len(
+            self.relay.subscribers.get('/feed', ())) == 3)
+        self.locals[0].publish('/other', 'hello')
+        yield self.wait_for(lambda: warnings)
+        self.assertEqual(warnings,
+            ['Relayed publish to /other failed: 403::Denied'])
+
+    @defer.inlineCallbacks
+    def test_subscriptions_resent_after_relay_restart(self):
+        yield self.wait_for(lambda: len(
+            self.relay.subscribers.get('/feed', ())) == 3)
+        self.relay.stop()
+        yield self.wait_for(lambda: '/feed' not in self.relay.subscribers)
+        self.relay.start()
+        yield self.wait_for(lambda: '/feed' in self.upstream_subscriptions()
+            and len(self.relay.subscribers.get('/feed', ())) == 3)
+        self.server.start_feed('/feed', rate=1000, count=5)
+        yield self.wait_for(lambda: all(len(messages) == 5
+            for messages in self.messages))
@@ -0,0 +1,212 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+import shutil
+import tempfile
+import threading
+import unittest as pyunit
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from bayeux import bayeux_constants
+from bayeux.bayeux_client import BayeuxClient
+from bayeux.bayeux_dispatcher import ThreadPoolDispatcher
+from bayeux.bayeux_message_receiver import BayeuxMessageReceiver
+from bayeux.bayeux_replay import BayeuxReplay, ReplayStore, replay_id
+from fake_server_mixin import FakeServerMixin
+
+class ReplayStoreTest(pyunit.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'replay')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def lines(self):
+        with open(self.path) as f:
+            return f.readlines()
+
+    def test_reload(self):
+        store = ReplayStore(self.path, fsync=False)
+        store.record('/foo', 1)
+        store.record('/bar', 'a')
+        store.record('/foo', 2)
+        store.close()
+        store = ReplayStore(self.path)
+        self.assertEqual(store.get('/foo'), 2)
+        self.assertEqual(store.get('/bar'), 'a')
+        self.assertEqual(store.get('/baz'), None)
+        store.close()
+
+    def test_batched(self):
+        store = ReplayStore(self.path, sync_every=3, fsync=False)
+        store.record('/foo', 1)
+        store.record('/foo', 2)
+        store.record('/bar', 1)
+        self.assertEqual(self.lines(), [])
+        self.assertEqual(store.get('/foo'), 2)
+        store.record('/baz', 1)
+        self.assertEqual(len(self.lines()), 3)
+        store.close()
+
+    def test_truncated_record(self):
+        with open(self.path, 'w') as f:
+            f.write('["/foo",5]\n["/foo",6]\n["/fo')
+        store = ReplayStore(self.path)
+        self.assertEqual(store.get('/foo'), 6)
+        store.close()
+
+    def test_compact(self):
+        store = ReplayStore(self.path, sync_every=1, fsync=False,
+            compact_lines=10)
+        for i in range(25):
+            store.record('/foo', i)
+        store.record('/bar', 0)
+        store.close()
+        self.assertTrue(len(self.lines()) < 10)
+        store = ReplayStore(self.path)
+        self.assertEqual(store.get('/foo'), 24)
+        self.assertEqual(store.get('/bar'), 0)
+        store.close()
+
+    def test_memory(self):
+        store = ReplayStore()
+        store.record('/foo', 1)
+        store.sync()
+        self.assertEqual(store.get('/foo'), 1)
+        store.close()
+
+class ReplayTest(pyunit.TestCase):
+    def test_replay_id(self):
+        self.assertEqual(replay_id(
+            {'data': {'event': {'replayId': 7}}, 'id': '3'}), 7)
+        self.assertEqual(replay_id({'data': 'x', 'id': '3'}), '3')
+        self.assertEqual(replay_id({'data': {}}), None)
+
+    def test_subscribe_ext(self):
+        replay = BayeuxReplay(default=-1)
+        self.assertEqual(replay.subscribe_ext('/foo'),
+            {'replay': {'/foo': -1}})
+        replay.store.record('/foo', 9)
+        self.assertEqual(replay.subscribe_ext('/foo'),
+            {'replay': {'/foo': 9}})
+        self.assertEqual(BayeuxReplay().subscribe_ext('/foo'), None)
+
+    def test_subscribe_ext_wildcard(self):
+        replay = BayeuxReplay(default=-1)
+        for channel, cursor in [('/foo/a', 1), ('/foo/b', 2),
+                ('/foo/a/x', 3), ('/other', 4)]:
+            replay.store.record(channel, cursor)
+        self.assertEqual(replay.subscribe_ext('/foo/*'),
+            {'replay': {'/foo/*': -1, '/foo/a': 1, '/foo/b': 2}})
+        self.assertEqual(replay.subscribe_ext(['/foo/**', '/other']),
+            {'replay': {'/foo/**': -1, '/foo/a': 1, '/foo/b': 2,
+                '/foo/a/x': 3, '/other': 4}})
+        self.assertEqual(BayeuxReplay().subscribe_ext('/bar/*'), None)
+
+class ReplaySyncTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @defer.inlineCallbacks
+    def test_close_cancels_sync(self):
+        replay = BayeuxReplay(os.path.join(self.dir, 'replay'),
+            key=lambda msg: msg['id'])
+        replay.seen('/foo', {'id': 1})
+        call = replay.sync_call
+        self.assertTrue(call.active())
+        replay.close()
+        #Cancelled on the reactor thread
+        yield task.deferLater(reactor, 0, lambda: None)
+        self.assertFalse(call.active())
+        self.assertEqual(replay.sync_call, None)
+        store = ReplayStore(replay.store.path)
+        self.assertEqual(store.get('/foo'), 1)
+        store.close()
+
+class ReplayDeliveryTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.dispatcher = ThreadPoolDispatcher(workers=2)
+        self.receiver = BayeuxMessageReceiver(self.dispatcher)
+        self.replay = self.receiver.replay = BayeuxReplay(
+            key=lambda msg: msg['id'])
+
+    def tearDown(self):
+        self.release.set()
+        self.dispatcher.stop()
+
+    def wait_for(self, condition):
+        """Polls until condition is true."""
+        def poll():
+            if condition():
+                return
+            return task.deferLater(reactor, 0.01, poll)
+        return poll()
+
+    @defer.inlineCallbacks
+    def test_cursor_waits_for_threaded_delivery(self):
+        delivered = []
+
+        def listener(msg):
+            if msg['id'] == 1:
+                self.release.wait(5)
+            delivered.append(msg['id'])
+        self.receiver.register('/foo', listener)
+        for i in (1, 2):
+            self.receiver.notify('/foo', {'channel': '/foo', 'id': i})
+        yield self.wait_for(lambda: delivered == [2])
+        yield task.deferLater(reactor, 0.05, lambda: None)
+        #Message 1 is still with its listener, so a restart must replay it
+        self.assertEqual(self.replay.store.get('/foo'), None)
+        self.release.set()
+        yield self.wait_for(lambda: self.replay.store.get('/foo') == 2)
+        self.assertEqual(self.replay.pending, {})
+
+    @defer.inlineCallbacks
+    def test_cursor_without_listeners(self):
+        self.receiver.notify('/bar', {'channel': '/bar', 'id': 7})
+        yield self.wait_for(lambda: self.replay.store.get('/bar') == 7)
+
+class ClientReplayTest(FakeServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.replay = BayeuxReplay(os.path.join(self.dir, 'replay'),
+            key=lambda msg: msg['data']['seq'])
+        self.addCleanup(self.replay.close)
+        self.client = BayeuxClient(self.listen(), use_websocket=False,
+            replay=self.replay)
+        self.messages = []
+        self.client.register('/feed', lambda msg: self.messages.append(msg))
+        reactor.callLater(0, self.client.start)
+
+    @defer.inlineCallbacks
+    def test_resubscribe_from_last_seen(self):
+        yield self.wait_for(lambda: self.server.sessions and
+            '/feed' in self.server.sessions.values()[0].subscriptions)
+        handshake = self.sent(bayeux_constants.HANDSHAKE_CHANNEL)[0]
+        self.assertEqual(handshake['ext'], {'replay': True})
+        self.assertFalse('ext' in
+            self.sent(bayeux_constants.SUBSCRIBE_CHANNEL)[0])
+        self.server.start_feed('/feed', rate=1000, count=5)
+        yield self.wait_for(lambda: len(self.messages) == 5)
+        last = self.messages[-1]['data']['seq']
+        self.server.expire_sessions()
+        yield self.wait_for(lambda: len(
+            self.sent(bayeux_constants.SUBSCRIBE_CHANNEL)) == 2)
+        self.assertEqual(self.sent(bayeux_constants.SUBSCRIBE_CHANNEL)[1]
+            ['ext'], {'replay': {'/feed': last}})
+        self.replay.sync()
+        store = ReplayStore(self.replay.store.path)
+        self.assertEqual(store.get('/feed'), last)
+        store.close()
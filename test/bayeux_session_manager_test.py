@@ -0,0 +1,100 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from bayeux.bayeux_backoff import Backoff
+from bayeux.bayeux_pool import BayeuxConnectionPool
+from bayeux.bayeux_session_manager import BayeuxSessionManager
+from fake_server_mixin import FakeServerMixin
+
+class BayeuxConnectionPoolTest(unittest.TestCase):
+    def test_requests_wait_for_room_per_host(self):
+        pool = BayeuxConnectionPool(max_per_host=1)
+        first = pool.acquire('http://a.example/cometd')
+        second = pool.acquire('http://a.example:80/cometd')
+        other = pool.acquire('http://b.example/cometd')
+        self.assertTrue(first.called)
+        self.assertFalse(second.called)
+        self.assertTrue(other.called)
+        pool.release('http://a.example/cometd')
+        self.assertTrue(second.called)
+
+class BayeuxSessionManagerTest(FakeServerMixin, unittest.TestCase):
+    """Runs several sessions against fake servers."""
+    def setUp(self):
+        self.manager = BayeuxSessionManager(max_per_host=2,
+            use_websocket=False,
+            backoff=Backoff(initial=0.01, maximum=0.05, jitter=0))
+        self.messages = {}
+
+    def stop_client(self):
+        self.manager.close()
+        return task.deferLater(reactor, 0.1, self.manager.pool.close)
+
+    def add(self, name, url):
+        client = self.manager.add_session(name, url)
+        messages = self.messages[name] = []
+        client.register('/feed', lambda msg: messages.append(msg))
+        return client
+
+    def subscribed(self, server, count):
+        return len([session for session in server.sessions.values()
+            if '/feed' in session.subscriptions]) == count
+
+    def test_duplicate_name(self):
+        url = self.listen()
+        self.add('a', url)
+        self.assertRaises(ValueError, self.manager.add_session, 'a', url)
+
+    @defer.inlineCallbacks
+    def test_sessions_are_independent(self):
+        first_url = self.listen(connect_timeout=0.1)
+        first = self.server
+        second_url = self.listen(connect_timeout=0.1)
+        second = self.server
+        self.add('first', first_url)
+        self.add('second', second_url)
+        reactor.callLater(0, self.manager.start)
+        yield self.wait_for(lambda: self.subscribed(first, 1) and
+            self.subscribed(second, 1))
+        first.start_feed('/feed', rate=200)
+        second.start_feed('/feed', rate=200)
+        yield self.wait_for(lambda: len(self.messages['first']) >= 10 and
+            len(self.messages['second']) >= 10)
+
+        removed = self.manager.remove_session('first')
+        self.assertFalse(removed.started)
+        self.assertEqual(self.manager.get_session('first'), None)
+        yield self.wait_for(lambda: not first.sessions)
+        received = len(self.messages['second'])
+        yield self.wait_for(lambda: len(self.messages['second']) >=
+            received + 10)
+        self.assertTrue(reactor.running)
+
+    @defer.inlineCallbacks
+    def test_many_sessions_share_a_host(self):
+        url = self.listen(connect_timeout=0.1)
+        server = self.server
+        for i in range(20):
+            self.add(i, url)
+        reactor.callLater(0, self.manager.start)
+        yield self.wait_for(lambda: self.subscribed(server, 20))
+        server.start_feed('/feed', rate=100, count=10)
+        yield self.wait_for(lambda: all(len(messages) == 10
+            for messages in self.messages.values()))
+        #Every session kept its connect connection, and the sessions
+        #took turns on a couple of control connections
+        for i in range(20):
+            lanes = self.manager.get_session(i).sender.lane_stats()
+            self.assertEqual(lanes['connect']['connections'], 1)
+            self.assertTrue(lanes['connect']['reused'] > 0)
+        self.assertTrue(lanes['control']['connections'] <= 2)
+
+if __name__ == '__main__':
+    unittest.main()
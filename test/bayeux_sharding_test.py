@@ -0,0 +1,96 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+import unittest as pyunit
+
+from twisted.internet import defer, threads
+from twisted.trial import unittest
+
+from bayeux.bayeux_sharding import HashRing, ShardedBayeuxClient
+from fake_server_mixin import FakeServerMixin
+
+def ignore(msg):
+    """Listener run in the shard workers."""
+    pass
+
+class HashRingTest(pyunit.TestCase):
+    def test_spreads_keys(self):
+        ring = HashRing(['a', 'b', 'c'])
+        counts = {}
+        for i in range(3000):
+            node = ring.node_for('/feed/%d' % i)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(sorted(counts), ['a', 'b', 'c'])
+        self.assertTrue(min(counts.values()) > 600)
+
+    def test_adding_a_node_moves_few_keys(self):
+        ring = HashRing(['a', 'b', 'c'])
+        keys = ['/feed/%d' % i for i in range(3000)]
+        before = [ring.node_for(key) for key in keys]
+        ring.add('d')
+        after = [ring.node_for(key) for key in keys]
+        moved = [(old, new) for old, new in zip(before, after) if old != new]
+        self.assertTrue(len(moved) < 1200)
+        self.assertTrue(all(new == 'd' for _, new in moved))
+        ring.remove('d')
+        self.assertEqual([ring.node_for(key) for key in keys], before)
+
+    def test_empty(self):
+        self.assertRaises(ValueError, HashRing().node_for, '/feed')
+
+class ShardedBayeuxClientTest(FakeServerMixin, unittest.TestCase):
+    timeout = 60
+    poll_interval = 0.05
+
+    def setUp(self):
+        self.client = ShardedBayeuxClient(self.listen(), shards=2,
+            stats=True, use_websocket=False)
+        self.channels = ['/feed/%d' % i for i in range(10)]
+        for channel in self.channels:
+            self.client.register(channel, ignore)
+        self.client.start()
+
+    def stop_client(self):
+        #The workers wait for their disconnects, which the server answers
+        #on this thread
+        return threads.deferToThread(self.client.close)
+
+    def subscribed(self, sessions):
+        subscriptions = [session.subscriptions
+            for session in self.server.sessions.values()]
+        return (len(subscriptions) == sessions and
+            set(self.channels) <= set().union(*subscriptions))
+
+    def received(self):
+        channels = self.client.stats()['channels']
+        return sum(channels.get(channel, {}).get('received', 0)
+            for channel in self.channels)
+
+    @defer.inlineCallbacks
+    def test_channels_are_spread_over_workers(self):
+        yield self.wait_for(lambda: self.subscribed(2))
+        for session in self.server.sessions.values():
+            self.assertTrue(0 < len(session.subscriptions) < 10)
+        for i, channel in enumerate(self.channels):
+            self.server.publish(channel, i)
+        yield self.wait_for(lambda: self.received() == 10)
+        health = self.client.health()
+        self.assertEqual(sorted(health), ['shard-0', 'shard-1'])
+        for state in health.values():
+            self.assertTrue(state['alive'] and state['handshook'])
+        self.assertEqual(sum(state['channels'] for state in health.values()),
+            10)
+
+    @defer.inlineCallbacks
+    def test_resize(self):
+        yield self.wait_for(lambda: self.subscribed(2))
+        yield threads.deferToThread(self.client.resize, 3)
+        yield self.wait_for(lambda: self.subscribed(3))
+        self.assertEqual(sum(len(session.subscriptions)
+            for session in self.server.sessions.values()), 10)
+        yield threads.deferToThread(self.client.resize, 1)
+        yield self.wait_for(lambda: self.subscribed(1))
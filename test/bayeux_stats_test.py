@@ -0,0 +1,105 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+import unittest as pyunit
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from bayeux.bayeux_client import BayeuxClient
+from bayeux.bayeux_message_receiver import BayeuxMessageReceiver
+from bayeux.bayeux_stats import BayeuxStats, Histogram
+from fake_server_mixin import FakeServerMixin
+
+class HistogramTest(pyunit.TestCase):
+    def test_empty(self):
+        snapshot = Histogram().snapshot()
+        self.assertEqual(snapshot['count'], 0)
+        self.assertEqual(snapshot['p50'], None)
+
+    def test_percentiles_within_bucket_precision(self):
+        histogram = Histogram(base=1.1)
+        for value in range(1, 1001):
+            histogram.record(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 1000)
+        self.assertEqual((snapshot['min'], snapshot['max']), (1, 1000))
+        self.assertAlmostEqual(snapshot['mean'], 500.5)
+        self.assertTrue(500 <= snapshot['p50'] <= 550)
+        self.assertTrue(990 <= snapshot['p99'] <= 1000)
+
+    def test_zero(self):
+        histogram = Histogram()
+        histogram.record(0)
+        histogram.record(2)
+        self.assertEqual(histogram.percentile(50), 0)
+        self.assertEqual(histogram.percentile(100), 2)
+
+class ReceiverStatsTest(pyunit.TestCase):
+    def test_notify(self):
+        stats = BayeuxStats()
+        receiver = BayeuxMessageReceiver(stats=stats)
+        called = []
+        receiver.register('/foo/*', lambda msg: called.append(msg))
+        receiver.notify('/foo/bar', {'data': 1})
+        receiver.notify('/baz', {'data': 2})
+        snapshot = stats.snapshot()
+        self.assertEqual(len(called), 1)
+        self.assertEqual(snapshot['channels'], {
+            '/foo/bar': {'received': 1, 'dispatched': 1},
+            '/baz': {'received': 1}})
+        self.assertEqual(snapshot['histograms']['callback_time']['count'], 1)
+
+    def test_disabled(self):
+        receiver = BayeuxMessageReceiver()
+        self.assertEqual(receiver.stats, None)
+        receiver.notify('/foo', {})
+        client = BayeuxClient('http://127.0.0.1:1/cometd')
+        self.assertEqual(client.stats(), None)
+        self.assertRaises(ValueError, client.add_stats_exporter,
+            lambda snapshot: None, 1)
+
+class ClientStatsTest(FakeServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.client = BayeuxClient(self.listen(), stats=True)
+        self.messages = []
+        self.client.register('/feed', lambda msg: self.messages.append(msg))
+        reactor.callLater(0, self.client.start)
+
+    def stop_client(self):
+        self.client.receiver.stats.stop()
+        return FakeServerMixin.stop_client(self)
+
+    @defer.inlineCallbacks
+    def test_stats(self):
+        yield self.wait_for(lambda: self.server.sessions and
+            '/feed' in self.server.sessions.values()[0].subscriptions)
+        self.server.start_feed('/feed', rate=1000, payload_size=10, count=20)
+        yield self.wait_for(lambda: len(self.messages) == 20)
+        stats = self.client.stats()
+        self.assertEqual(stats['counters']['handshakes'], 1)
+        self.assertTrue(stats['counters']['messages_sent'] >= 3)
+        self.assertTrue(stats['counters']['responses'] >= 3)
+        self.assertEqual(stats['channels']['/feed'],
+            {'received': 20, 'dispatched': 20})
+        histograms = stats['histograms']
+        self.assertEqual(histograms['callback_time']['count'],
+            stats['channels']['/feed']['dispatched'] +
+            stats['channels']['/meta/handshake']['dispatched'] +
+            stats['channels']['/meta/connect']['dispatched'])
+        for name in ('response_bytes', 'decode_time', 'connect_rtt',
+                'queue_depth'):
+            self.assertTrue(histograms[name]['count'] > 0, name)
+        self.assertEqual(stats['lanes']['connect']['connections'], 1)
+
+    @defer.inlineCallbacks
+    def test_exporter(self):
+        snapshots = []
+        self.client.add_stats_exporter(snapshots.append, 0.01)
+        yield self.wait_for(lambda: len(snapshots) >= 2)
+        self.assertTrue('counters' in snapshots[-1])
+        self.assertTrue('lanes' in snapshots[-1])
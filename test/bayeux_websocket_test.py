@@ -0,0 +1,59 @@
+#!/usr/bin/python
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(os.path.dirname(__file__))
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from bayeux.bayeux_client import BayeuxClient
+from bayeux.bayeux_websocket import websocket_available
+from fake_server_mixin import FakeServerMixin
+
+class BayeuxWebSocketTest(FakeServerMixin, unittest.TestCase):
+    if not websocket_available():
+        skip = 'autobahn is not installed'
+
+    def start(self, connection_types=('websocket', 'long-polling'),
+            **client_kwargs):
+        url = self.listen(connection_types=connection_types,
+            connect_timeout=0.2)
+        self.client = BayeuxClient(url, **client_kwargs)
+        received = defer.Deferred()
+        subscribed = defer.Deferred()
+        self.client.register('/chat', received.callback)
+        self.client.receiver.register('/meta/subscribe',
+            lambda msg: subscribed.called or subscribed.callback(msg))
+        #Start from inside the running reactor
+        reactor.callLater(0, self.client.start)
+        subscribed.addCallback(
+            lambda _: self.client.publish('/chat', {'text': 'hello'}))
+        return received
+
+    def connection_types(self):
+        return set(msg['connectionType']
+            for msg in self.sent('/meta/connect'))
+
+    def test_prefers_websocket(self):
+        def check(msg):
+            self.assertEqual(msg['data'], {'text': 'hello'})
+            self.assertEqual(self.client.sender.connection_type, 'websocket')
+            self.assertEqual(self.connection_types(), set(['websocket']))
+        return self.start().addCallback(check)
+
+    def test_falls_back_when_websocket_fails(self):
+        def check(msg):
+            self.assertEqual(msg['data'], {'text': 'hello'})
+            self.assertEqual(self.connection_types(), set(['long-polling']))
+        d = self.start(ws_url='ws://127.0.0.1:1/cometd')
+        return d.addCallback(check)
+
+    def test_long_polling_when_server_has_no_websocket(self):
+        def check(msg):
+            handshake = self.server.received[0]
+            self.assertIn('websocket', handshake['supportedConnectionTypes'])
+            self.assertEqual(self.connection_types(), set(['long-polling']))
+        d = self.start(('long-polling',))
+        return d.addCallback(check)
@@ -0,0 +1,225 @@
+"""asyncio version of the fake CometD style server, for AsyncBayeuxClient.
+
+Needs Python 3.7 or later. It speaks long-polling only and is small
+enough to run thousands of sessions on the same event loop as the clients
+under test. See fake_bayeux_server.py for the Twisted version.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+
+async def append_later(messages, msg):
+    """Coroutine listener that appends a message after yielding to the
+    loop once."""
+    await asyncio.sleep(0)
+    messages.append(msg)
+
+class FakeSession(object):
+    """State the fake server keeps for one handshaken client."""
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.subscriptions = set()
+        self.queue = []
+        self.waiter = None
+
+class FakeAsyncBayeuxServer(object):
+    """Minimal CometD style server running on an asyncio event loop.
+
+    Supports handshake, connect, subscribe, unsubscribe, disconnect and
+    publish over long-polling on keep-alive HTTP/1.1 connections.
+
+    Attributes:
+        sessions: Sessions by client id
+        connect_timeout: Time in seconds connects are held for
+        received: Every message received, in order
+        error_rate: Fraction of requests answered with a 500 error
+        random: Random number generator deciding which requests fail
+        feeds: The running feed tasks
+        handlers: The tasks serving each open connection
+        server: The asyncio server, once started
+        port: The port listened on, once started
+    """
+    def __init__(self, connect_timeout=0.2, error_rate=0, seed=None):
+        self.sessions = {}
+        self.connect_timeout = connect_timeout
+        self.received = []
+        self.ids = itertools.count(1)
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.feeds = []
+        self.handlers = set()
+        self.loop = None
+        self.server = None
+        self.port = None
+
+    async def start(self, port=0):
+        """Starts listening on localhost.
+
+        Returns:
+            The url to connect clients to
+        """
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1',
+            port, backlog=4096)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return 'http://127.0.0.1:%d/bayeux' % self.port
+
+    async def close(self):
+        """Stops the feeds, answers every held connect and stops
+        listening."""
+        for feed in self.feeds:
+            feed.cancel()
+        self.feeds = []
+        self.expire_sessions()
+        self.server.close()
+        await self.server.wait_closed()
+        #Close the connections clients still have open
+        handlers, self.handlers = self.handlers, set()
+        for handler in handlers:
+            handler.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    async def _serve(self, reader, writer):
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                length = 0
+                while True:
+                    header = (await reader.readline()).strip()
+                    if not header:
+                        break
+                    name, _, value = header.partition(b':')
+                    if name.strip().lower() == b'content-length':
+                        length = int(value)
+                body = await reader.readexactly(length)
+                if self.error_rate and self.random.random() < self.error_rate:
+                    self._respond(writer, b'', 500)
+                    continue
+                replies = await self.handle(json.loads(body.decode('utf-8')))
+                self._respond(writer, json.dumps(replies).encode('utf-8'))
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.CancelledError):
+            #Cancelled by close, which waits for this to return
+            pass
+        finally:
+            self.handlers.discard(handler)
+            writer.close()
+
+    def _respond(self, writer, body, code=200):
+        writer.write(b'HTTP/1.1 %d OK\r\nContent-Type: application/json\r\n'
+            b'Content-Length: %d\r\n\r\n%s' % (code, len(body), body))
+
+    async def handle(self, messages):
+        """Handles a batch of messages.
+
+        Returns:
+            The replies, after holding any connect until there is data for
+            it or it times out
+        """
+        replies = []
+        held = None
+        for msg in messages:
+            self.received.append(msg)
+            channel = msg['channel']
+            reply = {'channel': channel, 'id': msg.get('id'),
+                'successful': True}
+            session = self.sessions.get(msg.get('clientId'))
+            if channel == '/meta/handshake':
+                session = FakeSession(str(next(self.ids)))
+                self.sessions[session.client_id] = session
+                reply['clientId'] = session.client_id
+                reply['supportedConnectionTypes'] = ['long-polling']
+            elif session is None:
+                reply['successful'] = False
+                reply['error'] = '402::Unknown client'
+                reply['advice'] = {'reconnect': 'handshake'}
+            elif channel == '/meta/connect':
+                reply['advice'] = {'interval': 0,
+                    'timeout': int(self.connect_timeout * 1000)}
+                held = session
+            elif channel == '/meta/subscribe':
+                session.subscriptions.add(msg['subscription'])
+                reply['subscription'] = msg['subscription']
+            elif channel == '/meta/unsubscribe':
+                session.subscriptions.discard(msg['subscription'])
+                reply['subscription'] = msg['subscription']
+            elif channel == '/meta/disconnect':
+                del self.sessions[session.client_id]
+                if session.waiter is not None and not session.waiter.done():
+                    session.waiter.set_result(None)
+            else:
+                self.publish(channel, msg.get('data'))
+            replies.append(reply)
+        if held is not None:
+            if not held.queue:
+                held.waiter = self.loop.create_future()
+                try:
+                    await asyncio.wait_for(held.waiter, self.connect_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                held.waiter = None
+            replies = held.queue + replies
+            held.queue = []
+        return replies
+
+    def publish(self, channel, data):
+        """Delivers data to every session subscribed to the channel."""
+        self.publish_many(channel, [data])
+
+    def publish_many(self, channel, data):
+        """Delivers several messages to every session subscribed to the
+        channel."""
+        events = [{'channel': channel, 'data': item} for item in data]
+        for session in self.sessions.values():
+            if channel in session.subscriptions:
+                session.queue.extend(events)
+                if session.waiter is not None and not session.waiter.done():
+                    session.waiter.set_result(None)
+
+    def start_feed(self, channel, rate, payload_size=0, count=None):
+        """Starts publishing generated messages on a channel.
+
+        Each message's data holds its sequence number, the time it was
+        published and a payload of the given size.
+
+        Args:
+            channel: The channel to publish on
+            rate: Messages per second
+            payload_size: Size in bytes of each message's payload
+            count: Number of messages to publish, None for no limit
+
+        Returns:
+            The task publishing the messages
+        """
+        feed = self.loop.create_task(
+            self._feed(channel, rate, 'x' * payload_size, count))
+        self.feeds.append(feed)
+        return feed
+
+    async def _feed(self, channel, rate, payload, count):
+        started = time.time()
+        sent = 0
+        while count is None or sent < count:
+            await asyncio.sleep(0.01)
+            due = int((time.time() - started) * rate)
+            if count is not None:
+                due = min(due, count)
+            if due > sent:
+                now = time.time()
+                self.publish_many(channel, [{'seq': seq, 'sent': now,
+                    'payload': payload} for seq in range(sent, due)])
+                sent = due
+
+    def expire_sessions(self):
+        """Forgets every client, so their next messages are answered with
+        an unknown client error and handshake advice."""
+        for session in self.sessions.values():
+            if session.waiter is not None and not session.waiter.done():
+                session.waiter.set_result(None)
+        self.sessions = {}
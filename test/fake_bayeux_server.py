@@ -0,0 +1,368 @@
+#!/usr/bin/python
+"""Scriptable in-process CometD style server for tests and benchmarks.
+
+Run it directly to serve a feed that a client, such as
+test/bayeux_client_test.py or benchmarks/client_bench.py, can connect to:
+
+    python test/fake_bayeux_server.py --port 8080 --channel /chat/demo \\
+        --rate 100 --payload 256
+
+The port it is listening on is printed on the first line of its output.
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+import urlparse
+
+from twisted.internet import reactor, task
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+try:
+    from autobahn.twisted.resource import WebSocketResource
+    from autobahn.twisted.websocket import (WebSocketServerFactory,
+        WebSocketServerProtocol)
+except ImportError:
+    WebSocketResource = None
+    WebSocketServerProtocol = object
+
+def _channels(subscription):
+    """Returns the channels of a subscription, which may be an array."""
+    if isinstance(subscription, list):
+        return subscription
+    return [subscription]
+
+class FakeSession(object):
+    """State the fake server keeps for one handshaken client."""
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.subscriptions = set()
+        self.queue = []
+        self.pending_connect = None
+        self.release_call = None
+        self.connect_reply = None
+        self.websocket = None
+
+class Feed(object):
+    """Publishes generated messages on a channel at a fixed rate.
+
+    Each message's data holds its sequence number, the time it was
+    published (so receivers can measure delivery latency) and a payload
+    of the configured size.
+
+    Attributes:
+        server: The server to publish through
+        channel: The channel to publish on
+        rate: Messages per second
+        count: Number of messages to publish before stopping, None to
+               publish until stopped
+        sent: Number of messages published so far
+    """
+    def __init__(self, server, channel, rate, payload_size=0, count=None):
+        self.server = server
+        self.channel = channel
+        self.rate = rate
+        self.count = count
+        self.payload = 'x' * payload_size
+        self.sent = 0
+        self.started = None
+        self.loop = task.LoopingCall(self.tick)
+
+    def start(self, interval=0.01):
+        """Starts publishing, checking every interval seconds for messages
+        that are due."""
+        self.started = time.time()
+        self.loop.start(interval, now=False)
+
+    def tick(self):
+        due = int((time.time() - self.started) * self.rate)
+        if self.count is not None:
+            due = min(due, self.count)
+        if due > self.sent:
+            now = time.time()
+            self.server.publish_many(self.channel, [{'seq': seq,
+                'sent': now, 'payload': self.payload}
+                for seq in range(self.sent, due)])
+            self.sent = due
+        if self.count is not None and self.sent >= self.count:
+            self.stop()
+
+    def stop(self):
+        """Stops publishing."""
+        if self.loop.running:
+            self.loop.stop()
+
+class FakeBayeuxServer(Resource):
+    """Minimal in-process CometD style server used by the tests.
+
+    Supports handshake, connect, subscribe, unsubscribe, disconnect and
+    publish over long-polling and, if autobahn is installed, websockets
+    on the same url. Feeds publish generated messages at a set rate, and
+    faults can be injected to check that clients recover from them.
+
+    Attributes:
+        sessions: Sessions by client id
+        connection_types: Connection types offered at handshake
+        connect_timeout: Time in seconds connects are held for
+        reconnect_advice: Reconnect advice given to unknown clients
+        received: Every message received, in order
+        feeds: The running feeds
+        error_rate: Fraction of requests answered with a 500 error
+        drop_rate: Fraction of requests, and websocket messages, whose
+                   connection is dropped without a response
+        latency: Time in seconds every request is held before it is
+                 handled
+        random: Random number generator deciding which requests fail
+    """
+    isLeaf = True
+
+    def __init__(self, connection_types=('websocket', 'long-polling'),
+            connect_timeout=0.2, error_rate=0, drop_rate=0, latency=0,
+            seed=None):
+        Resource.__init__(self)
+        self.sessions = {}
+        self.connection_types = list(connection_types)
+        self.connect_timeout = connect_timeout
+        self.reconnect_advice = 'handshake'
+        self.received = []
+        self.ids = itertools.count(1)
+        self.feeds = []
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.websocket = None
+        if WebSocketResource is not None and 'websocket' in connection_types:
+            factory = WebSocketServerFactory()
+            factory.protocol = FakeWebSocketProtocol
+            factory.bayeux_server = self
+            self.websocket = WebSocketResource(factory)
+
+    def render_GET(self, request):
+        if self.websocket is not None and request.getHeader('upgrade'):
+            return self.websocket.render(request)
+        request.setResponseCode(400)
+        return ''
+
+    def render_POST(self, request):
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            request.channel.transport.abortConnection()
+            return NOT_DONE_YET
+        if self.error_rate and self.random.random() < self.error_rate:
+            request.setResponseCode(500)
+            return ''
+        if self.latency:
+            reactor.callLater(self.latency, self._render_later, request)
+            return NOT_DONE_YET
+        return self._render(request)
+
+    def _render_later(self, request):
+        body = self._render(request)
+        if body is not NOT_DONE_YET:
+            request.write(body)
+            request.finish()
+
+    def _render(self, request):
+        body = request.content.read()
+        if request.getHeader('content-type').startswith(
+                'application/x-www-form-urlencoded'):
+            body = urlparse.parse_qs(body)['message'][0]
+        replies, held = self.handle(json.loads(body))
+        if held is None:
+            return json.dumps(replies)
+
+        #Clients may go away while their connect is held
+        lost = []
+        request.notifyFinish().addErrback(lost.append)
+
+        def respond(queue):
+            if lost:
+                return
+            request.write(json.dumps(replies + queue))
+            request.finish()
+        self.hold(held, respond)
+        return NOT_DONE_YET
+
+    def handle(self, messages, websocket=None):
+        """Handles a batch of messages.
+
+        Returns:
+            The replies and, if a connect is being held, its session
+        """
+        replies = []
+        held = None
+        for msg in messages:
+            self.received.append(msg)
+            channel = msg['channel']
+            reply = {'channel': channel, 'id': msg.get('id'),
+                'successful': True}
+            session = self.sessions.get(msg.get('clientId'))
+            if channel == '/meta/handshake':
+                session = FakeSession(str(next(self.ids)))
+                self.sessions[session.client_id] = session
+                reply['clientId'] = session.client_id
+                reply['supportedConnectionTypes'] = self.connection_types
+            elif session is None:
+                reply['successful'] = False
+                reply['error'] = '402::Unknown client'
+                reply['advice'] = {'reconnect': self.reconnect_advice}
+            elif channel == '/meta/connect':
+                session.websocket = websocket
+                reply['advice'] = {'interval': 0,
+                    'timeout': int(self.connect_timeout * 1000)}
+                if session.queue:
+                    replies.extend(session.queue)
+                    session.queue = []
+                else:
+                    held = session
+                    continue
+            elif channel == '/meta/subscribe':
+                session.subscriptions.update(_channels(msg['subscription']))
+                reply['subscription'] = msg['subscription']
+            elif channel == '/meta/unsubscribe':
+                session.subscriptions.difference_update(
+                    _channels(msg['subscription']))
+                reply['subscription'] = msg['subscription']
+            elif channel == '/meta/disconnect':
+                del self.sessions[session.client_id]
+                if session.pending_connect is not None:
+                    self._release(session, session.pending_connect)
+            else:
+                self.publish(channel, msg.get('data'))
+            replies.append(reply)
+        if held is not None:
+            #The connect reply goes out once the hold is released
+            connect = [msg for msg in messages
+                if msg['channel'] == '/meta/connect'][0]
+            held.connect_reply = {'channel': '/meta/connect',
+                'id': connect.get('id'), 'successful': True,
+                'advice': {'interval': 0,
+                    'timeout': int(self.connect_timeout * 1000)}}
+        return replies, held
+
+    def publish(self, channel, data):
+        """Delivers data to every session subscribed to the channel."""
+        self.publish_many(channel, [data])
+
+    def publish_many(self, channel, data):
+        """Delivers several messages to every session subscribed to the
+        channel, in one response or websocket frame per session."""
+        events = [{'channel': channel, 'data': item} for item in data]
+        for session in self.sessions.values():
+            if channel in session.subscriptions:
+                websocket = session.websocket
+                if websocket is not None:
+                    if websocket.state == websocket.STATE_OPEN:
+                        websocket.sendMessage(json.dumps(events))
+                else:
+                    session.queue.extend(events)
+                    if session.pending_connect is not None:
+                        self._release(session, session.pending_connect)
+
+    def start_feed(self, channel, rate, payload_size=0, count=None):
+        """Starts publishing generated messages on a channel.
+
+        Args:
+            channel: The channel to publish on
+            rate: Messages per second
+            payload_size: Size in bytes of each message's payload
+            count: Number of messages to publish, None for no limit
+
+        Returns:
+            The started Feed
+        """
+        feed = Feed(self, channel, rate, payload_size, count)
+        self.feeds.append(feed)
+        feed.start()
+        return feed
+
+    def hold(self, session, respond):
+        """Holds a connect until there is data or it times out."""
+        session.pending_connect = respond
+        session.release_call = reactor.callLater(self.connect_timeout,
+            self._release, session, respond)
+
+    def _release(self, session, respond):
+        """Answers a held connect."""
+        if session.release_call.active():
+            session.release_call.cancel()
+        session.pending_connect = None
+        queue, session.queue = session.queue, []
+        respond(queue + [session.connect_reply])
+
+    def expire_sessions(self):
+        """Forgets every client, so their next messages are answered with
+        an unknown client error and the reconnect advice."""
+        for session in self.sessions.values():
+            if session.pending_connect is not None:
+                self._release(session, session.pending_connect)
+        self.sessions = {}
+
+    def close(self):
+        """Stops the feeds and answers every held connect so the server
+        can shut down."""
+        for feed in self.feeds:
+            feed.stop()
+        self.feeds = []
+        self.expire_sessions()
+
+class FakeWebSocketProtocol(WebSocketServerProtocol):
+    """Websocket side of the fake server."""
+    def onMessage(self, payload, isBinary):
+        server = self.factory.bayeux_server
+        if server.drop_rate and server.random.random() < server.drop_rate:
+            self.dropConnection(abort=True)
+            return
+        replies, held = server.handle(json.loads(payload), self)
+        if replies:
+            self.sendMessage(json.dumps(replies))
+        if held is not None:
+            def respond(queue):
+                if self.state == self.STATE_OPEN:
+                    self.sendMessage(json.dumps(queue))
+            server.hold(held, respond)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8080,
+        help='port to listen on, 0 for any free port')
+    parser.add_argument('--interface', default='127.0.0.1')
+    parser.add_argument('--connection-types', default='websocket,long-polling',
+        help='comma separated connection types to offer')
+    parser.add_argument('--connect-timeout', type=float, default=30,
+        help='seconds a connect is held waiting for messages')
+    parser.add_argument('--channel', action='append', default=[],
+        help='channel to feed, may be given more than once')
+    parser.add_argument('--rate', type=float, default=10,
+        help='messages per second on each fed channel')
+    parser.add_argument('--payload', type=int, default=64,
+        help='payload size in bytes of each fed message')
+    parser.add_argument('--count', type=int, default=None,
+        help='messages to publish on each fed channel')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--drop-rate', type=float, default=0)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--expire-every', type=float, default=0,
+        help='seconds between forgetting every client, 0 for never')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeBayeuxServer(args.connection_types.split(','),
+        args.connect_timeout, args.error_rate, args.drop_rate, args.latency,
+        args.seed)
+    port = reactor.listenTCP(args.port, Site(server),
+        interface=args.interface)
+    print port.getHost().port
+    sys.stdout.flush()
+    for channel in args.channel:
+        server.start_feed(channel, args.rate, args.payload, args.count)
+    if args.expire_every:
+        task.LoopingCall(server.expire_sessions).start(args.expire_every,
+            now=False)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
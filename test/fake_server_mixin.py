@@ -0,0 +1,73 @@
+"""Fixture shared by the trial tests that run a client against a
+FakeBayeuxServer."""
+from twisted.internet import reactor, task
+from twisted.web.server import Site
+
+from fake_bayeux_server import FakeBayeuxServer
+
+class FakeServerMixin(object):
+    """Runs fake servers for a test and shuts them down after it.
+
+    Mix it in ahead of unittest.TestCase, start servers with listen and
+    keep the client under test in self.client. tearDown stops the client
+    with stop_client, which test cases override for other clients, and
+    then the servers.
+
+    Attributes:
+        server: The last server started
+        port: The port the last server listens on
+        servers: Every server started, with its port
+        poll_interval: Time in seconds between the checks of wait_for
+    """
+    poll_interval = 0.01
+
+    def listen(self, **server_kwargs):
+        """Starts a fake server offering long-polling.
+
+        Args:
+            server_kwargs: Keyword arguments for the FakeBayeuxServer,
+                           overriding the defaults
+
+        Returns:
+            The url of the server
+        """
+        server_kwargs.setdefault('connection_types', ('long-polling',))
+        server_kwargs.setdefault('connect_timeout', 0.05)
+        self.server = FakeBayeuxServer(**server_kwargs)
+        self.port = reactor.listenTCP(0, Site(self.server),
+            interface='127.0.0.1')
+        if not hasattr(self, 'servers'):
+            self.servers = []
+        self.servers.append((self.server, self.port))
+        return 'http://127.0.0.1:%d/cometd' % self.port.getHost().port
+
+    def stop_client(self):
+        """Stops the client and closes its connections.
+
+        Returns:
+            A Deferred that fires once they are closed
+        """
+        self.client.stop()
+        #Let the disconnect go out before closing the connections
+        return task.deferLater(reactor, 0.1, self.client.sender.close)
+
+    def tearDown(self):
+        d = self.stop_client()
+        for server, port in getattr(self, 'servers', ()):
+            d.addCallback(lambda _, server=server: server.close())
+            d.addCallback(lambda _, port=port: port.stopListening())
+        return d.addCallback(lambda _: task.deferLater(reactor, 0.05,
+            lambda: None))
+
+    def wait_for(self, condition):
+        """Polls until condition is true."""
+        def poll():
+            if condition():
+                return
+            return task.deferLater(reactor, self.poll_interval, poll)
+        return poll()
+
+    def sent(self, channel):
+        """Returns the messages the servers received on a channel."""
+        return [msg for server, _ in getattr(self, 'servers', ())
+            for msg in server.received if msg.get('channel') == channel]